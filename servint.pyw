@@ -3,13 +3,20 @@
 """
 ServiceInterval
 Main script.
+Runs GUI. If command-line arguments specified - runs command-line interface
+(see servint_cli), tkinter is not imported in this case.
 """
-__author__ = 'Don D.S.'
+import sys
 
-import tkinter as tk
-from tk_gui import MainFrame
+__author__ = 'Don D.S.'
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import servint_cli
+        sys.exit(servint_cli.main())
+    # tk_gui imported first: it starts startup time trace.
+    from tk_gui import MainFrame
+    import tkinter as tk
     root = tk.Tk()
     app = MainFrame(master=root)
     app.pack()
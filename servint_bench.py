@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ServiceInterval
+Performance benchmarks with synthetic data.
+
+Runs without GUI (table population benchmark is skipped if there is no
+display). Results are printed and can be saved to JSON file and compared
+with previously stored baseline:
+
+$ python servint_bench.py --size 5000 --labels 50 -o results.json
+$ python servint_bench.py --baseline bench_baseline.json
+$ python servint_bench.py --save-baseline bench_baseline.json
+
+Exit status is 1 if some benchmark is slower than baseline more than
+tolerance allows.
+"""
+import argparse
+from datetime import date, timedelta
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from time import perf_counter
+import servint_utils as siu
+
+__author__ = 'Don D.S.'
+
+# Default synthetic book parameters.
+DEFAULT_SIZE = 2000
+DEFAULT_LABELS = 20
+DEFAULT_SEED = 42
+# Allowed slowdown relative to baseline (0.25 means 25%).
+DEFAULT_TOLERANCE = 0.25
+
+
+def make_operation_types(n_labels, seed=DEFAULT_SEED):
+    """ Create synthetic periodic operation types.
+
+    :param n_labels: number of unique operation labels
+    :param seed:     random generator seed
+    :return:         list of <Operation> class instances
+    """
+    rnd = random.Random(seed)
+    return [siu.Operation("Operation {:05d}: {}".format(
+                              i, rnd.choice(("engine", "gearbox", "brakes",
+                                             "suspension", "body"))),
+                          interval_km=rnd.choice((5000, 10000, 15000, 30000)),
+                          interval_year=rnd.choice((0.5, 1, 2, 3)))
+            for i in range(n_labels)]
+
+
+def make_log(size, n_labels, seed=DEFAULT_SEED):
+    """ Create synthetic operations log sorted by haul.
+
+    :param size:     number of operations in log
+    :param n_labels: number of unique operation labels
+    :param seed:     random generator seed
+    :return:         <OperationsList> of done operations
+    """
+    rnd = random.Random(seed)
+    types = make_operation_types(n_labels, seed)
+    day = date(2000, 1, 1)
+    km = 0
+    log = siu.OperationsList()
+    for i in range(size):
+        km += rnd.randint(0, 200)
+        day += timedelta(days=rnd.randint(0, 3))
+        log.append(rnd.choice(types).done(
+            km, day, "Price: {} RUR".format(rnd.randint(100, 10000))))
+    return log
+
+
+def make_book(size, n_labels, seed=DEFAULT_SEED):
+    """ Create synthetic vehicle log book.
+
+    :return: <VehicleLogBook> class instance
+    """
+    book = siu.VehicleLogBook("Synthetic vehicle", date(2000, 1, 1))
+    for op in make_log(size, n_labels, seed):
+        book.add_operation_to_log(op)
+    return book
+
+
+def measure(func, repeat):
+    """ Best time of several runs of function.
+
+    :param func:   function without arguments. It can return number of
+                   processed items (or None if it is unknown)
+    :param repeat: number of runs
+    :return:       (best time in seconds, number of processed items)
+    """
+    best = None
+    items = None
+    for _ in range(repeat):
+        t_start = perf_counter()
+        items = func()
+        elapsed = perf_counter() - t_start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, items
+
+
+def run(size=DEFAULT_SIZE, n_labels=DEFAULT_LABELS, repeat=5,
+        seed=DEFAULT_SEED):
+    """ Run all benchmarks.
+
+    :return:  dict: keys - benchmark names; values - dict with time in
+              seconds, number of processed items and items per second
+              (or reason of skipping)
+    """
+    results = dict()
+    types = make_operation_types(n_labels, seed)
+    log = make_log(size, n_labels, seed)
+    book = make_book(size, n_labels, seed)
+
+    def operation_create():
+        for i in range(size):
+            siu.Operation("Changing the oil: engine", 10000, 1)
+        return size
+
+    def operation_done():
+        op = types[0]
+        for i in range(size):
+            op.done(i, date(2015, 12, 5), "Price: 4000 RUR")
+        return size
+
+    def add_operation_to_log():
+        new_book = siu.VehicleLogBook("Vehicle", date(2000, 1, 1))
+        for op in log:
+            new_book.add_operation_to_log(op)
+        return size
+
+    def make_maintenance_plan():
+        n = 0
+        for i in range(100):
+            n += len(book.make_maintenance_plan())
+        return n
+
+    with tempfile.TemporaryDirectory() as tmp:
+        txt = os.path.join(tmp, "log.txt")
+        sif = os.path.join(tmp, "book" + siu.VehicleLogBook.get_extension())
+
+        def oplist_save():
+            log.save(txt)
+            return size
+
+        def oplist_load():
+            return len(siu.OperationsList.load(txt))
+
+        def import_log():
+            new_book = siu.VehicleLogBook("Vehicle", date(2000, 1, 1))
+            new_book.import_log(txt)
+            return len(new_book.operations_log)
+
+        def book_save():
+            book.save(sif)
+            return size
+
+        def book_load():
+            return len(siu.VehicleLogBook.load(sif).operations_log)
+
+        benchmarks = (operation_create, operation_done, add_operation_to_log,
+                      oplist_save, oplist_load, import_log,
+                      book_save, book_load, make_maintenance_plan)
+        for func in benchmarks:
+            seconds, items = measure(func, repeat)
+            results[func.__name__] = make_result(seconds, items)
+
+    results["table_population"] = bench_table_population(book, repeat)
+    return results
+
+
+def bench_table_population(book, repeat):
+    # Fill all GUI tables. Skipped if tkinter or display is unavailable.
+    try:
+        import tkinter as tk
+        import tk_gui
+        root = tk.Tk()
+    except Exception as err:
+        return {"skipped": str(err) or type(err).__name__}
+    try:
+        root.withdraw()
+        frame = tk.Frame(root)
+        doc = tk_gui.TkVehicleLogBook(
+            label="Vehicle", production_date=date(2000, 1, 1),
+            tab_log=tk_gui.OperationsTable(parent=frame),
+            tab_cat=tk_gui.PeriodicOperationsTable(parent=frame),
+            tab_plan=tk_gui.MaintenancePlanTable(parent=frame))
+        doc.log_book = book
+
+        def table_population():
+            doc.tabs_update()
+            return len(book.operations_log)
+        return make_result(*measure(table_population, repeat))
+    finally:
+        root.destroy()
+
+
+def make_result(seconds, items):
+    result = {"seconds": seconds, "items": items}
+    if items and seconds:
+        result["per_sec"] = items / seconds
+    return result
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Compare results with baseline.
+
+    :param results:   benchmark results (see run())
+    :param baseline:  benchmark results stored before
+    :param tolerance: allowed slowdown, i.e. 0.25 - 25%
+    :return:          list of (name, seconds, baseline seconds) for
+                      benchmarks slower than allowed
+    """
+    regressions = list()
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base or "seconds" not in result or "seconds" not in base:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append((name, result["seconds"], base["seconds"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Service Interval performance benchmarks.")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE,
+                        help="number of operations in synthetic log")
+    parser.add_argument("--labels", type=int, default=DEFAULT_LABELS,
+                        help="number of unique operation labels")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of runs of every benchmark")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="random generator seed")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="save results to JSON file")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare results with baseline JSON file")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="save results as baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown relative to baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.labels, args.repeat, args.seed)
+    report = {
+        "params": {"size": args.size, "labels": args.labels,
+                   "repeat": args.repeat, "seed": args.seed},
+        "python": platform.python_version(),
+        "version": siu.VERSION,
+        "results": results}
+
+    for name, result in sorted(results.items()):
+        if "skipped" in result:
+            print("{:<24} skipped: {}".format(name, result["skipped"]))
+        else:
+            print("{:<24} {:10.2f} ms {:14.0f} items/s".format(
+                name, result["seconds"] * 1000, result.get("per_sec", 0)))
+
+    for file in (args.output, args.save_baseline):
+        if file:
+            with open(file, 'w') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline.get("params") != report["params"]:
+            print("Warning: baseline was created with other parameters: " +
+                  str(baseline.get("params")), file=sys.stderr)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for name, seconds, base in regressions:
+            print("REGRESSION {}: {:.2f} ms, baseline {:.2f} ms".format(
+                name, seconds * 1000, base * 1000))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ServiceInterval
+Command-line interface. Works without tkinter, so it can be used on
+headless servers (i.e. in cron jobs).
+
+Examples of using:
+$ python -m servint_cli plan car.sif --haul 120500
+$ python -m servint_cli plan car.sif -o plan.txt
+$ python -m servint_cli import-log car.sif workshop.txt
+$ python -m servint_cli --encoding cp1251 import-log car.sif workshop.txt
+$ python -m servint_cli import-log fleet.sif fleet_export.txt --processes 0
+$ python -m servint_cli merge car.sif car_backup.sif
+$ python -m servint_cli follow car.sif workshop.txt
+$ python -m servint_cli --timing log history.txt
+$ python -m servint_cli log car.sif --since 2016-03-01 --until 2016-06-30
+$ python -m servint_cli fleet cars/*.sif --overdue
+$ python -m servint_cli report cars/ --within-days 30 -o report.html
+$ python -m servint_cli report cars/ --overdue --cache plans.db
+"""
+from time import perf_counter, sleep
+_START = perf_counter()  # measure startup time too
+
+import argparse
+import codecs
+from copy import copy
+from datetime import date, datetime
+import os
+import sys
+import servint_report
+import servint_utils as siu
+
+__author__ = 'Don D.S.'
+
+
+def open_book(file, production_date=None, encoding=None):
+    """ Open vehicle log book.
+
+    :param file:            file of <VehicleLogBook> (*.sif) or text file of
+                            operations log created by export
+    :param production_date: vehicle production date for books created from
+                            text files. Date of the first log record by
+                            default.
+    :param encoding:        encoding of text files without BOM
+    :return:                <VehicleLogBook> class instance
+    """
+    ext = os.path.splitext(file)[-1]
+    if ext == siu.VehicleLogBook.get_extension():
+        return siu.VehicleLogBook.load(file)
+    ops = siu.OperationsList.load(file, encoding)
+    if production_date is None:
+        dates = [op.done_at_date for op in ops if op.is_done]
+        production_date = min(dates) if dates else date.today()
+    label = os.path.splitext(os.path.basename(file))[0]
+    book = siu.VehicleLogBook(label, production_date)
+    for op in ops:
+        if op.is_done:
+            book.add_operation_to_log(op)
+        else:
+            book.add_operation_to_cat(op)
+    return book
+
+
+def print_operations(operations, file=None, encoding=None):
+    # Print operations in the same format as export to text file.
+    if file:
+        siu.OperationsList(operations).save(file, encoding)
+    else:
+        for op in operations:
+            print(op, end="\n\n")
+
+
+def cmd_plan(args):
+    book = open_book(args.book, args.production_date, args.encoding)
+    plan = book.make_maintenance_plan(args.haul, relative=not args.absolute)
+    print_operations(plan, args.output, args.encoding)
+
+
+def cmd_log(args):
+    book = open_book(args.book, args.production_date, args.encoding)
+    if args.since or args.until:
+        ops = book.log_between(args.since, args.until)
+    else:
+        ops = book.operations_log
+    print_operations(ops, args.output, args.encoding)
+
+
+def cmd_cat(args):
+    book = open_book(args.book, args.production_date, args.encoding)
+    # Operation types without last completion info.
+    cat = [copy(op) for op in book.operations_cat.values()]
+    for op in cat:
+        op.undo()
+    print_operations(cat, args.output, args.encoding)
+
+
+def cmd_import_log(args):
+    book = siu.VehicleLogBook.load(args.book)
+    stats = book.import_log(args.file, args.encoding,
+                            args.processes or None)
+    book.save()
+    print("Imported: {}".format(stats))
+    for op in stats.conflicts:
+        print("Conflicting (skipped):", op, sep="\n", end="\n\n")
+
+
+def cmd_import_cat(args):
+    book = siu.VehicleLogBook.load(args.book)
+    book.import_cat(args.file, args.encoding)
+    book.save()
+
+
+def cmd_merge(args):
+    book = siu.VehicleLogBook.load(args.book)
+    stats = book.merge(siu.VehicleLogBook.load(args.other))
+    book.save()
+    print("Merged: {}".format(stats))
+    for op in stats.conflicts:
+        print("Conflicting (skipped):", op, sep="\n", end="\n\n")
+
+
+def follow_pairs(book, files):
+    """ Pairs of (text file, log book file) to follow.
+
+    :param book:   log book file or directory of log books. For directory
+                   text file is imported into the book with the same name.
+    :param files:  text files or directories of text files (*.txt)
+    :return:       list of (<os.DirEntry> or file name, book file name)
+    """
+    ext = siu.VehicleLogBook.get_extension()
+    pairs = list()
+    for file in files:
+        if os.path.isdir(file):
+            # Entries keep file status: no extra system calls.
+            entries = [x for x in os.scandir(file)
+                       if x.name.endswith(".txt") and x.is_file()]
+        else:
+            entries = [file]
+        for entry in entries:
+            if os.path.isdir(book):
+                name = os.path.splitext(os.path.basename(entry))[0]
+                book_file = os.path.join(book, name + ext)
+                if not os.path.isfile(book_file):
+                    continue
+            else:
+                book_file = book
+            pairs.append((entry, book_file))
+    return pairs
+
+
+def cmd_follow(args):
+    books = dict()
+    while True:
+        for entry, book_file in follow_pairs(args.book, args.files):
+            book = books.get(book_file)
+            if book is None:
+                book = books[book_file] = siu.VehicleLogBook.load(book_file)
+            stat = entry.stat() if isinstance(entry, os.DirEntry) else None
+            stats = book.follow_log(entry, stat, args.encoding)
+            if stats.total:
+                print("{}: imported from {}: {}".format(
+                    book_file, os.fspath(entry), stats))
+            if book.is_modified:
+                book.save()
+        if args.once:
+            break
+        sleep(args.interval)
+
+
+def cmd_fleet(args):
+    # Import only when needed: multiprocessing slows down startup.
+    import servint_fleet
+    books = [open_book(file, args.production_date, args.encoding)
+             for file in args.books]
+    with servint_fleet.FleetPlan(books, args.processes) as fleet:
+        if args.overdue:
+            for book, op in fleet.overdue(args.date):
+                print("[{}]".format(book.label))
+                print(op, end="\n\n")
+        else:
+            for book, plan in zip(books, fleet.plans()):
+                print("[{}]".format(book.label))
+                print_operations(plan)
+
+
+def cmd_report(args):
+    # Books are loaded, filtered and written one by one.
+    def load(file):
+        return open_book(file, args.production_date, args.encoding)
+    if args.cache:
+        with servint_report.PlanCache(args.cache, load) as cache:
+            write_report(
+                args, servint_report.cached_plan_rows(args.books, cache,
+                                                      args.date))
+    else:
+        write_report(args, servint_report.plan_rows(
+            servint_report.iter_books(args.books, load), args.date))
+
+
+def write_report(args, rows):
+    # Filter rows and write report (see cmd_report).
+    if args.overdue:
+        rows = servint_report.overdue(rows)
+    if args.within_km is not None or args.within_days is not None:
+        rows = servint_report.due_within(rows, args.within_km,
+                                         args.within_days)
+    if args.label:
+        rows = servint_report.with_label(rows, args.label)
+    report_format = args.format
+    if report_format is None:
+        report_format = "html" if args.output and os.path.splitext(
+            args.output)[-1].lower() in (".html", ".htm") else "csv"
+    write = servint_report.write_html if report_format == "html" \
+        else servint_report.write_csv
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as fh:
+            write(rows, fh)
+    else:
+        write(rows, sys.stdout)
+
+
+def parse_date(text):
+    # Date argument in format YYYY-MM-DD or YYYY.MM.DD
+    try:
+        return datetime.strptime(text.replace('.', '-'), '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Wrong date format. It must be YYYY-MM-DD or YYYY.MM.DD, "
+            "not " + text)
+
+
+def parse_encoding(text):
+    # Encoding argument: name known by codecs module.
+    try:
+        return codecs.lookup(text).name
+    except LookupError:
+        raise argparse.ArgumentTypeError("Unknown encoding: " + text)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="servint",
+        description="Service Interval: vehicle maintenance planning.")
+    parser.add_argument(
+        "--timing", action="store_true",
+        help="print elapsed time (including startup) to stderr")
+    parser.add_argument(
+        "--stats", action="store_true",
+        help="print call statistics of log book methods to stderr")
+    parser.add_argument(
+        "--profile", metavar="FILE",
+        help="save cProfile profile of log book methods to file")
+    parser.add_argument(
+        "--encoding", metavar="NAME", type=parse_encoding,
+        help="encoding of text files (i.e. utf-8, cp1251). Files with byte "
+             "order mark are read in its encoding. System default by "
+             "default")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    def add_book_command(name, func, help_text):
+        cmd = commands.add_parser(name, help=help_text)
+        cmd.add_argument("book",
+                         help="log book file (*{}) or text export".format(
+                             siu.VehicleLogBook.get_extension()))
+        cmd.add_argument("-o", "--output", metavar="FILE",
+                         help="export to text file instead of printing")
+        cmd.add_argument("--production-date", type=parse_date,
+                         metavar="YYYY-MM-DD",
+                         help="vehicle production date for text exports")
+        cmd.set_defaults(func=func)
+        return cmd
+
+    cmd = add_book_command("plan", cmd_plan, "show maintenance plan")
+    cmd.add_argument("--haul", type=float, metavar="KM",
+                     help="current vehicle haul, km")
+    cmd.add_argument("--absolute", action="store_true",
+                     help="show absolute haul instead of relative to "
+                          "current")
+    cmd = add_book_command("log", cmd_log, "show operations history")
+    cmd.add_argument("--since", type=parse_date, metavar="YYYY-MM-DD",
+                     help="show operations done since this date only")
+    cmd.add_argument("--until", type=parse_date, metavar="YYYY-MM-DD",
+                     help="show operations done up to this date only")
+    add_book_command("cat", cmd_cat, "show periodic operations catalogue")
+    cmd = commands.add_parser(
+        "fleet", help="show maintenance plans of many vehicles")
+    cmd.add_argument("books", nargs="+",
+                     help="log book files (*{}) or text exports".format(
+                         siu.VehicleLogBook.get_extension()))
+    cmd.add_argument("--overdue", action="store_true",
+                     help="show overdue operations only")
+    cmd.add_argument("--date", type=parse_date, metavar="YYYY-MM-DD",
+                     help="date of overdue report (today by default)")
+    cmd.add_argument("--processes", type=int, metavar="N",
+                     help="number of worker processes (CPU count by "
+                          "default)")
+    cmd.add_argument("--production-date", type=parse_date,
+                     metavar="YYYY-MM-DD",
+                     help="vehicle production date for text exports")
+    cmd.set_defaults(func=cmd_fleet)
+
+    cmd = commands.add_parser(
+        "report", help="write maintenance report of many vehicles to CSV or "
+                       "HTML (books are processed one by one)")
+    cmd.add_argument("books", nargs="+",
+                     help="log book files (*{0}), directories of log books "
+                          "or text exports".format(
+                              siu.VehicleLogBook.get_extension()))
+    cmd.add_argument("-o", "--output", metavar="FILE",
+                     help="report file instead of printing")
+    cmd.add_argument("--format", choices=("csv", "html"),
+                     help="report format (by output file extension, CSV by "
+                          "default)")
+    cmd.add_argument("--overdue", action="store_true",
+                     help="report overdue operations only")
+    cmd.add_argument("--within-km", type=float, metavar="KM",
+                     help="report operations due within haul")
+    cmd.add_argument("--within-days", type=int, metavar="DAYS",
+                     help="report operations due within days")
+    cmd.add_argument("--label", metavar="TEXT",
+                     help="report operations with labels containing text")
+    cmd.add_argument("--date", type=parse_date, metavar="YYYY-MM-DD",
+                     help="date of report (today by default)")
+    cmd.add_argument("--cache", metavar="FILE",
+                     help="plan cache file: only books changed since the "
+                          "last report are loaded and planned")
+    cmd.add_argument("--production-date", type=parse_date,
+                     metavar="YYYY-MM-DD",
+                     help="vehicle production date for text exports")
+    cmd.set_defaults(func=cmd_report)
+
+    cmd = commands.add_parser(
+        "follow", help="import operations appended to text files into log "
+                       "book (files are polled)")
+    cmd.add_argument("book", help="log book file (*{0}) or directory of log "
+                                  "books: text file <name>.txt is imported "
+                                  "into book <name>{0}".format(
+                                      siu.VehicleLogBook.get_extension()))
+    cmd.add_argument("files", nargs="+", metavar="file",
+                     help="text file or directory of text files (*.txt)")
+    cmd.add_argument("--interval", type=float, default=5, metavar="SEC",
+                     help="polling interval, seconds (default: %(default)s)")
+    cmd.add_argument("--once", action="store_true",
+                     help="import once and exit (i.e. for cron jobs)")
+    cmd.set_defaults(func=cmd_follow)
+
+    for name, func, help_text in (
+            ("import-log", cmd_import_log,
+             "import operations history from text file into log book"),
+            ("import-cat", cmd_import_cat,
+             "import periodic operations catalogue from text file into "
+             "log book")):
+        cmd = commands.add_parser(name, help=help_text)
+        cmd.add_argument("book", help="log book file (*{})".format(
+            siu.VehicleLogBook.get_extension()))
+        cmd.add_argument("file", help="text file to import")
+        cmd.set_defaults(func=func)
+        if func is cmd_import_log:
+            cmd.add_argument(
+                "--processes", type=int, default=1, metavar="N",
+                help="number of processes parsing large file (default: "
+                     "%(default)s, 0 - CPU count)")
+
+    cmd = commands.add_parser(
+        "merge", help="merge operations history and catalogue of other log "
+                      "book into log book")
+    cmd.add_argument("book", help="log book file (*{})".format(
+        siu.VehicleLogBook.get_extension()))
+    cmd.add_argument("other", help="log book file to merge from")
+    cmd.set_defaults(func=cmd_merge)
+    return parser
+
+
+def print_stats(file=sys.stderr):
+    # Print call statistics of instrumented methods.
+    print("{:<40} {:>7} {:>11} {:>11} {:>9}".format(
+        "Method", "Calls", "Total, ms", "Max, ms", "Records"), file=file)
+    for name, st in sorted(siu.stats().items()):
+        print("{:<40} {:>7} {:>11.2f} {:>11.2f} {:>9}".format(
+            name, st["calls"], st["total"] * 1000, st["max"] * 1000,
+            st["items"]), file=file)
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.stats or args.profile:
+        siu.enable_stats(profile=bool(args.profile))
+    try:
+        args.func(args)
+    except (OSError, ValueError, TypeError) as err:
+        print("servint: error: {}".format(err), file=sys.stderr)
+        return 1
+    finally:
+        if args.stats:
+            print_stats()
+        if args.profile:
+            siu.STATS.dump_profile(args.profile)
+        if args.timing:
+            print("Elapsed: {:.1f} ms".format((perf_counter() - _START) * 1000),
+                  file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
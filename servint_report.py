@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ServiceInterval
+Fleet-wide maintenance reports built as pipeline of generators.
+
+Books are loaded, planned and written one at a time: memory is bounded by
+the largest book, and the first rows of report are written before the next
+books are loaded. Stages are generators of <ReportRow>:
+iter_books() -> plan_rows() -> filters (overdue(), due_within(),
+with_label()) -> write_csv() or write_html().
+Plans of books can be kept in persistent cache (see PlanCache), so only
+changed books are loaded and planned again: cached_plan_rows() replaces
+iter_books() -> plan_rows().
+
+Examples of using:
+>>> import io
+>>> from datetime import date
+>>> car = siu.VehicleLogBook("Car", date(2015, 1, 1))
+>>> car.add_operation_to_log(siu.Operation("Oil", 10000, 1).done(
+...     5000, date(2015, 6, 1)))
+>>> car.add_operation_to_log(siu.Operation("Belt", 60000, 4).done(
+...     5000, date(2015, 6, 1)))
+>>> rows = plan_rows([car], at_date=date(2016, 3, 1))
+>>> out = io.StringIO()
+>>> write_csv(due_within(rows, days=60), out)
+1
+>>> for line in out.getvalue().splitlines():
+...     print(line)
+vehicle,operation,km_left,date,days_left
+Car,Oil,15000.0,2016-03-29,28
+"""
+import csv
+from datetime import date, timedelta
+from html import escape
+from itertools import groupby
+import json
+import os
+import pickle
+import sqlite3
+import warnings
+import servint_utils as siu
+
+__author__ = 'Don D.S.'
+
+# Columns of CSV report.
+COLUMNS = ("vehicle", "operation", "km_left", "date", "days_left")
+# Version of plan cache database: cache of other version is cleared.
+CACHE_VERSION = 1
+# Errors of loading of broken or foreign files.
+LOAD_ERRORS = (OSError, ValueError, TypeError, EOFError,
+               pickle.UnpicklingError)
+
+
+class ReportRow(object):
+    """ Planned operation of vehicle in report.
+    """
+    __slots__ = ('vehicle', 'operation', 'km_left', 'date', 'days_left')
+
+    def __init__(self, vehicle, operation, km_left, plan_date, days_left):
+        """
+        :param vehicle:    vehicle label
+        :param operation:  operation label
+        :param km_left:    haul left to operation, km (negative if exceeded)
+        :param plan_date:  planned date as <datetime.date> or None
+        :param days_left:  days left to planned date (negative if expired)
+                           or None
+        """
+        self.vehicle = vehicle
+        self.operation = operation
+        self.km_left = km_left
+        self.date = plan_date
+        self.days_left = days_left
+
+    def fields(self):
+        # Values in order of COLUMNS.
+        return (self.vehicle, self.operation, self.km_left, self.date,
+                self.days_left)
+
+    def __repr__(self):
+        return "ReportRow({0}, {1}, km_left={2}, date={3})".format(
+            self.vehicle, self.operation, self.km_left, self.date)
+
+
+def iter_books(paths, load=siu.VehicleLogBook.load):
+    """ Load log books one by one. Books that can't be loaded are skipped
+    with warning.
+
+    :param paths:  files of log books or directories of them (*.sif,
+                   sorted by name)
+    :param load:   function that loads book from file
+    :return:       generator of <VehicleLogBook> class instances
+    """
+    for file in book_files(paths):
+        try:
+            book = load(file)
+        except LOAD_ERRORS as err:
+            warnings.warn("Log book {} skipped: {}".format(file, err),
+                          Warning)
+            continue
+        yield book
+
+
+def book_files(paths):
+    # Files of log books: files as is, directories are scanned for *.sif
+    # (sorted by name).
+    ext = siu.VehicleLogBook.get_extension()
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(entry.path for entry in os.scandir(path)
+                              if entry.name.endswith(ext) and entry.is_file())
+        else:
+            yield path
+
+
+def plan_rows(books, at_date=None):
+    """ Maintenance plans of books (see VehicleLogBook.make_maintenance_plan)
+    as rows of report. Rows of every book are sorted by planned date.
+
+    :param books:    iterable of <VehicleLogBook> class instances
+    :param at_date:  date of report as <datetime.date>. Today by default
+    :return:         generator of <ReportRow> class instances
+    """
+    if at_date is None:
+        at_date = date.today()
+    for book in books:
+        try:
+            plan = book.make_maintenance_plan()
+        except (TypeError, ValueError) as err:
+            warnings.warn("Log book {} skipped: {}".format(book.label, err),
+                          Warning)
+            continue
+        yield from _rows(book.label, plan, at_date)
+
+
+def _rows(vehicle, plan, at_date, haul=0):
+    # Report rows of plan sorted by planned date.
+    plan = sorted(plan, key=lambda x: (x.done_at_date or date.max,
+                                       x.done_at_km))
+    for op in plan:
+        plan_date = op.done_at_date
+        yield ReportRow(
+            vehicle, op.label, op.done_at_km - haul, plan_date,
+            (plan_date - at_date).days if plan_date else None)
+
+
+class PlanCache(object):
+    """ Persistent cache of maintenance plans of log book files (SQLite
+    database).
+
+    Plan is kept with fingerprint of book file: size, modification time and
+    inode (saving of book replaces the file). Book is loaded and planned
+    again only if its file is changed. Current haul is saved in book file,
+    so its change changes the fingerprint too. Plans are absolute (see
+    VehicleLogBook.make_maintenance_plan()), because they don't depend on
+    date of report.
+
+    Cache is written on close(), use it as context manager.
+    Use one cache file with the same load function (i.e. the same encoding
+    of text exports).
+    """
+
+    def __init__(self, filename, load=siu.VehicleLogBook.load):
+        """
+        :param filename:  file of cache database (created if missed)
+        :param load:      function that loads book from file
+        """
+        self._load = load
+        self._db = sqlite3.connect(filename)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS plans")
+            self._db.execute("PRAGMA user_version = {:d}".format(
+                CACHE_VERSION))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans (path TEXT PRIMARY KEY, "
+            "size INTEGER, mtime INTEGER, inode INTEGER, vehicle TEXT, "
+            "haul REAL, plan TEXT)")
+        # Fingerprints of all cached plans are read at once:
+        # keys - paths; values - (size, mtime, inode).
+        self._known = {row[0]: tuple(row[1:]) for row in self._db.execute(
+            "SELECT path, size, mtime, inode FROM plans")}
+        # Number of plans got from cache and computed.
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(file):
+        # Fingerprint of file: (size, modification time, inode).
+        st = os.stat(file)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, file):
+        """ Plan of log book file.
+
+        :param file:  file of log book
+        :return:      (vehicle label, haul, plan), where plan is list of
+                      <Operation> class instances with absolute haul
+        :raise:       errors of loading and planning of changed book
+        """
+        path = os.path.abspath(file)
+        fingerprint = self.fingerprint(path)
+        if self._known.get(path) == fingerprint:
+            vehicle, haul, plan = self._db.execute(
+                "SELECT vehicle, haul, plan FROM plans WHERE path = ?",
+                (path,)).fetchone()
+            self.hits += 1
+            return vehicle, haul, [
+                siu.Operation._from_fields(
+                    label, interval_km, timedelta(days=interval_days), km,
+                    date.fromordinal(day) if day else None, "", True)
+                for label, interval_km, interval_days, km, day
+                in json.loads(plan)]
+        book = self._load(file)
+        plan = book.make_maintenance_plan(relative=False)
+        self.misses += 1
+        self._db.execute(
+            "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path,) + fingerprint + (book.label, book.haul, json.dumps([
+                (op.label, op.interval_km,
+                 op.interval_time.total_seconds() / 86400,
+                 op.done_at_km,
+                 op.done_at_date.toordinal() if op.done_at_date else None)
+                for op in plan])))
+        self._known[path] = fingerprint
+        return book.label, book.haul, plan
+
+    def close(self):
+        # Write cache and close database.
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def cached_plan_rows(paths, cache, at_date=None):
+    """ Maintenance plans of log books as rows of report using plan cache
+    (the same rows as iter_books() -> plan_rows()). Books that can't be
+    loaded or planned are skipped with warning.
+
+    :param paths:    files of log books or directories of them
+    :param cache:    <PlanCache> class instance
+    :param at_date:  date of report as <datetime.date>. Today by default
+    :return:         generator of <ReportRow> class instances
+    """
+    if at_date is None:
+        at_date = date.today()
+    for file in book_files(paths):
+        try:
+            vehicle, haul, plan = cache.get(file)
+        except LOAD_ERRORS as err:
+            warnings.warn("Log book {} skipped: {}".format(file, err),
+                          Warning)
+            continue
+        yield from _rows(vehicle, plan, at_date, haul)
+
+
+def overdue(rows):
+    # Rows of overdue operations: planned date is reached or planned haul is
+    # exceeded.
+    for row in rows:
+        if row.km_left <= 0 or (row.days_left is not None
+                                and row.days_left <= 0):
+            yield row
+
+
+def due_within(rows, km=None, days=None):
+    """ Rows of operations due within haul or days (overdue operations
+    included).
+
+    :param km:    haul left, km. Not checked if None
+    :param days:  days left. Not checked if None
+    """
+    for row in rows:
+        if (km is not None and row.km_left <= km) or \
+                (days is not None and row.days_left is not None
+                 and row.days_left <= days):
+            yield row
+
+
+def with_label(rows, text):
+    # Rows of operations which labels contain text (case insensitive).
+    text = text.casefold()
+    for row in rows:
+        if text in row.operation.casefold():
+            yield row
+
+
+def write_csv(rows, file):
+    """ Write rows to CSV report incrementally.
+
+    :param rows:  iterable of <ReportRow> class instances
+    :param file:  file object opened in text mode with newline=""
+    :return:      number of written rows
+    """
+    writer = csv.writer(file)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row.fields())
+        count += 1
+    return count
+
+
+def write_html(rows, file, title="Maintenance report"):
+    """ Write rows to HTML report incrementally: table of every vehicle is
+    written as soon as its rows are produced.
+
+    :param rows:   iterable of <ReportRow> class instances (grouped by
+                   vehicle, as produced by plan_rows())
+    :param file:   file object opened in text mode
+    :param title:  report title
+    :return:       number of written rows
+    """
+    file.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+               '<title>{0}</title>\n</head>\n<body>\n<h1>{0}</h1>\n'.format(
+                   escape(title)))
+    count = 0
+    for vehicle, group in groupby(rows, key=lambda x: x.vehicle):
+        file.write("<h2>{}</h2>\n<table>\n<tr><th>Operation</th>"
+                   "<th>Km left</th><th>Date</th><th>Days left</th></tr>\n"
+                   .format(escape(vehicle)))
+        for row in group:
+            file.write("<tr><td>{}</td><td>{:.0f}</td><td>{}</td>"
+                       "<td>{}</td></tr>\n".format(
+                           escape(row.operation), row.km_left,
+                           row.date or "", "" if row.days_left is None
+                           else row.days_left))
+            count += 1
+        file.write("</table>\n")
+    file.write("<p>Total: {}</p>\n</body>\n</html>\n".format(count))
+    return count
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ServiceInterval
+Local HTTP server with JSON API over a directory of log books (*.sif).
+Uses standard library only (asyncio), so it can be run on any workshop
+computer without external services:
+
+$ python servint_server.py cars/ --port 8080
+
+API (GET requests only):
+/vehicles                     list of vehicles
+/vehicles/<id>/log            operations history (pages of books, that are
+                              not cached, are read without loading of the
+                              whole book). Query parameters:
+                              page, size - page of log (the first page
+                              is 0, 50 operations by default);
+                              since, until - dates range (YYYY-MM-DD);
+                              q - full-text search in labels and comments
+/vehicles/<id>/cat            periodic operations catalogue
+/vehicles/<id>/plan           maintenance plan. Query parameters:
+                              absolute=1 - absolute haul instead of
+                              relative to current
+/stats                        request latency percentiles
+
+Vehicle <id> is the log book file name without extension. Books are
+cached in memory and reloaded when the file is changed. Files are read
+by thread pool, so disk I/O doesn't block other requests.
+"""
+import argparse
+import asyncio
+from collections import deque
+from datetime import datetime
+import json
+import os
+import sys
+from time import perf_counter
+from urllib.parse import urlsplit, parse_qs, unquote
+import servint_utils as siu
+
+__author__ = 'Don D.S.'
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Default and maximal number of operations in page of log.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# Number of last requests used to compute latency percentiles.
+LATENCY_WINDOW = 10000
+# Limits of request size.
+MAX_LINE = 8192
+MAX_HEADERS = 100
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or REASONS[status])
+        self.status = status
+
+
+def operation_to_json(operation):
+    # JSON object of operation.
+    at_date = operation.done_at_date
+    return {"label": operation.label,
+            "interval_km": operation.interval_km,
+            "interval_days": operation.interval_time.days,
+            "is_done": operation.is_done,
+            "done_at_km": operation.done_at_km,
+            "done_at_date": at_date.isoformat() if at_date else None,
+            "comment": operation.comment}
+
+
+def percentile(values, percent):
+    """ Percentile of sorted values (nearest rank method).
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+class LatencyStats(object):
+    """ Latency of last requests by route.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._window = window
+        # keys - routes; values - deque of latencies, seconds
+        self._latency = dict()
+        # keys - routes; values - total number of requests
+        self._count = dict()
+
+    def add(self, route, seconds):
+        latency = self._latency.get(route)
+        if latency is None:
+            latency = self._latency[route] = deque(maxlen=self._window)
+        latency.append(seconds)
+        self._count[route] = self._count.get(route, 0) + 1
+
+    def report(self):
+        """ Latency percentiles of last requests by route, ms.
+
+        :return:  dict: keys - routes; values - dicts with count, p50, p90,
+                  p99 and max
+        """
+        report = dict()
+        for route, latency in self._latency.items():
+            values = sorted(latency)
+            report[route] = {"count": self._count[route]}
+            for name, percent in (("p50", 50), ("p90", 90), ("p99", 99),
+                                  ("max", 100)):
+                report[route][name] = round(percentile(values, percent) * 1000,
+                                            3)
+        return report
+
+
+class BookCache(object):
+    """ Log books of directory cached in memory.
+
+    Books are loaded by thread pool of event loop. Book is reloaded when
+    modification time of its file is changed.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        # keys - vehicle ids; values - (modification time, <VehicleLogBook>)
+        self._books = dict()
+        # Loads in progress: keys - vehicle ids; values - futures.
+        self._loading = dict()
+
+    def _path(self, vehicle):
+        return os.path.join(self._directory,
+                            vehicle + siu.VehicleLogBook.get_extension())
+
+    def _scan(self):
+        # Vehicle ids of all books in directory.
+        ext = siu.VehicleLogBook.get_extension()
+        return sorted(os.path.splitext(entry.name)[0]
+                      for entry in os.scandir(self._directory)
+                      if entry.is_file() and entry.name.endswith(ext))
+
+    async def vehicles(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._scan)
+
+    async def get(self, vehicle):
+        """ Get log book by vehicle id.
+
+        :raise HTTPError:  if there is no such book
+        """
+        if not vehicle or os.sep in vehicle or vehicle.startswith("."):
+            raise HTTPError(404, "Unknown vehicle: " + vehicle)
+        loop = asyncio.get_running_loop()
+        path = self._path(vehicle)
+        try:
+            mtime = (await loop.run_in_executor(None, os.stat, path)).st_mtime
+        except OSError:
+            self._books.pop(vehicle, None)
+            raise HTTPError(404, "Unknown vehicle: " + vehicle)
+        cached = self._books.get(vehicle)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        # Concurrent requests of the same book wait for one load.
+        future = self._loading.get(vehicle)
+        if future is None:
+            future = loop.run_in_executor(None, siu.VehicleLogBook.load, path)
+            self._loading[vehicle] = future
+            try:
+                book = await future
+            finally:
+                del self._loading[vehicle]
+            self._books[vehicle] = (mtime, book)
+            return book
+        return await future
+
+    def is_cached(self, vehicle):
+        return vehicle in self._books
+
+    async def read_page(self, vehicle, start, stop):
+        """ Read page of log from file without loading of the whole book
+        (see servint_utils.LogBookReader).
+
+        :return:  (number of records, list of operations) or None if file
+                  is saved by previous version
+        """
+        if not vehicle or os.sep in vehicle or vehicle.startswith("."):
+            raise HTTPError(404, "Unknown vehicle: " + vehicle)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self._read_page, self._path(vehicle), start, stop)
+
+    @staticmethod
+    def _read_page(path, start, stop):
+        try:
+            if not siu.LogBookReader.is_chunked(path):
+                return None
+            with siu.LogBookReader(path) as reader:
+                return len(reader), reader.read(start, stop)
+        except FileNotFoundError:
+            return None
+
+
+class Server(object):
+    """ HTTP/1.1 server with JSON API (see module description).
+    """
+
+    def __init__(self, directory):
+        self.books = BookCache(directory)
+        self.stats = LatencyStats()
+        self._routes = {"vehicles": self.get_vehicles,
+                        "log": self.get_log,
+                        "cat": self.get_cat,
+                        "plan": self.get_plan,
+                        "stats": self.get_stats}
+
+    async def get_vehicles(self, query):
+        ids = await self.books.vehicles()
+        # Load books concurrently.
+        books = await asyncio.gather(*(self.books.get(x) for x in ids),
+                                     return_exceptions=True)
+        vehicles = list()
+        for vehicle, book in zip(ids, books):
+            if isinstance(book, Exception):
+                # Removed or broken file.
+                continue
+            vehicles.append({
+                "id": vehicle,
+                "label": book.label,
+                "production_date": book.production_date.isoformat()
+                if book.production_date else None,
+                "haul": book.haul,
+                "log_size": len(book.operations_log),
+                "cat_size": len(book.operations_cat)})
+        return vehicles
+
+    async def get_log(self, query, vehicle):
+        page = int_arg(query, "page", 0)
+        size = min(int_arg(query, "size", PAGE_SIZE), MAX_PAGE_SIZE)
+        since = date_arg(query, "since")
+        until = date_arg(query, "until")
+        text = query.get("q", [""])[0]
+        if not (text or since or until) and not self.books.is_cached(vehicle):
+            # Read only records of the page.
+            result = await self.books.read_page(vehicle, page * size,
+                                                (page + 1) * size)
+            if result is not None:
+                total, ops = result
+                return {"total": total, "page": page, "size": size,
+                        "operations": [operation_to_json(op) for op in ops]}
+        book = await self.books.get(vehicle)
+        if text:
+            ops = book.search_log(text)
+            if since or until:
+                ops = [op for op in ops
+                       if (since is None or op.done_at_date >= since)
+                       and (until is None or op.done_at_date <= until)]
+        elif since or until:
+            ops = book.log_between(since, until)
+        else:
+            ops = book.operations_log
+        return {"total": len(ops), "page": page, "size": size,
+                "operations": [operation_to_json(op) for op in
+                               ops[page * size:(page + 1) * size]]}
+
+    async def get_cat(self, query, vehicle):
+        book = await self.books.get(vehicle)
+        cat = sorted(book.operations_cat.values(), key=lambda x: x.label)
+        return [operation_to_json(op) for op in cat]
+
+    async def get_plan(self, query, vehicle):
+        book = await self.books.get(vehicle)
+        absolute = query.get("absolute", ["0"])[0] not in ("0", "")
+        try:
+            plan = book.make_maintenance_plan(relative=not absolute)
+        except TypeError:
+            # Some periodic operation has never been done.
+            raise HTTPError(400, "Plan is unavailable: last completion of "
+                                 "some periodic operation is unknown")
+        return [operation_to_json(op) for op in plan]
+
+    async def get_stats(self, query):
+        return self.stats.report()
+
+    async def dispatch(self, method, target):
+        """ Get response to request.
+
+        :return:  (route name, JSON-serializable response)
+        """
+        url = urlsplit(target)
+        parts = [unquote(x) for x in url.path.split("/") if x]
+        query = parse_qs(url.query)
+        if parts == ["vehicles"] or parts == ["stats"]:
+            route, args = parts[0], ()
+        elif len(parts) == 3 and parts[0] == "vehicles" \
+                and parts[2] in ("log", "cat", "plan"):
+            route, args = parts[2], (parts[1],)
+        else:
+            raise HTTPError(404)
+        if method != "GET":
+            raise HTTPError(405)
+        return route, await self._routes[route](query, *args)
+
+    async def handle(self, reader, writer):
+        # Serve requests of one connection (keep-alive is supported).
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                started = perf_counter()
+                route = "error"
+                keep_alive = True
+                try:
+                    if len(line) > MAX_LINE:
+                        raise HTTPError(400)
+                    try:
+                        method, target, version = \
+                            line.decode("latin-1").split()
+                    except ValueError:
+                        raise HTTPError(400)
+                    keep_alive = version == "HTTP/1.1"
+                    for _ in range(MAX_HEADERS):
+                        header = await reader.readline()
+                        if header in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = header.decode("latin-1") \
+                            .partition(":")
+                        if name.strip().lower() == "connection":
+                            keep_alive = value.strip().lower() == "keep-alive"
+                    else:
+                        raise HTTPError(400)
+                    route, body = await self.dispatch(method, target)
+                    status = 200
+                except HTTPError as err:
+                    status, body = err.status, {"error": str(err)}
+                except Exception as err:
+                    # Broken book file, etc.
+                    status, body = 500, {"error": str(err)}
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    "HTTP/1.1 {} {}\r\n"
+                    "Content-Type: application/json; charset=utf-8\r\n"
+                    "Content-Length: {}\r\n"
+                    "Connection: {}\r\n\r\n".format(
+                        status, REASONS[status], len(data),
+                        "keep-alive" if keep_alive else "close")
+                    .encode("latin-1") + data)
+                await writer.drain()
+                self.stats.add(route, perf_counter() - started)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def int_arg(query, name, default):
+    # Non-negative integer query parameter.
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise HTTPError(400, "Parameter {} must be integer".format(name))
+    if value < 0:
+        raise HTTPError(400, "Parameter {} must be non-negative".format(name))
+    return value
+
+
+def date_arg(query, name):
+    # Date query parameter in format YYYY-MM-DD.
+    text = query.get(name, [""])[0]
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPError(400, "Parameter {} must be date YYYY-MM-DD"
+                        .format(name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="JSON API server over a directory of log books.")
+    parser.add_argument("directory", help="directory of log books (*{})"
+                        .format(siu.VehicleLogBook.get_extension()))
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="address to listen (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port to listen (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        parser.error("Directory not found: " + args.directory)
+    print("Serving {} at http://{}:{}/".format(
+        args.directory, args.host, args.port), file=sys.stderr)
+    try:
+        asyncio.run(Server(args.directory).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,23 +4,331 @@
 ServiceInterval
 Application implementation classes.
 """
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import codecs
+from collections import Counter, deque
 from copy import copy
 from datetime import date, timedelta
+from functools import wraps
+from hashlib import blake2b
+import io
+import locale
 from numbers import Number
 import os
 import pickle
 import re
+import struct
+import sys
+import threading
+from time import perf_counter
 import warnings
+import zlib
 
 __author__ = 'Don D.S.'
 
 # Version of ServiceInterval.
-VERSION = (1, 0)
+VERSION = (1, 1)
+# Number of log records in one chunk of log book file (see LogBookReader).
+CHUNK_RECORDS = 1024
+# Byte order marks of text files: (BOM, encoding). UTF-32-LE mark starts
+# with UTF-16-LE one, so it is checked first.
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'))
+
+
+class Stats(object):
+    """ Collector of instrumented methods call statistics.
+
+    Disabled by default: instrumented method costs only one attribute check.
+    Use module instance STATS or functions enable_stats(), stats() etc.
+
+    Examples of using:
+    >>> st = Stats()
+    >>> st.enable()
+    >>> st.record("load", 0.5, items=100)
+    >>> st.record("load", 1.5, items=300)
+    >>> st.report()["load"]
+    {'calls': 2, 'total': 2.0, 'max': 1.5, 'mean': 1.0, 'items': 400, 'items_per_call': 200.0}
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.enabled = False
+        # <cProfile.Profile> class instance if profiling enabled.
+        self.profiler = None
+        # Depth of nested instrumented calls: profiler switched on and off
+        # only by the outer call.
+        self._depth = 0
+        # keys - method names; values - [calls, total time, max time, items]
+        self._records = dict()
+
+    def enable(self, profile=False):
+        """ Start collecting statistics.
+
+        :param profile: if True - also capture cProfile profile of
+                        instrumented calls
+        """
+        if profile and self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        # Clear collected statistics and profile.
+        self._records.clear()
+        if self.profiler is not None:
+            self.profiler = None
+            self.enable(profile=True)
+
+    def record(self, name, elapsed, items=None):
+        """ Add one call to statistics.
+
+        :param name:     method name
+        :param elapsed:  call duration, seconds
+        :param items:    number of records processed by the call
+        """
+        rec = self._records.get(name)
+        if rec is None:
+            rec = self._records[name] = [0, 0.0, 0.0, 0]
+        rec[0] += 1
+        rec[1] += elapsed
+        if elapsed > rec[2]:
+            rec[2] = elapsed
+        if items:
+            rec[3] += items
+
+    def report(self):
+        """ Get collected statistics.
+
+        :return: dict: keys - method names; values - dict with number of
+                 calls, total, max and mean call time in seconds, number of
+                 processed records in total and per call.
+        """
+        return {name: {"calls": calls,
+                       "total": total,
+                       "max": max_time,
+                       "mean": total / calls,
+                       "items": items,
+                       "items_per_call": items / calls}
+                for name, (calls, total, max_time, items)
+                in self._records.items()}
+
+    def dump_profile(self, file):
+        # Save captured profile for pstats module.
+        if self.profiler is None:
+            raise ValueError("Profiling is not enabled.")
+        self.profiler.dump_stats(file)
+
+    def call(self, name, items, func, *args, **kwargs):
+        # Call function and record statistics.
+        profiler = self.profiler if self._depth == 0 else None
+        self._depth += 1
+        if profiler is not None:
+            profiler.enable()
+        t_start = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - t_start
+            if profiler is not None:
+                profiler.disable()
+            self._depth -= 1
+        self.record(name, elapsed, items(args, result) if items else None)
+        return result
+
+
+# Statistics of instrumented methods of this module.
+STATS = Stats()
+
+
+def enable_stats(profile=False):
+    STATS.enable(profile)
+
+
+def disable_stats():
+    STATS.disable()
+
+
+def reset_stats():
+    STATS.reset()
+
+
+def stats():
+    """ Get statistics of instrumented methods (see Stats.report()).
+    """
+    return STATS.report()
+
+
+def instrumented(items=None):
+    """ Decorator to collect method call statistics into STATS.
+
+    :param items: function (args, result) that returns number of records
+                  processed by the call. args - tuple of positional arguments.
+    """
+    def decorator(func):
+        name = func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not STATS.enabled:
+                return func(*args, **kwargs)
+            return STATS.call(name, items, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def undoable(func):
+    """ Decorator of <VehicleLogBook> methods that can be undone.
+
+    Changes of the book made by the method are recorded as inverse changes
+    (see VehicleLogBook._record()) and kept as one undo step. Nested calls
+    of decorated methods are parts of the outer step.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self._undo_depth:
+            return func(self, *args, **kwargs)
+        journal = self._journal = list()
+        self._undo_depth = 1
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self._undo_depth = 0
+            self._journal = None
+            if journal:
+                self._redo.clear()
+                self._push_step(self._undo, func.__name__, journal)
+    return wrapper
+
+
+def atomic_write(file, data):
+    """ Write file atomically: it has either old or new content even if
+    program or system crashes while writing.
+
+    Data is written to temporary file in the same directory, flushed to disk
+    and renamed to the target file.
+    :param file:  file name
+    :param data:  bytes
+    """
+    directory = os.path.dirname(os.path.abspath(file))
+    temp = "{}.{}.tmp".format(file, os.urandom(4).hex())
+    # Permissions of new file are the same as of open() (umask applied).
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if os.path.exists(file):
+            os.chmod(temp, os.stat(file).st_mode & 0o7777)
+        os.replace(temp, file)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        # Make rename durable (POSIX).
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def detect_encoding(data, encoding=None):
+    """ Detect encoding of text file by byte order mark (BOM).
+
+    >>> detect_encoding(codecs.BOM_UTF8 + b"text", "cp1251")
+    ('utf-8-sig', 3)
+    >>> detect_encoding(b"text", "cp1251")
+    ('cp1251', 0)
+
+    :param data:      bytes from the beginning of file
+    :param encoding:  encoding of file without BOM. Default is the same as
+                      of open()
+    :return:          (encoding, length of BOM)
+    """
+    for bom, bom_encoding in BOMS:
+        if data.startswith(bom):
+            return bom_encoding, len(bom)
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    return encoding, 0
+
+
+def _ascii_compatible(encoding):
+    # Check if encoding keeps ASCII characters as the same single bytes and
+    # isn't stateful, so records, dates and numbers can be found in bytes.
+    name = codecs.lookup(encoding).name
+    if name in ('utf-7', 'hz') or 'iso2022' in name:
+        return False
+    ascii_text = bytes(range(128))
+    try:
+        return ascii_text.decode('ascii').encode(name) == ascii_text
+    except UnicodeError:
+        return False
+
+
+class OperationType(object):
+    """ Type of service operation: label and intervals.
+
+    Shared by operations with the same label (i.e. all entries of vehicle
+    operations log), so renaming of operation and changing of its intervals
+    do not need to touch every entry. Values are validated by <Operation>
+    properties.
+    """
+    __slots__ = ('label', 'interval_km', 'interval_time')
+
+    def __init__(self, label="", interval_km=0.0, interval_time=timedelta()):
+        """
+        :param label:          operation label or description
+        :param interval_km:    operation interval by vehicle haul, km
+        :param interval_time:  operation interval time
+                               as <datetime.timedelta>
+        """
+        self.label = label
+        self.interval_km = interval_km
+        self.interval_time = interval_time
+
+    def __repr__(self):
+        return "OperationType({0}, interval_km={1}, interval_days={2})".format(
+            self.label, self.interval_km, self.interval_time.days)
+
+    def __getstate__(self):
+        # Interval time as days (<float>).
+        return (self.label, self.interval_km,
+                self.interval_time.total_seconds() / 86400)
+
+    def __setstate__(self, state):
+        if len(state) == 2:
+            # Saved by version 1.0: (None, dict of slots).
+            state = state[1]
+            state = (state['label'], state['interval_km'],
+                     state['interval_time'])
+        self.label, self.interval_km, interval_time = state
+        if not isinstance(interval_time, timedelta):
+            interval_time = timedelta(days=interval_time)
+        self.interval_time = interval_time
 
 
 class Operation(object):
     """ Represents service operation.
 
+    Operation is a view of shared <OperationType> (label and intervals) and
+    completion record (haul, date and comment). Operations created by done()
+    share operation type with the original one. Changing of label or
+    intervals gives the operation its own copy of type, other operations are
+    not changed (operations of log book are changed by
+    VehicleLogBook.edit_operation()).
+
     Examples of using:
     # Create an operation type.
     >>> oil_change = Operation("Changing the oil: engine",
@@ -48,6 +356,8 @@ class Operation(object):
     'Operation(Changing the oil: engine, interval_km=10000.0, interval_year=1.0)'
 
     """
+    __slots__ = ('_type', '_done_at_km', '_done_at_date', 'comment',
+                 '_is_done')
 
     def __init__(self, label, interval_km=0, interval_year=0, interval_month=0):
         """ Create service operation type.
@@ -61,9 +371,7 @@ class Operation(object):
         """
         super().__init__()
         # Initialize default values.
-        self._label = ""
-        self._interval_time = timedelta()
-        self._interval_km = 0
+        self._type = OperationType()
         # For done copy of this operation type.
         self._done_at_km = 0
         self._done_at_date = None
@@ -77,14 +385,42 @@ class Operation(object):
             days=365 * interval_year + 30.4 * interval_month)
         self.interval_km = interval_km
 
+    @classmethod
+    def _from_fields(cls, label, interval_km, interval_time,
+                     done_at_km=0.0, done_at_date=None, comment="",
+                     is_done=False):
+        """ Create operation from trusted values without validation.
+
+        For bulk creation of operations (parsing, planning). Values must
+        have proper types: label and comment - <str>, interval_km and
+        done_at_km - <float>, interval_time - <datetime.timedelta>,
+        done_at_date - <datetime.date> or None.
+        """
+        return cls._from_type(OperationType(label, interval_km, interval_time),
+                              done_at_km, done_at_date, comment, is_done)
+
+    @classmethod
+    def _from_type(cls, op_type, done_at_km=0.0, done_at_date=None,
+                   comment="", is_done=False):
+        """ Create operation of shared <OperationType> from trusted values
+        without validation (see _from_fields()).
+        """
+        op = cls.__new__(cls)
+        op._type = op_type
+        op._done_at_km = done_at_km
+        op._done_at_date = done_at_date
+        op.comment = comment
+        op._is_done = is_done
+        return op
+
     def done(self, km=0, date=None, comment=""):
         # Create a copy of this operation, that has been done and return it.
-        done = copy(self)
-        done.done_at_km = km
-        done.done_at_date = date
-        done.comment = comment
-        done._is_done = True
-        return done
+        # (operation type is shared with the copy)
+        return self._from_type(self._type,
+                               self._valid_km(km),
+                               self._valid_date(date),
+                               comment,
+                               True)
 
     def undo(self):
         # Clear information about operation completion
@@ -102,31 +438,39 @@ class Operation(object):
     def is_periodic(self):
         return self.interval_km != 0
 
+    @property
+    def op_type(self):
+        # Shared operation type: label and intervals.
+        return self._type
+
     @property
     def label(self):
-        return self._label
+        return self._type.label
 
     @label.setter
     def label(self, new_title):
         if isinstance(new_title, str):
-            self._label = new_title
+            # Copy on write: operation type may be shared.
+            self._type = OperationType(new_title, self._type.interval_km,
+                                       self._type.interval_time)
         else:
             raise TypeError("OperationType title must be a text string.")
 
     @property
     def interval_time(self):
-        return self._interval_time
+        return self._type.interval_time
 
     @interval_time.setter
     def interval_time(self, interval):
         if not isinstance(interval, timedelta):
             raise TypeError("Time must be represented as <datetime.timedelta>"
                             " class instance.")
-        self._interval_time = interval
+        self._type = OperationType(self._type.label, self._type.interval_km,
+                                   interval)
 
     @property
     def interval_km(self):
-        return self._interval_km
+        return self._type.interval_km
 
     @interval_km.setter
     def interval_km(self, new_interval):
@@ -137,7 +481,8 @@ class Operation(object):
         if new_interval < 0:
             raise ValueError("Operation interval must be positive. "
                              "Received value " + str(new_interval))
-        self._interval_km = new_interval
+        self._type = OperationType(self._type.label, new_interval,
+                                   self._type.interval_time)
 
     @property
     def done_at_km(self):
@@ -146,6 +491,10 @@ class Operation(object):
 
     @done_at_km.setter
     def done_at_km(self, new_km):
+        self._done_at_km = self._valid_km(new_km)
+
+    @staticmethod
+    def _valid_km(new_km):
         try:
             new_km = float(new_km)
         except ValueError:
@@ -156,7 +505,7 @@ class Operation(object):
         # if new_km < 0 and not relative:
         #     raise ValueError("Haul value must be positive. "
         #                      "Received value " + str(new_km))
-        self._done_at_km = new_km
+        return new_km
 
     @property
     def done_at_date(self):
@@ -164,14 +513,24 @@ class Operation(object):
 
     @done_at_date.setter
     def done_at_date(self, new_date):
-        if isinstance(new_date, date):
-            self._done_at_date = new_date
-        else:
+        self._done_at_date = self._valid_date(new_date)
+
+    @staticmethod
+    def _valid_date(new_date):
+        if not isinstance(new_date, date):
             raise TypeError("Date must be a <datetime.date> class instance.")
+        return new_date
 
     def __eq__(self, other):
+        if not isinstance(other, Operation):
+            return NotImplemented
         return self.label == other.label and self.done_at_km == other.done_at_km
 
+    def __hash__(self):
+        # Consistent with __eq__. Operation must not be changed while it is
+        # a key of dict or an item of set.
+        return hash((self.label, self.done_at_km))
+
     def __ne__(self, other):
         return not self == other
 
@@ -195,6 +554,30 @@ class Operation(object):
             TypeError("unorderable operations with different labels")
         return self.done_at_km > other.done_at_km
 
+    def __getstate__(self):
+        # Date as ordinal (None if missed).
+        done_at_date = self._done_at_date
+        return (self._type, self._done_at_km,
+                done_at_date.toordinal() if done_at_date else None,
+                self.comment, self._is_done)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Saved by version without operation types.
+            state = (OperationType(state['_label'],
+                                   state['_interval_km'],
+                                   state['_interval_time']),
+                     state['_done_at_km'],
+                     state['_done_at_date'],
+                     state['comment'],
+                     state['_is_done'])
+        (self._type, self._done_at_km, done_at_date,
+         self.comment, self._is_done) = state
+        # Version 1.0 saved date as <datetime.date>.
+        if isinstance(done_at_date, int):
+            done_at_date = date.fromordinal(done_at_date)
+        self._done_at_date = done_at_date
+
     def __repr__(self):
         if self.is_done:
             return "Operation({0}, interval_km={1}, interval_year={2}).done("\
@@ -235,6 +618,627 @@ class Operation(object):
                 prd_km=self.interval_km)
 
 
+class OdometerReadings(object):
+    """ Sorted series of vehicle odometer readings.
+
+    Allows to estimate vehicle haul at some date and the date when vehicle
+    reaches some haul. Readings are kept in two parallel lists sorted by date,
+    so both queries take O(log n) time. Haul values are made non-decreasing
+    (odometer can not go back), so the series can be searched by haul too.
+    Outside of the series values are extrapolated with average daily haul.
+
+    Examples of using:
+    >>> readings = OdometerReadings([(date(2015, 1, 1), 1000),
+    ...                              (date(2015, 1, 11), 2000)])
+    >>> readings.haul_at(date(2015, 1, 6))
+    1500.0
+    >>> readings.haul_at(date(2015, 1, 21))
+    3000.0
+    >>> readings.date_at(2500)
+    datetime.date(2015, 1, 16)
+    >>> print(readings.date_at(1e12))
+    None
+    """
+
+    def __init__(self, readings=()):
+        """
+        :param readings:  iterable of (<datetime.date>, haul in km) pairs
+                          in any order
+        """
+        super().__init__()
+        # Keep one reading per day: the biggest one.
+        by_day = dict()
+        for day, km in readings:
+            day = day.toordinal()
+            km = float(km)
+            if by_day.get(day, km) <= km:
+                by_day[day] = km
+        # Parallel lists: days as date ordinals and haul values.
+        self._days = sorted(by_day)
+        self._kms = list()
+        km_max = 0
+        for day in self._days:
+            km_max = max(km_max, by_day[day])
+            self._kms.append(km_max)
+
+    @classmethod
+    def from_series(cls, days, kms):
+        """ Create readings from series previously got by <series> property
+        without sorting and validation.
+
+        :param days:  list of date ordinals sorted in ascending order
+        :param kms:   list of non-decreasing haul values, km
+        """
+        readings = cls.__new__(cls)
+        readings._days = days
+        readings._kms = kms
+        return readings
+
+    @property
+    def series(self):
+        """ Readings as parallel lists: (date ordinals, haul values in km).
+        """
+        return self._days, self._kms
+
+    def __len__(self):
+        return len(self._days)
+
+    @property
+    def daily_haul(self):
+        """ Average haul per day, km. None if it can not be estimated.
+        """
+        if len(self._days) < 2 or self._days[-1] == self._days[0]:
+            return None
+        return (self._kms[-1] - self._kms[0]) / \
+               (self._days[-1] - self._days[0])
+
+    def haul_at(self, at_date):
+        """ Estimate vehicle haul at specified date.
+
+        :param at_date:  <datetime.date> class instance
+        :return:         haul, km. None if series is empty.
+        """
+        if not self._days:
+            return None
+        day = at_date.toordinal()
+        days = self._days
+        kms = self._kms
+        ind = bisect_right(days, day)
+        if 0 < ind < len(days):
+            # Interpolate between neighbour readings.
+            day_0, day_1 = days[ind - 1], days[ind]
+            km_0, km_1 = kms[ind - 1], kms[ind]
+            return km_0 + (km_1 - km_0) * (day - day_0) / (day_1 - day_0)
+        # Extrapolate outside of series.
+        rate = self.daily_haul or 0
+        if ind == 0:
+            return max(0.0, kms[0] - rate * (days[0] - day))
+        return kms[-1] + rate * (day - days[-1])
+
+    def date_at(self, km):
+        """ Estimate the date when vehicle reaches (or reached) specified haul.
+
+        :param km:  haul, km
+        :return:    <datetime.date> class instance. None if it can not be
+                    estimated (empty series, vehicle is not moving or the
+                    date is out of <datetime.date> range).
+        """
+        if not self._days:
+            return None
+        days = self._days
+        kms = self._kms
+        ind = bisect_left(kms, km)
+        if ind == len(kms):
+            # Extrapolate to the future.
+            rate = self.daily_haul
+            if not rate:
+                return None
+            day = days[-1] + (km - kms[-1]) / rate
+        elif ind == 0 or kms[ind] == km:
+            day = days[ind]
+        else:
+            # Interpolate between neighbour readings.
+            day_0, day_1 = days[ind - 1], days[ind]
+            km_0, km_1 = kms[ind - 1], kms[ind]
+            day = day_0 + (day_1 - day_0) * (km - km_0) / (km_1 - km_0)
+        day = int(round(day))
+        if not 1 <= day <= date.max.toordinal():
+            # Slow vehicle: extrapolated date is never reached.
+            return None
+        return date.fromordinal(day)
+
+
+class PrefixIndex(object):
+    """ Sorted set of strings for case-insensitive prefix search.
+
+    Search takes O(log n + k) time, adding and removing - O(log n) search
+    plus list items shift.
+
+    Examples of using:
+    >>> index = PrefixIndex(["Changing the oil: engine", "Brake pads",
+    ...                      "changing the oil: gearbox"])
+    >>> index.find("CHANGING")
+    ['Changing the oil: engine', 'changing the oil: gearbox']
+    >>> index.remove("Brake pads")
+    >>> index.add("Air filter")
+    >>> index.find("", limit=2)
+    ['Air filter', 'Changing the oil: engine']
+    """
+
+    def __init__(self, items=()):
+        super().__init__()
+        # Sorted list of (case-folded string, string)
+        self._keys = sorted((x.casefold(), x) for x in set(items))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, item):
+        insort(self._keys, (item.casefold(), item))
+
+    def remove(self, item):
+        key = (item.casefold(), item)
+        ind = bisect_left(self._keys, key)
+        if ind == len(self._keys) or self._keys[ind] != key:
+            raise ValueError("Item is not in index: " + item)
+        del self._keys[ind]
+
+    def find(self, prefix, limit=None):
+        """ Find strings started with prefix (case-insensitive).
+
+        :param prefix:  prefix string
+        :param limit:   max number of strings to return (None - all)
+        :return:        list of strings sorted case-insensitive
+        """
+        prefix = prefix.casefold()
+        keys = self._keys
+        start = bisect_left(keys, (prefix,))
+        stop = bisect_left(keys, (prefix + chr(0x10FFFF),), start)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return [keys[ind][1] for ind in range(start, stop)]
+
+
+class TextIndex(object):
+    """ Inverted index of words of operations labels and comments.
+
+    Words are case-insensitive. Operation matches a query if it contains all
+    query words; the last word of query may be incomplete (matches words
+    started with it), so index can be used for search as you type.
+    Operations are identified by identity: index must be updated by update()
+    after operation changes in place.
+
+    Examples of using:
+    >>> oil = Operation("Changing the oil: engine", 10000, 1).done(
+    ...     98042, date(2015, 12, 5), "Price: 4000 RUR")
+    >>> pads = Operation("Brake pads").done(
+    ...     99000, date(2016, 2, 1), "Part 58101-1CA00, price: 2500 RUR")
+    >>> index = TextIndex([oil, pads])
+    >>> [op.label for op in index.search("price RU")]
+    ['Changing the oil: engine', 'Brake pads']
+    >>> [op.label for op in index.search("58101-1ca00")]
+    ['Brake pads']
+    >>> index.remove(pads)
+    >>> index.search("brake")
+    []
+    """
+    _re_word = re.compile(r"\w+")
+
+    def __init__(self, operations=()):
+        super().__init__()
+        # keys - words; values - dict: keys - id(operation); values -
+        # operations
+        self._postings = dict()
+        # keys - id(operation); values - tuples of indexed words
+        self._words = dict()
+        for op in operations:
+            self._index(op)
+        # Sorted words for search by incomplete word.
+        self._vocabulary = PrefixIndex(self._postings)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, operation):
+        return id(operation) in self._words
+
+    @classmethod
+    def split(cls, text):
+        # Get list of case-folded words of text.
+        return cls._re_word.findall(text.casefold())
+
+    def _index(self, operation):
+        # Add operation to postings. Return list of new words.
+        words = set(self.split(operation.label))
+        words.update(self.split(operation.comment))
+        key = id(operation)
+        self._words[key] = tuple(words)
+        new_words = list()
+        for word in words:
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = dict()
+                new_words.append(word)
+            posting[key] = operation
+        return new_words
+
+    def add(self, operation):
+        for word in self._index(operation):
+            self._vocabulary.add(word)
+
+    def remove(self, operation):
+        # Remove operation by words indexed before (it can be changed since).
+        key = id(operation)
+        for word in self._words.pop(key, ()):
+            posting = self._postings[word]
+            del posting[key]
+            if not posting:
+                del self._postings[word]
+                self._vocabulary.remove(word)
+
+    def update(self, operation):
+        # Index operation changed in place again.
+        self.remove(operation)
+        self.add(operation)
+
+    def search(self, query):
+        """ Find operations with all words of query.
+
+        Takes time proportional to the number of operations with the
+        rarest query word (plus words started with the last one).
+        :param query:  text string
+        :return:       list of operations sorted by haul
+                       (empty list for empty query)
+        """
+        words = self.split(query)
+        if not words:
+            return []
+        postings = [self._postings.get(word, {}) for word in words[:-1]]
+        # The last word may be incomplete.
+        prefixed = self._vocabulary.find(words[-1])
+        if len(prefixed) == 1:
+            postings.append(self._postings[prefixed[0]])
+        else:
+            union = dict()
+            for word in prefixed:
+                union.update(self._postings[word])
+            postings.append(union)
+        postings.sort(key=len)
+        found = postings[0]
+        for posting in postings[1:]:
+            if not found:
+                break
+            found = {key: op for key, op in found.items() if key in posting}
+        return sorted(found.values(), key=lambda x: x.done_at_km or 0)
+
+
+class DateIndex(object):
+    """ Done operations ordered by completion date for date range queries.
+
+    Query takes O(log n + k) time, adding and removing - O(log n) search
+    plus list items shift.
+
+    Examples of using:
+    >>> oil = Operation("Changing the oil: engine", 10000, 1)
+    >>> index = DateIndex([oil.done(98042, date(2015, 12, 5)),
+    ...                    oil.done(108042, date(2016, 11, 5))])
+    >>> pads = Operation("Brake pads").done(99000, date(2016, 2, 1))
+    >>> index.add(pads)
+    >>> [op.done_at_km for op in index.between(date(2016, 1, 1))]
+    [99000.0, 108042.0]
+    >>> index.remove(pads)
+    >>> [op.done_at_km for op in index.between(end=date(2016, 6, 1))]
+    [98042.0]
+    """
+
+    def __init__(self, operations=()):
+        super().__init__()
+        # Operations sorted by date and their date ordinals.
+        self._ops = sorted(operations, key=lambda x: x.done_at_date)
+        self._days = [op.done_at_date.toordinal() for op in self._ops]
+
+    def __len__(self):
+        return len(self._ops)
+
+    def add(self, operation):
+        ind = bisect_right(self._days, operation.done_at_date.toordinal())
+        self._days.insert(ind, operation.done_at_date.toordinal())
+        self._ops.insert(ind, operation)
+
+    def remove(self, operation):
+        day = operation.done_at_date.toordinal()
+        start = bisect_left(self._days, day)
+        stop = bisect_right(self._days, day, start)
+        for ind in range(start, stop):
+            if self._ops[ind] is operation:
+                del self._days[ind]
+                del self._ops[ind]
+                return
+        raise ValueError("Operation is not in index: " + repr(operation))
+
+    def between(self, start=None, end=None):
+        """ Get operations done in date range.
+
+        :param start:  first date of range as <datetime.date> class instance
+                       (None - from the first operation)
+        :param end:    last date of range (inclusive). None - up to the last
+                       operation.
+        :return:       list of operations sorted by date
+        """
+        lo = 0 if start is None else bisect_left(self._days, start.toordinal())
+        hi = len(self._days) if end is None \
+            else bisect_right(self._days, end.toordinal(), lo)
+        return self._ops[lo:hi]
+
+
+class DedupIndex(object):
+    """ Index of done operations by record key to check in O(1) time if
+    imported operation is already in log.
+
+    Record key is (label, done km, done date, comment digest). Equal
+    operations (the same label and haul, see Operation.__eq__) with other
+    date or comment are conflicting.
+
+    Examples of using:
+    >>> oil = Operation("Changing the oil: engine", 10000, 1)
+    >>> index = DedupIndex([oil.done(98042, date(2015, 12, 5), "Castrol")])
+    >>> index.check(oil.done(98042, date(2015, 12, 5), "Castrol "))
+    'duplicate'
+    >>> index.check(oil.done(98042, date(2015, 12, 6), "Castrol"))
+    'conflicting'
+    >>> index.check(oil.done(108042, date(2016, 11, 5)))
+    'new'
+    """
+    NEW = "new"
+    DUPLICATE = "duplicate"
+    CONFLICTING = "conflicting"
+
+    def __init__(self, operations=()):
+        super().__init__()
+        # keys - record keys; values - number of operations
+        self._records = dict()
+        # keys - (label, done km); values - number of operations
+        self._equal = dict()
+        # Identities of indexed operations.
+        self._ids = set()
+        for op in operations:
+            self.add(op)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, operation):
+        return id(operation) in self._ids
+
+    @staticmethod
+    def key(operation):
+        # Record key of operation. Comment is compared without leading and
+        # trailing spaces (i.e. empty lines lost by export).
+        digest = blake2b(operation.comment.strip().encode("utf-8"),
+                         digest_size=8).digest()
+        return (operation.label, operation.done_at_km,
+                operation.done_at_date, digest)
+
+    def add(self, operation):
+        self._ids.add(id(operation))
+        key = self.key(operation)
+        self._records[key] = self._records.get(key, 0) + 1
+        key = key[:2]
+        self._equal[key] = self._equal.get(key, 0) + 1
+
+    def remove(self, operation):
+        self._ids.remove(id(operation))
+        key = self.key(operation)
+        for counts, key in ((self._records, key), (self._equal, key[:2])):
+            if counts[key] > 1:
+                counts[key] -= 1
+            else:
+                del counts[key]
+
+    def check(self, operation):
+        """ Check if operation is already in index.
+
+        :return:  NEW, DUPLICATE (the same record is in index) or
+                  CONFLICTING (equal operation with other date or comment is
+                  in index)
+        """
+        key = self.key(operation)
+        if key in self._records:
+            return self.DUPLICATE
+        if key[:2] in self._equal:
+            return self.CONFLICTING
+        return self.NEW
+
+
+class ImportStats(object):
+    """ Statistics of import of operations into log book.
+    """
+
+    def __init__(self):
+        # Number of added operations.
+        self.new = 0
+        # Number of skipped operations that are already in log (or in
+        # catalogue, or are never done and non-periodic).
+        self.duplicate = 0
+        # Skipped operations: equal operations in log have other date or
+        # comment.
+        self.conflicts = list()
+
+    @property
+    def conflicting(self):
+        return len(self.conflicts)
+
+    @property
+    def total(self):
+        return self.new + self.duplicate + self.conflicting
+
+    def __repr__(self):
+        return "ImportStats(new={}, duplicate={}, conflicting={})".format(
+            self.new, self.duplicate, self.conflicting)
+
+    def __str__(self):
+        return "{} new, {} duplicate, {} conflicting".format(
+            self.new, self.duplicate, self.conflicting)
+
+
+# Sort keys of operations by names of table columns.
+SORT_KEYS = {
+    "date": lambda op: op.done_at_date or date.min,
+    "km": lambda op: op.done_at_km,
+    "label": lambda op: op.label.casefold(),
+    "interval_km": lambda op: op.interval_km,
+    "interval_time": lambda op: op.interval_time,
+}
+
+
+class SortCache(object):
+    """ Sort permutations of a sequence by several keys.
+
+    Keys of items are computed once for every key name and permutations are
+    kept until invalidate() call, so sorting the same sequence again
+    (i.e. switching between table columns) costs nothing.
+    Key name with leading "-" means descending order.
+
+    Examples of using:
+    >>> cache = SortCache({"len": len, "str": str})
+    >>> items = ["bb", "a", "ab", "c"]
+    >>> cache.permutation(items, ("len", "str"))
+    [1, 3, 2, 0]
+    >>> cache.permutation(items, ("-len", "str"))
+    [2, 0, 1, 3]
+    >>> cache.ranks(items, ("len", "str"))
+    [3, 0, 2, 1]
+    """
+
+    def __init__(self, key_funcs=None):
+        """
+        :param key_funcs:  dict: keys - key names; values - functions of
+                           item. SORT_KEYS by default.
+        """
+        super().__init__()
+        self._key_funcs = SORT_KEYS if key_funcs is None else key_funcs
+        # keys - key names; values - lists of item keys
+        self._keys = dict()
+        # keys - tuples of key names; values - lists of item indexes
+        self._perms = dict()
+        # keys - tuples of key names; values - lists of item positions
+        # (inverse permutations)
+        self._ranks = dict()
+
+    def invalidate(self):
+        # Must be called after every change of sorted sequence.
+        self._keys.clear()
+        self._perms.clear()
+        self._ranks.clear()
+
+    def permutation(self, items, keys):
+        """ Get indexes of items in sorted order.
+
+        :param items:  sequence of items. It must be the same until
+                       invalidate() call.
+        :param keys:   key names from the most significant one
+        :return:       list of indexes. Do not modify it: it is cached.
+        """
+        keys = tuple(keys)
+        perm = self._perms.get(keys)
+        if perm is not None:
+            return perm
+        perm = list(range(len(items)))
+        # Stable sort by every key starting from the least significant one.
+        for name in reversed(keys):
+            reverse = name.startswith("-")
+            name = name.lstrip("-")
+            column = self._keys.get(name)
+            if column is None:
+                if name not in self._key_funcs:
+                    raise ValueError("Unknown sort key: " + name)
+                column = list(map(self._key_funcs[name], items))
+                self._keys[name] = column
+            perm.sort(key=column.__getitem__, reverse=reverse)
+        self._perms[keys] = perm
+        return perm
+
+    def ranks(self, items, keys):
+        """ Get positions of items in sorted order (inverse of
+        permutation()). Subset of items is sorted by them in O(k log k)
+        time: ranks[index] is the sort key.
+
+        :return:  list of positions. Do not modify it: it is cached.
+        """
+        keys = tuple(keys)
+        ranks = self._ranks.get(keys)
+        if ranks is None:
+            ranks = [0] * len(items)
+            for pos, ind in enumerate(self.permutation(items, keys)):
+                ranks[ind] = pos
+            self._ranks[keys] = ranks
+        return ranks
+
+
+# Text files smaller than this are parsed in the current process.
+MIN_PARALLEL_BYTES = 1 << 22
+# The least size of chunk of text file parsed by one task.
+MIN_CHUNK_BYTES = 1 << 20
+
+
+# Line break followed by empty line (LF or CRLF line breaks).
+_re_empty_line = re.compile(rb"\n\r?\n")
+
+
+def _text_chunks(data, start, chunk_size):
+    # Split bytes of text in format of OperationsList.save() to chunks of
+    # whole records: every chunk but the last ends with empty line.
+    # Return list of (start, end) positions.
+    chunks = list()
+    size = len(data)
+    while start < size:
+        end = start + chunk_size
+        if end >= size:
+            end = size
+        else:
+            match = _re_empty_line.search(data, end)
+            end = size if match is None else match.end()
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def _parse_chunk(task):
+    # Parse chunk of text file in worker process (see OperationsList.load()).
+    # Operations are packed to columns to be sent back faster: operation
+    # types as (label, interval km, interval time) tuples and arrays of
+    # type numbers, hauls and date ordinals (0 - operation isn't done) and
+    # list of comments.
+    # Error of parsing is returned to be raised by parent process: the pool
+    # is closed and joined before that (terminating of pool with queued
+    # tasks can hang).
+    import mmap
+    file, start, end, encoding = task
+    try:
+        with open(file, 'rb') as fh, \
+                mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ops = OperationsList._parse_data(data[start:end], encoding)
+    except Exception as err:
+        return err
+    # keys - identities of shared operation types
+    type_nums = dict()
+    types = list()
+    nums = array('I')
+    kms = array('d')
+    days = array('i')
+    for op in ops:
+        op_type = op.op_type
+        num = type_nums.get(id(op_type))
+        if num is None:
+            num = type_nums[id(op_type)] = len(types)
+            types.append((op_type.label, op_type.interval_km,
+                          op_type.interval_time))
+        nums.append(num)
+        kms.append(op.done_at_km)
+        days.append(op.done_at_date.toordinal() if op.is_done else 0)
+    return types, nums, kms, days, [op.comment for op in ops]
+
+
 class OperationsList(list):
     """ List inheritance with additional methods.
     Added save(), load() methods.
@@ -249,10 +1253,14 @@ class OperationsList(list):
     def __init__(self, seq=()):
         super().__init__(seq)
 
-    def save(self, file):
+    @instrumented(items=lambda args, result: len(args[0]))
+    def save(self, file, encoding=None):
         """ Create human-readable text file from list
+
+        :param encoding:  text encoding (i.e. 'utf-8-sig' to write BOM).
+                          Default is the same as of open()
         """
-        with open(file, 'w') as fh:
+        with open(file, 'w', encoding=encoding) as fh:
             for operation in self:
                 comm = operation.comment
                 # Remove empty string to prevent parsing errors on import
@@ -261,9 +1269,23 @@ class OperationsList(list):
                 print(operation, end="\n\n", file=fh)
 
     @staticmethod
-    def load(file):
+    @instrumented(items=lambda args, result: len(result))
+    def load(file, encoding=None, processes=1):
         """ Create <OperationList> class instance from file previously created
         by self.save() or created manually with the same formatting.
+        Encoding is detected by byte order mark (BOM) if file has it (see
+        loads()).
+
+        Large file in ASCII compatible encoding can be parsed by pool of
+        processes: memory-mapped file is split to chunks of whole records
+        (by empty lines), chunks are parsed in parallel and joined in the
+        original order. The result is the same as of one process.
+
+        :param encoding:   encoding of file without BOM. Default is the same
+                           as of open()
+        :param processes:  number of worker processes, None - CPU count.
+                           Files smaller than MIN_PARALLEL_BYTES are parsed
+                           in the current process.
 
         # Create test operation type.
         >>> oil_change = Operation("Changing the oil: engine",
@@ -298,14 +1320,238 @@ class OperationsList(list):
         >>> print(OperationsList.load('doctest.txt'))
         [Operation(Changing the oil: engine., interval_km=10000.0, interval_year=1.0)]
         """
-        # Regular expression that can detect, that operation has been done
-        re_done = re.compile(
-            r"(?P<yyyy>[0-9]{4})-(?P<mm>[0-9]{2})-(?P<dd>[0-9]{2})\s/\s(?P<km>[0-9.]+)\skm")
-        # Regular expression that can detect operation intervals line
-        re_interval = re.compile(
-            r"Every\s(?P<time>[0-9.]+)\s(?P<year_or_mon>[a-z()]+)\sor\s(?P<km>[0-9.]+)\skm")
+        if processes is not None and (not isinstance(processes, int)
+                                      or processes < 1):
+            raise ValueError("Number of processes must be positive integer.")
+        if processes is None or processes > 1:
+            with open(file, 'rb') as fh:
+                head = fh.read(4)
+                size = os.fstat(fh.fileno()).st_size
+            text_encoding, bom = detect_encoding(head, encoding)
+            if text_encoding == 'utf-8-sig':
+                text_encoding = 'utf-8'
+            if size >= MIN_PARALLEL_BYTES and \
+                    _ascii_compatible(text_encoding):
+                return OperationsList._load_parallel(file, text_encoding,
+                                                     bom, processes)
+        with open(file, 'rb') as fh:
+            return OperationsList.loads(fh.read(), encoding)
+
+    @staticmethod
+    def _load_parallel(file, encoding, start, processes):
+        # Parse text file by pool of processes (see load()). Text starts at
+        # position <start> (after BOM).
+        # Import only when needed: multiprocessing slows down startup.
+        import mmap
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        with open(file, 'rb') as fh, \
+                mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # A few tasks per worker to balance load.
+            chunks = _text_chunks(data, start, max(
+                MIN_CHUNK_BYTES, (len(data) - start) // (processes * 4)))
+        tasks = [(file, chunk_start, chunk_end, encoding)
+                 for chunk_start, chunk_end in chunks]
+        ops = OperationsList()
+        # Operation types are shared by operations of the whole file:
+        # keys - (label, interval_km, interval_time).
+        shared = dict()
+        # Dates by ordinals (0 - operation isn't done).
+        dates = {0: None}
+        from_type = Operation._from_type
+        error = None
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            # Chunks are joined while the next ones are parsed.
+            for result in pool.imap(_parse_chunk, tasks):
+                if isinstance(result, Exception):
+                    # Error of the first wrong record in file.
+                    error = result
+                    break
+                types, nums, kms, days, comments = result
+                types = [shared.setdefault(key, OperationType(*key))
+                         for key in types]
+                for day in set(days).difference(dates):
+                    dates[day] = date.fromordinal(day)
+                ops.extend(
+                    from_type(types[num], km, dates[day], comment, day != 0)
+                    for num, km, day, comment in zip(nums, kms, days,
+                                                     comments))
+        finally:
+            pool.close()
+            pool.join()
+        if error is not None:
+            raise error
+        return ops
+
+    @staticmethod
+    def loads(data, encoding=None):
+        """ Create <OperationList> class instance from bytes of text in
+        format of self.save().
+
+        Byte order mark (BOM) has priority over encoding. Text in ASCII
+        compatible encoding (UTF-8, Windows-1251, KOI8-R etc.) is parsed
+        without decoding of the whole text (see _parse_bytes()).
+
+        :param data:      bytes of text
+        :param encoding:  encoding of text without BOM. Default is the same
+                          as of open()
+        """
+        encoding, bom = detect_encoding(data, encoding)
+        if encoding == 'utf-8-sig':
+            data, encoding = data[bom:], 'utf-8'
+        return OperationsList._parse_data(data, encoding)
+
+    @staticmethod
+    def _parse_data(data, encoding):
+        # Parse bytes of text without BOM (see loads()).
+        if _ascii_compatible(encoding):
+            # Universal newlines as in text mode files.
+            lf_data = data.replace(b"\r\n", b"\n")
+            if b"\r" not in lf_data:
+                return OperationsList._parse_bytes(lf_data, encoding)
+        # Original text: i.e. '\r\r\n' is two line breaks.
+        return OperationsList.parse(
+            io.StringIO(data.decode(encoding), newline=None))
+
+    # Regular expression that can detect, that operation has been done
+    re_done = re.compile(
+        r"(?P<yyyy>[0-9]{4})-(?P<mm>[0-9]{2})-(?P<dd>[0-9]{2})\s/\s(?P<km>[0-9.]+)\skm")
+    # Regular expression that can detect operation intervals line
+    re_interval = re.compile(
+        r"Every\s(?P<time>[0-9.]+)\s(?P<year_or_mon>[a-z()]+)\sor\s(?P<km>[0-9.]+)\skm")
+    # Records in format of self.save() (bytes of ASCII compatible encoding
+    # with '\n' line breaks) followed by empty line: operation that has been
+    # done and operation that hasn't been done.
+    re_record_done = re.compile(
+        rb"([0-9]{4})-([0-9]{2})-([0-9]{2}) / ([0-9.]+) km\n"
+        rb"([^\n]+)\n"
+        rb"Every ([0-9.]+) (year\(s\)|month\(s\)) or ([0-9.]+) km\n"
+        rb"((?:[^\n]+\n)*)\n")
+    re_record = re.compile(
+        rb"([^\n]+)\n"
+        rb"Every ([0-9.]+) (year\(s\)|month\(s\)) or ([0-9.]+) km\n\n")
+
+    @staticmethod
+    def _parse_bytes(data, encoding):
+        """ Parse bytes of text in format of self.save() in ASCII compatible
+        encoding with '\n' line breaks. Records are found, dates and numbers
+        are parsed in bytes, only labels and comments are decoded. Records
+        of other shape are parsed by parse() with the same result.
+        """
+        ops = OperationsList()
+        # keys - (label, interval_km, interval_year, interval_month)
+        types = dict()
+        # The same types by bytes of (label, time, year_or_mon, interval_km).
+        raw_types = dict()
+        # Decoded labels, comments and dates. keys - bytes.
+        labels = dict()
+        dates = dict()
+        re_done = OperationsList.re_done
+        re_interval = OperationsList.re_interval
+        match_done = OperationsList.re_record_done.match
+        match_record = OperationsList.re_record.match
+        from_type = Operation._from_type
+
+        def text(raw):
+            # Decode label or comment. None if it looks like dates or
+            # intervals line: parse() would treat it other way.
+            decoded = labels.get(raw)
+            if decoded is None:
+                decoded = raw.decode(encoding)
+                if b"km" in raw and (re_done.search(decoded) or
+                                     re_interval.search(decoded)):
+                    return None
+                labels[raw] = decoded
+            return decoded
+
+        def op_type(fields):
+            # Operation type by bytes of (label, time, year_or_mon,
+            # interval_km). None if label can't be parsed here.
+            known = raw_types.get(fields)
+            if known is None:
+                label, time, year_or_mon, interval_km = fields
+                label = text(label)
+                if label is None:
+                    return None
+                interval_km = int(float(interval_km))
+                if year_or_mon == b"year(s)":
+                    interval_year, interval_month = float(time), 0
+                else:
+                    interval_year, interval_month = 0, float(time)
+                key = (label, interval_km, interval_year, interval_month)
+                known = types.get(key)
+                if known is None:
+                    known = types[key] = OperationType(
+                        label, float(interval_km), timedelta(
+                            days=365 * interval_year + 30.4 * interval_month))
+                raw_types[fields] = known
+            return known
+
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if data[pos] == 10:
+                # Empty line.
+                pos += 1
+                continue
+            op = None
+            match = match_done(data, pos)
+            try:
+                if match:
+                    known = op_type(match.group(5, 6, 7, 8))
+                    comment = match.group(9)
+                    comment = text(comment[:-1]) if comment else ""
+                    if known is not None and comment is not None:
+                        day = data[pos:pos + 10]
+                        done_at_date = dates.get(day)
+                        if done_at_date is None:
+                            done_at_date = dates[day] = date(
+                                int(day[:4]), int(day[5:7]), int(day[8:]))
+                        done_at_km = float(int(float(match.group(4))))
+                        op = from_type(known, done_at_km, done_at_date,
+                                       comment, True)
+                else:
+                    match = match_record(data, pos)
+                    if match:
+                        known = op_type(match.groups())
+                        if known is not None:
+                            op = from_type(known)
+            except ValueError:
+                # Wrong number or date: parse() raises the same error.
+                op = None
+            if op is not None:
+                ops.append(op)
+                pos = match.end()
+                continue
+            # Other shape: parse record as text.
+            end = data.find(b"\n\n", pos)
+            if end < 0:
+                # Incomplete record at the end: parse() skips it, but
+                # raises errors of its lines.
+                end = size - 2
+            ops.extend(OperationsList.parse(
+                io.StringIO(data[pos:end + 2].decode(encoding)), types))
+            pos = end + 2
+        return ops
+
+    @staticmethod
+    def parse(lines, types=None):
+        """ Create <OperationList> class instance from lines of text in format
+        of self.save(). Operation is parsed when empty line after it is met.
+
+        :param lines:  iterable of text lines (i.e. opened text file)
+        :param types:  shared operation types, keys - (label, interval_km,
+                       interval_year, interval_month). Updated by parsing.
+        """
+        re_done = OperationsList.re_done
+        re_interval = OperationsList.re_interval
         # Output variable
         ops = OperationsList()
+        # Shared operation types.
+        if types is None:
+            types = dict()
         # Operation arguments
         label = None
         interval_km = None
@@ -320,79 +1566,704 @@ class OperationsList(list):
         nline_done_first = None
         # Initialize storage
         line_previous = ""
-        with open(file, 'r') as fh:
-            for num, line in enumerate(fh):
-                line = line.strip('\n')
-                # At first line and after every empty line...
-                if line == "":
-                    # ...append previous operation to list (if exist)
-                    if label:  # (check by label - it is necessary argument)
-                        op = Operation(label,
-                                       interval_km,
-                                       interval_year,
-                                       interval_month)
-                        if is_done:
-                            op = op.done(done_at_km,
-                                         done_at_date,
-                                         comment)
-                        ops.append(op)
-                    # ... and reset operation args, flag, nlines - anyway
-                    # Operation arguments
-                    label = None
-                    interval_km = None
-                    interval_year = None
-                    interval_month = None
-                    done_at_km = None
-                    done_at_date = None
-                    comment = ""
-                    # Operation done flag
-                    is_done = False
-                    # Control line numbers
-                    nline_done_first = None
-                # Match with done-type operation
-                match_done = re_done.search(line)
-                if match_done:
-                    is_done = True
-                    done_at_km = int(float(match_done.group('km')))
-                    done_at_date = date(int(match_done.group('yyyy')),
-                                        int(match_done.group('mm')),
-                                        int(match_done.group('dd')))
-                    nline_done_first = num
-                # Next line after match_done line - is label
-                if is_done and num - 1 == nline_done_first:
-                    label = line
-                # Check for intervals line
-                match_interval = re_interval.search(line)
-                if match_interval:
-                    year_or_mon = match_interval.group('year_or_mon')
-                    if year_or_mon == "year(s)":
-                        interval_year = float(match_interval.group('time'))
-                        interval_month = 0
-                    elif year_or_mon == "month(s)":
-                        interval_year = 0
-                        interval_month = float(match_interval.group('time'))
+        for num, line in enumerate(lines):
+            line = line.strip('\n')
+            # At first line and after every empty line...
+            if line == "":
+                # ...append previous operation to list (if exist)
+                if label:  # (check by label - it is necessary argument)
+                    if interval_km is None:
+                        raise ValueError(
+                            "Intervals line missed for operation: \n" +
+                            label)
+                    key = (label, interval_km,
+                           interval_year, interval_month)
+                    op_type = types.get(key)
+                    if op_type is None:
+                        op_type = types[key] = OperationType(
+                            label, float(interval_km), timedelta(
+                                days=365 * interval_year +
+                                30.4 * interval_month))
+                    if is_done:
+                        op = Operation._from_type(
+                            op_type, float(done_at_km), done_at_date,
+                            comment, True)
                     else:
-                        raise ValueError("Unable to parse line: \n" + line)
-                    interval_km = int(float(match_interval.group('km')))
-
-                    if not is_done:
-                        label = line_previous
-                # Next line after label - is intervals. Already parsed.
-                # Next line after intervals - is comment
-                if is_done and num - 3 == nline_done_first:
-                    if comment:
-                        comment += "\n" + line
+                        op = Operation._from_type(op_type)
+                    ops.append(op)
+                # ... and reset operation args, flag, nlines - anyway
+                # Operation arguments
+                label = None
+                interval_km = None
+                interval_year = None
+                interval_month = None
+                done_at_km = None
+                done_at_date = None
+                comment = ""
+                # Operation done flag
+                is_done = False
+                # Control line numbers
+                nline_done_first = None
+            # Match with done-type operation
+            match_done = re_done.search(line)
+            if match_done:
+                is_done = True
+                done_at_km = int(float(match_done.group('km')))
+                done_at_date = date(int(match_done.group('yyyy')),
+                                    int(match_done.group('mm')),
+                                    int(match_done.group('dd')))
+                nline_done_first = num
+            # Next line after match_done line - is label
+            if is_done and num - 1 == nline_done_first:
+                label = line
+            # Check for intervals line
+            match_interval = re_interval.search(line)
+            if match_interval:
+                year_or_mon = match_interval.group('year_or_mon')
+                if year_or_mon == "year(s)":
+                    interval_year = float(match_interval.group('time'))
+                    interval_month = 0
+                elif year_or_mon == "month(s)":
+                    interval_year = 0
+                    interval_month = float(match_interval.group('time'))
+                else:
+                    raise ValueError("Unable to parse line: \n" + line)
+                interval_km = int(float(match_interval.group('km')))
+
+                if not is_done:
+                    label = line_previous
+            # Next line after label - is intervals. Already parsed.
+            # Next line after intervals - is comment
+            if is_done and num - 3 == nline_done_first:
+                if comment:
+                    comment += "\n" + line
+                else:
+                    comment = line
+                # Comment was the last part.
+                # For multiline comments...
+                nline_done_first += 1
+            # Keep previous line. We can detect operation that hasn't been
+            # done only from second string. In this case previous line will
+            # be used as label.
+            line_previous = line
+        return ops
+
+
+class FileTail(object):
+    """ Position of reading of growing text file of operations (format of
+    OperationsList.save()), to parse only records appended since the last
+    reading.
+
+    Only complete records (followed by empty line) are read. The end of the
+    last read record is kept to detect that file has been rewritten: in
+    this case it is read from the beginning again.
+    """
+    # Number of bytes before offset kept to detect rewriting of file.
+    tail_size = 256
+    # Encoding detected by byte order mark at the beginning of file (None
+    # if file has no BOM).
+    bom_encoding = None
+
+    def __init__(self, file):
+        self.file = file
+        # Offset of the end of the last read record, bytes.
+        self.offset = 0
+        # Bytes before offset.
+        self.tail = b""
+        # (inode, size, modification time) at the last reading.
+        self.stat = None
+        # True if file has been read from the beginning again at the last
+        # reading.
+        self.restarted = False
+
+    @staticmethod
+    def _key(stat):
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def changed(self, stat=None):
+        """ Check by file status (without reading) if file has been changed
+        since the last reading.
+
+        :param stat:  file status (i.e. from os.scandir()). Read if None.
+        """
+        if stat is None:
+            stat = os.stat(self.file)
+        return self._key(stat) != self.stat
+
+    def read(self, encoding=None):
+        """ Read records appended since the last reading. Only ASCII
+        compatible encodings are supported: records are found in bytes.
+
+        :param encoding:  encoding of file without BOM. Default is the same
+                          as of open()
+        :return:          <OperationsList> of new operations
+        """
+        with open(self.file, 'rb') as fh:
+            stat = os.fstat(fh.fileno())
+            self.restarted = False
+            if self.stat is not None and (
+                    stat.st_ino != self.stat[0] or stat.st_size < self.offset):
+                # Replaced or truncated.
+                self.restarted = True
+            elif self.offset:
+                fh.seek(self.offset - len(self.tail))
+                if fh.read(len(self.tail)) != self.tail:
+                    # Rewritten.
+                    self.restarted = True
+            if self.restarted:
+                self.offset = 0
+                self.tail = b""
+            fh.seek(self.offset)
+            data = fh.read(stat.st_size - self.offset)
+        self.stat = self._key(stat)
+        if not self.offset:
+            bom_encoding, bom = detect_encoding(data)
+            self.bom_encoding = bom_encoding if bom else None
+        encoding = self.bom_encoding or encoding or \
+            locale.getpreferredencoding(False)
+        if encoding != 'utf-8-sig' and not _ascii_compatible(encoding):
+            raise ValueError("Unable to follow file {} in {} encoding".format(
+                self.file, encoding))
+        # The end of the last complete record: empty line.
+        end = max(data.rfind(b"\n\n"), data.rfind(b"\n\r\n"))
+        if end < 0:
+            return OperationsList()
+        end = data.index(b"\n", end + 1) + 1
+        data = data[:end]
+        self.tail = (self.tail + data)[-self.tail_size:]
+        self.offset += end
+        return OperationsList.loads(data, encoding)
+
+
+class Autosaver(object):
+    """ Background saving of modified log books by worker thread.
+
+    Modified book is saved to recovery file next to the book file (see
+    recovery_file()) every <interval> seconds, the book file itself is not
+    changed. Recovery file is removed when the book is saved or changes are
+    discarded. Books that have never been saved are not autosaved.
+
+    Snapshot of book is taken without locks and without work in the main
+    thread: worker pickles the book, and the result is dropped if the book
+    has been changed meanwhile (see VehicleLogBook._changes) or if some
+    change was in progress. It is retried after <retry_interval> seconds.
+    """
+    suffix = ".autosave"
+    retry_interval = 1
+
+    def __init__(self, interval=60):
+        """
+        :param interval:  interval of saving, seconds
+        """
+        super().__init__()
+        self.interval = interval
+        # keys - id of book; values - [book, number of changes saved]
+        self._books = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # True if some book was changed while it was saved.
+        self._retry = False
+        # The last error of saving (i.e. <OSError>) or None.
+        self.error = None
+
+    @classmethod
+    def recovery_file(cls, file):
+        return file + cls.suffix
+
+    @classmethod
+    def has_recovery(cls, file):
+        # Check if recovery file is newer than the book file.
+        recovery = cls.recovery_file(file)
+        try:
+            return os.path.getmtime(recovery) >= os.path.getmtime(file)
+        except FileNotFoundError:
+            return os.path.exists(recovery)
+
+    @classmethod
+    def recover(cls, file):
+        """ Load autosaved book if recovery file is newer than the book file.
+
+        :param file:  book file
+        :return:      <VehicleLogBook> with unsaved changes or None
+        """
+        if not cls.has_recovery(file):
+            return None
+        book = VehicleLogBook.load(cls.recovery_file(file))
+        book._filename = file
+        book._modified = True
+        return book
+
+    def watch(self, book):
+        # Start autosaving of book.
+        with self._lock:
+            self._books.setdefault(id(book), [book, None])
+
+    def unwatch(self, book):
+        # Stop autosaving of book. Recovery file is kept.
+        with self._lock:
+            self._books.pop(id(book), None)
+
+    def discard(self, book):
+        # Stop autosaving of book and remove its recovery file.
+        self.unwatch(book)
+        if book.filename:
+            self._remove(self.recovery_file(book.filename))
+
+    @staticmethod
+    def _remove(file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def save_pending(self):
+        """ Save all modified books now (called by worker thread).
+
+        :return:  number of saved books
+        """
+        with self._lock:
+            items = list(self._books.values())
+        count = 0
+        self._retry = False
+        for item in items:
+            book, saved = item
+            file = book.filename
+            if not file:
+                continue
+            changes = book._changes
+            try:
+                if not book.is_modified:
+                    # Saved by user.
+                    self._remove(self.recovery_file(file))
+                    item[1] = changes
+                    continue
+                if saved == changes:
+                    continue
+                if book._undo_depth:
+                    self._retry = True
+                    continue
+                try:
+                    data = pickle.dumps(book, pickle.HIGHEST_PROTOCOL)
+                except Exception as err:
+                    # Book is pickled without lock: changing it meanwhile
+                    # can break pickling anyhow (i.e. dictionary changed
+                    # size, new label of operation isn't in packed types).
+                    if book._changes != changes or book._undo_depth:
+                        self._retry = True
                     else:
-                        comment = line
-                    # Comment was the last part.
-                    # For multiline comments...
-                    nline_done_first += 1
-                # Keep previous line. We can detect operation that hasn't been
-                # done only from second string. In this case previous line will
-                # be used as label.
-                line_previous = line
+                        self.error = err
+                    continue
+                if book._changes != changes or book._undo_depth:
+                    self._retry = True
+                    continue
+                atomic_write(self.recovery_file(file), data)
+            except OSError as err:
+                self.error = err
+                continue
+            item[1] = changes
+            count += 1
+        return count
+
+    def _run(self):
+        while not self._stop.wait(
+                min(self.retry_interval, self.interval) if self._retry
+                else self.interval):
+            self.save_pending()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="autosave", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Stop worker thread (waits for saving in progress).
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+def _pack_records(ops, type_nums):
+    # Pack done operations to columns: type numbers, hauls and date ordinals
+    # as bytes of little-endian arrays and list of comments.
+    # type_nums - dict of numbers of operation types: keys - labels.
+    try:
+        nums = [type_nums[op.label] for op in ops]
+    except KeyError as err:
+        raise ValueError(
+            "Operation {} isn't registered in log book: operations of log "
+            "book must be changed by VehicleLogBook.edit_operation()."
+            .format(err)) from None
+    columns = (array('I', nums),
+               array('d', [op.done_at_km for op in ops]),
+               array('i', [op.done_at_date.toordinal() for op in ops]))
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    return tuple(column.tobytes() for column in columns) + (
+        [op.comment for op in ops],)
+
+
+def _unpack_columns(records):
+    # Arrays of columns packed by _pack_records() and list of comments.
+    columns = list()
+    for code, data in zip('Idi', records):
+        column = array(code)
+        column.frombytes(data)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column)
+    return columns + [records[3]]
+
+
+def _unpack_records(records, types):
+    # Done operations from columns packed by _pack_records().
+    # types - list of <OperationType> class instances.
+    fromordinal = date.fromordinal
+    from_type = Operation._from_type
+    return [from_type(types[type_num], km, fromordinal(day), comment, True)
+            for type_num, km, day, comment in zip(*_unpack_columns(records))]
+
+
+def _unpack_types(types):
+    # Operation types from (label, interval km, interval days) tuples.
+    return [OperationType(label, interval_km, timedelta(days=interval_days))
+            for label, interval_km, interval_days in types]
+
+
+def _pack_book(types, log, cat, records=True):
+    """ Pack operation types, catalogue and log of book (state of version
+    1.1). Types are saved as (label, interval km, interval days) tuples,
+    catalogue operations - as (label, type number, km, date ordinal, comment,
+    is done, number of the same operation in log or None) tuples, log - as
+    columns (see _pack_records()).
+
+    :param types:    list of <OperationType> class instances shared by
+                     operations
+    :param log:      list of done <Operation> class instances sorted by haul
+    :param cat:      catalogue: dict of <Operation> class instances, keys -
+                     labels
+    :param records:  if False, log records are not packed (i.e. saved in
+                     chunks by VehicleLogBook.dumps())
+    :return:         dict with keys 'types', 'cat' and 'log'
+    """
+    type_nums = {op_type.label: num for num, op_type in enumerate(types)}
+    log_nums = {id(op): num for num, op in enumerate(log)}
+    state = {
+        'types': [op_type.__getstate__() for op_type in types],
+        'cat': [(label, type_nums[label], op.done_at_km,
+                 op.done_at_date.toordinal() if op.done_at_date else None,
+                 op.comment, op.is_done, log_nums.get(id(op)))
+                for label, op in cat.items()]}
+    if records:
+        state['log'] = _pack_records(log, type_nums)
+    return state
+
+
+def _unpack_book(state):
+    """ Unpack operation types, catalogue and log packed by _pack_book().
+
+    :return:  (dict of <OperationType>, log as <OperationsList>, dict of
+              catalogue, dict of counts of labels in log), keys of dicts -
+              labels
+    """
+    types = _unpack_types(state['types'])
+    log = OperationsList(_unpack_records(state['log'], types))
+    type_nums = _unpack_columns(state['log'])[0]
+    log_refs = {types[type_num].label: count
+                for type_num, count in Counter(type_nums).items()}
+    cat = dict()
+    for label, type_num, km, day, comment, is_done, num in state['cat']:
+        if num is not None:
+            # The same operation as in log.
+            cat[label] = log[num]
+        else:
+            cat[label] = Operation._from_type(
+                types[type_num], km,
+                date.fromordinal(day) if day is not None else None,
+                comment, is_done)
+    return {op_type.label: op_type for op_type in types}, log, cat, log_refs
+
+
+def _upgrade_state_1_0(state):
+    # Version 1.0 saved book as dict of fields with log and catalogue of
+    # <Operation> class instances.
+    state = dict(state)
+    log = state.pop('_operations_log')
+    cat = state.pop('_operations_cat')
+    op_types = state.pop('_op_types', None)
+    if op_types is None:
+        # Every operation had own copy of label and intervals: the first
+        # one is shared, catalogue intervals are actual.
+        op_types = dict()
+        for op in log:
+            op_types.setdefault(op.label, op.op_type)
+        for op in cat.values():
+            op_type = op_types.setdefault(op.label, op.op_type)
+            op_type.interval_km = op.interval_km
+            op_type.interval_time = op.interval_time
+    for name in VehicleLogBook._unsaved:
+        state.pop(name, None)
+    state.update(_pack_book(list(op_types.values()), log, cat))
+    return state
+
+
+# Upgrades of saved state of <VehicleLogBook>: keys - version of state;
+# values - (next version, function that converts state to next version).
+STATE_UPGRADES = {
+    (1, 0): ((1, 1), _upgrade_state_1_0),
+}
+
+
+class ChunkError(ValueError):
+    """ Checksum of chunk of log book file (see LogBookReader) mismatch.
+    """
+
+    def __init__(self, file, chunk, first=None, count=None):
+        if first is None:
+            where = "header"
+        else:
+            where = "records {}-{}".format(first, first + count - 1)
+        super().__init__("File {} is corrupted: chunk {} ({})".format(
+            file, chunk, where))
+        self.file = file
+        self.chunk = chunk
+        # Numbers of records in log lost with chunk (None for header).
+        self.first = first
+        self.count = count
+
+
+class LogBookReader(object):
+    """ Random access to log book file saved in chunked layout.
+
+    Layout: magic line, header chunk (book fields, operation types and
+    catalogue), chunks of log records sorted by haul (CHUNK_RECORDS records
+    in every chunk), index of chunks and trailer with index offset. Index
+    keeps offset, size, CRC-32 checksum, the first record number and ranges
+    of haul and dates of every chunk, so records by number, haul or date
+    range are read without decoding of other chunks. Corrupted chunk is
+    detected by checksum and reported with numbers of lost records.
+
+    Examples of using:
+    >>> book = VehicleLogBook("Car", date(2015, 1, 1))
+    >>> oil = Operation("Changing the oil: engine", 10000, 1)
+    >>> for km in range(0, 50000, 10000):
+    ...     book.add_operation_to_log(
+    ...         oil.done(km, date(2015, 1, 1) + timedelta(days=km // 50)))
+    >>> book.save("doctest.sif")
+    >>> with LogBookReader("doctest.sif") as reader:
+    ...     [op.done_at_km for op in reader.read(1, 3)]
+    ...     [op.done_at_date for op in reader.between_dates(
+    ...         date(2015, 6, 1), date(2015, 9, 1))]
+    [10000.0, 20000.0]
+    [datetime.date(2015, 7, 20)]
+    """
+    # Magic line at the beginning of file.
+    magic = b"ServiceInterval log book\n"
+    # Trailer: index offset, index size, index CRC-32 and magic.
+    trailer = struct.Struct("<QII8s")
+    trailer_magic = b"SIFINDEX"
+
+    def __init__(self, file):
+        """
+        :param file:  log book file (*.sif)
+        """
+        super().__init__()
+        self.file = file
+        self._fh = open(file, 'rb')
+        try:
+            if self._fh.read(len(self.magic)) != self.magic:
+                raise ValueError(
+                    "File {} is not a chunked log book".format(file))
+            self._fh.seek(-self.trailer.size, os.SEEK_END)
+            offset, size, crc, magic = self.trailer.unpack(
+                self._fh.read(self.trailer.size))
+            if magic != self.trailer_magic:
+                raise ValueError("File {} is truncated".format(file))
+            self._fh.seek(offset)
+            data = self._fh.read(size)
+            if zlib.crc32(data) != crc:
+                raise ValueError("File {} is corrupted: index".format(file))
+            # Header chunk: (offset, size, crc).
+            # Log chunks: (offset, size, crc, first record, number of records,
+            # min km, max km, min date ordinal, max date ordinal).
+            self._header_chunk, self._chunks = pickle.loads(data)
+        except BaseException:
+            self._fh.close()
+            raise
+        self._firsts = [chunk[3] for chunk in self._chunks]
+        self._header = None
+        self._types = None
+
+    @classmethod
+    def is_chunked(cls, file):
+        # Check if file is saved in chunked layout.
+        with open(file, 'rb') as fh:
+            return fh.read(len(cls.magic)) == cls.magic
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        # Number of records in log.
+        if not self._chunks:
+            return 0
+        return self._chunks[-1][3] + self._chunks[-1][4]
+
+    def _read(self, offset, size, crc, chunk, first=None, count=None):
+        self._fh.seek(offset)
+        data = self._fh.read(size)
+        if zlib.crc32(data) != crc:
+            raise ChunkError(self.file, chunk, first, count)
+        return pickle.loads(data)
+
+    def header(self):
+        """ Book fields, operation types and catalogue (decoded once).
+
+        :return:  dict (see VehicleLogBook.dumps())
+        """
+        if self._header is None:
+            self._header = self._read(*self._header_chunk, chunk=0)
+            self._types = _unpack_types(self._header["types"])
+        return self._header
+
+    def records(self, chunk):
+        """ Decode records of chunk.
+
+        :param chunk:  chunk number (the first chunk of log is 1)
+        :return:       list of <Operation> class instances sorted by haul
+        :raise ChunkError:  if chunk is corrupted
+        """
+        self.header()
+        offset, size, crc, first, count = self._chunks[chunk - 1][:5]
+        return _unpack_records(
+            self._read(offset, size, crc, chunk, first, count), self._types)
+
+    def read(self, start=0, stop=None):
+        """ Read records [start, stop) of log sorted by haul.
+
+        :return:  list of <Operation> class instances
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        ops = list()
+        if start >= stop:
+            return ops
+        chunk = bisect_right(self._firsts, start)
+        while chunk <= len(self._chunks) and self._firsts[chunk - 1] < stop:
+            first = self._firsts[chunk - 1]
+            ops.extend(self.records(chunk)[max(0, start - first):stop - first])
+            chunk += 1
+        return ops
+
+    def between_km(self, low=None, high=None):
+        """ Read records done in haul range (inclusive).
+
+        :return:  list of <Operation> class instances sorted by haul
+        """
+        ops = list()
+        for chunk, fields in enumerate(self._chunks, 1):
+            km_min, km_max = fields[5:7]
+            if (low is None or km_max >= low) \
+                    and (high is None or km_min <= high):
+                ops.extend(op for op in self.records(chunk)
+                           if (low is None or op.done_at_km >= low)
+                           and (high is None or op.done_at_km <= high))
+        return ops
+
+    def between_dates(self, start=None, end=None):
+        """ Read records done in date range (inclusive).
+
+        :return:  list of <Operation> class instances sorted by date
+        """
+        low = start.toordinal() if start else None
+        high = end.toordinal() if end else None
+        ops = list()
+        for chunk, fields in enumerate(self._chunks, 1):
+            day_min, day_max = fields[7:9]
+            if (low is None or day_max >= low) \
+                    and (high is None or day_min <= high):
+                ops.extend(op for op in self.records(chunk)
+                           if (start is None or op.done_at_date >= start)
+                           and (end is None or op.done_at_date <= end))
+        ops.sort(key=lambda x: x.done_at_date)
         return ops
 
+    def verify(self):
+        """ Check checksums of all chunks without decoding.
+
+        :return:  list of <ChunkError> for corrupted chunks
+        """
+        errors = list()
+        chunks = [self._header_chunk + (None, None)] + \
+            [fields[:5] for fields in self._chunks]
+        for chunk, (offset, size, crc, first, count) in enumerate(chunks):
+            self._fh.seek(offset)
+            if zlib.crc32(self._fh.read(size)) != crc:
+                errors.append(ChunkError(self.file, chunk, first, count))
+        return errors
+
+    def book(self, recover=False):
+        """ Read the whole book.
+
+        :param recover:     if True, records of corrupted chunks are skipped
+                            with warning. Otherwise error is raised.
+        :return:            <VehicleLogBook> class instance
+        :raise ChunkError:  if chunk is corrupted (header - even if recover)
+        """
+        state = dict(self.header())
+        # Packed columns of chunks are joined without decoding.
+        columns = ([], [], [])
+        comments = list()
+        # Lost records: (first, count).
+        lost = list()
+        for chunk, (offset, size, crc, first, count) in \
+                enumerate((fields[:5] for fields in self._chunks), 1):
+            try:
+                records = self._read(offset, size, crc, chunk, first, count)
+            except ChunkError as err:
+                if not recover:
+                    raise
+                warnings.warn(str(err), Warning)
+                lost.append((first, count))
+                continue
+            for column, data in zip(columns, records):
+                column.append(data)
+            comments.extend(records[3])
+        state["log"] = tuple(b"".join(column) for column in columns) + (
+            comments,)
+        if lost:
+            # Numbers of records in log to positions in loaded log.
+            cat = list()
+            for fields in state["cat"]:
+                num = fields[6]
+                shift = 0
+                for first, count in lost:
+                    if num is None or num < first:
+                        break
+                    elif num < first + count:
+                        # Operation is lost with log records.
+                        num = None
+                    else:
+                        shift += count
+                cat.append(fields[:6] + (
+                    None if num is None else num - shift,))
+            state["cat"] = cat
+        book = VehicleLogBook.__new__(VehicleLogBook)
+        book.__setstate__(state)
+        return book
+
 
 class VehicleLogBook(object):
     """ Represents storage of service operations for vehicle
@@ -432,8 +2303,13 @@ class VehicleLogBook(object):
     >>> car.add_operation_to_log(oil_changed)
 
     # Make maintenance plan.
+    # (10000 km will be reached earlier than in 1 year)
     >>> car.make_maintenance_plan()
-    [Operation(Changing the oil: engine, interval_km=10000.0, interval_year=1.0).done(km=108042.0, date=2016-12-04, comment=)]
+    [Operation(Changing the oil: engine, interval_km=10000.0, interval_year=1.0).done(km=108042.0, date=2016-11-05, comment=)]
+
+    # Estimate haul by odometer readings.
+    >>> car.date_at_haul(108042)
+    datetime.date(2016, 11, 5)
 
     # Add new periodic operation to catalogue.
     # ...already exist in catalogue
@@ -456,6 +2332,18 @@ class VehicleLogBook(object):
     """
     # Extension for files of class serialization
     _extension = ".sif"
+    # Max number of steps that can be undone.
+    undo_limit = 100
+    # Max total size of undo and redo steps: number of operations (and
+    # types) referenced by their changes (see _push_step()).
+    undo_size_limit = 1000000
+    # Fields not saved: operations are packed (see _pack_book()), caches
+    # and undo history are rebuilt by loading.
+    _unsaved = ('_operations_log', '_operations_cat', '_op_types',
+                '_labels', '_labels_index', '_label_refs', '_odometer',
+                '_log_sort', '_cat_sort', '_text_index', '_date_index',
+                '_dedup_index', '_undo', '_redo', '_journal', '_undo_depth',
+                '_changes')
 
     def __init__(self, label, production_date, operations_cat=tuple()):
         """
@@ -469,6 +2357,15 @@ class VehicleLogBook(object):
         super().__init__()
         # Version identifier
         self._version = VERSION
+        # Undo and redo steps: (method name, list of inverse changes, size).
+        # See undoable(), _record(), undo(), redo(), _push_step().
+        self._undo = deque(maxlen=self.undo_limit)
+        self._redo = deque(maxlen=self.undo_limit)
+        # Inverse changes of current step (None if not recorded).
+        self._journal = None
+        self._undo_depth = 0
+        # Counter of changes (see Autosaver).
+        self._changes = 0
 
         self._production_date = None
         self._filename = ""  # filename where object saved
@@ -477,8 +2374,40 @@ class VehicleLogBook(object):
         self.production_date = production_date
         # Car haul today
         self._haul = 0
+        # Manually entered odometer readings.
+        # keys - <datetime.date>; values - haul, km.
+        self._haul_readings = dict()
+        # Followed text files of operations (see follow_log()).
+        # keys - absolute file names; values - <FileTail> class instances.
+        self._followed = dict()
+        # Cached <OdometerReadings> built from log and manual readings.
+        # Must be reset to None after every change of them.
+        self._odometer = None
+        # Cached sort permutations of log and catalogue (see sort_log(),
+        # sort_cat()). Must be invalidated after every change of them.
+        self._log_sort = SortCache()
+        self._cat_sort = SortCache()
+        # <TextIndex> of log. Built on first search_log() call, then updated
+        # by every change of log (None if not built).
+        self._text_index = None
+        # <DateIndex> of log. Built on first log_between() call, then updated
+        # by every change of log (None if not built).
+        self._date_index = None
+        # <DedupIndex> of log. Built on the first import, then updated by
+        # every change of log (None if not built).
+        self._dedup_index = None
         # List of all done operations for keeping history.
         self._operations_log = OperationsList()
+        # Operation types shared by all operations of this book.
+        # keys - operation labels; values - <OperationType> class instances.
+        self._op_types = dict()
+        # Sorted list of all known operation labels and number of operations
+        # (in log and catalogue) for every label. Updated by every change
+        # of log and catalogue (see _label_ref(), _label_unref()).
+        self._labels = list()
+        self._label_refs = dict()
+        # The same labels for case-insensitive search by prefix.
+        self._labels_index = PrefixIndex()
         # Catalogue of all periodical operations types.
         # keys - operation labels; values - <Operation> class instances.
         self._operations_cat = dict()
@@ -488,7 +2417,12 @@ class VehicleLogBook(object):
                     "Operation <{}> is not periodic.".format(op.label) +
                     "\nUnable to add non-periodic operation to the catalogue "
                     "of periodic operations.")
-            self._operations_cat[op.label] = op
+            self._operations_cat[op.label] = Operation._from_type(
+                self._intern_type(op.op_type),
+                op.done_at_km, op.done_at_date, op.comment, op.is_done)
+            self._label_ref(op.label)
+        # Initial values can't be undone.
+        self._undo.clear()
         self._modified = False  # WARNING!!! False in spite of assignation
         # label and production_date during call __init___(). Becomes True after
         # assignment this fields through properties.
@@ -506,12 +2440,13 @@ class VehicleLogBook(object):
         return self._haul
 
     @haul.setter
+    @undoable
     def haul(self, new_haul):
         if isinstance(new_haul, str) and new_haul.isdigit():
             new_haul = float(new_haul)
         if isinstance(new_haul, Number):
-            self._haul = new_haul
-            self._modified = True
+            self._set_field("_haul", new_haul)
+            self.add_haul_reading(new_haul)
         else:
             raise TypeError(
                 "Haul value must be a Number (int, float, ...) or digit-string")
@@ -537,26 +2472,79 @@ class VehicleLogBook(object):
         return self._label
 
     @label.setter
+    @undoable
     def label(self, new_label):
         if self._label != new_label:
             self._modified = True
-            self._label = new_label
+            self._set_field("_label", new_label)
 
     @property
     def production_date(self):
         return self._production_date
 
     @production_date.setter
+    @undoable
     def production_date(self, new_prod_date):
         # Car production date.
         if isinstance(new_prod_date, date):
             if new_prod_date != self._production_date:
                 self._modified = True
-                self._production_date = new_prod_date
+                self._set_field("_production_date", new_prod_date)
         else:
             raise TypeError("Argument <new_prod_date> must be an instance "
                             "of <datetime.date> type.")
 
+    @property
+    def haul_readings(self):
+        return self._haul_readings
+
+    @undoable
+    def add_haul_reading(self, km, at_date=None):
+        """ Add manual odometer reading.
+
+        :param km:       vehicle haul, km
+        :param at_date:  date of reading as <datetime.date> class instance.
+                         Today by default.
+        """
+        if at_date is None:
+            at_date = date.today()
+        if not isinstance(at_date, date):
+            raise TypeError("Argument <at_date> must be an instance "
+                            "of <datetime.date> type.")
+        self._set_haul_reading(at_date, float(km))
+        self._modified = True
+
+    @property
+    def odometer(self):
+        """ Odometer readings series.
+
+        Built from vehicle production date (zero haul), operations log and
+        manual readings.
+        :return: <OdometerReadings> class instance
+        """
+        if self._odometer is None:
+            readings = [(op.done_at_date, op.done_at_km)
+                        for op in self._operations_log
+                        if op.done_at_date is not None]
+            readings.extend(self._haul_readings.items())
+            if self._production_date is not None:
+                readings.append((self._production_date, 0))
+            self._odometer = OdometerReadings(readings)
+        return self._odometer
+
+    def haul_at_date(self, at_date):
+        """ Estimate vehicle haul at specified date, km.
+        """
+        return self.odometer.haul_at(at_date)
+
+    def date_at_haul(self, km):
+        """ Estimate the date when vehicle reaches specified haul.
+
+        :return: <datetime.date> class instance or None if unknown
+        """
+        return self.odometer.date_at(km)
+
+    @undoable
     def op_label_replace(self, old, new):
         """Rename operation
         - reAdd periodic operation to catalogue with new label
@@ -569,27 +2557,448 @@ class VehicleLogBook(object):
             return
 
         self._modified = True
-        for op in self._operations_log:
-            # Rename operations with  old name to new
-            if op.label == old:
-                op.label = new
-        if old in self._operations_cat:
-            # ReAdd with new label under new label-keyword
-            op = self._operations_cat[old]
-            self._operations_cat.pop(old)
-            op.label = new
+        # Operation type may be already renamed through some operation.
+        op_type = self._op_types.get(old)
+        known = self._op_types.get(new)
+        if op_type is not None:
+            if known is None or known is op_type:
+                # Rename shared type: all operations in log are renamed.
+                self._type_rename(op_type, old, new)
+            else:
+                # Operation with the new label exists: join with it.
+                if old in self._operations_cat \
+                        and new not in self._operations_cat:
+                    # Intervals of periodic operation are actual.
+                    self._type_update(known, op_type.interval_km,
+                                      op_type.interval_time)
+                self._retype([(op, known) for op in self._operations_log
+                              if op.op_type is op_type])
+                self._type_register(old, None)
+        # ReAdd with new label under new label-keyword
+        op = self._operations_cat.get(old)
+        if op is not None:
+            self._cat_set(old, None)
+        # Move counters of renamed operations in log to the new label.
+        count = self._label_refs.get(old, 0)
+        if count:
+            self._refs_move(old, new, count)
+        if op is not None:
+            if known is not None:
+                self._retype([(op, known)])
             self.add_operation_to_cat(op)
 
-    def get_all_oper_labels(self):
-        """ Get set of all known operation labels
-        :return: list of strings
+    def _invalidate_caches(self):
+        # Called after every change of log or catalogue.
+        self._changes += 1
+        self._odometer = None
+        self._log_sort.invalidate()
+        self._cat_sort.invalidate()
+
+    def _intern_type(self, op_type):
+        """ Get operation type shared by operations of this book with the
+        same label. Unknown type is copied to the book.
+
+        :param op_type:  <OperationType> class instance
+        :return:         <OperationType> class instance of this book
         """
-        labels = set()
-        labels = labels.union([x.label for x in self._operations_log])
-        labels = labels.union([x for x in self._operations_cat.keys()])
-        labels = list(labels)
-        labels.sort()
-        return labels
+        known = self._op_types.get(op_type.label)
+        if known is None:
+            known = OperationType(
+                op_type.label, op_type.interval_km, op_type.interval_time)
+            self._type_register(op_type.label, known)
+        return known
+
+    def _label_ref(self, label, count=1):
+        # Count operations with label added to log or catalogue.
+        refs = self._label_refs.get(label, 0)
+        if not refs:
+            insort(self._labels, label)
+            self._labels_index.add(label)
+        self._label_refs[label] = refs + count
+
+    def _label_unref(self, label, count=1):
+        # Count operations with label removed from log or catalogue.
+        refs = self._label_refs[label] - count
+        if refs > 0:
+            self._label_refs[label] = refs
+            return
+        del self._label_refs[label]
+        del self._labels[bisect_left(self._labels, label)]
+        self._labels_index.remove(label)
+        # There are no operations of this type anymore.
+        self._type_register(label, None)
+
+    def _rebuild_labels(self, log_refs=None):
+        # Count labels of all operations in log and catalogue again.
+        # log_refs - counts of labels in log (if known).
+        if log_refs is None:
+            self._label_refs = dict()
+            for op in self._operations_log:
+                self._label_refs[op.label] = \
+                    self._label_refs.get(op.label, 0) + 1
+        else:
+            self._label_refs = dict(log_refs)
+        for label in self._operations_cat:
+            self._label_refs[label] = self._label_refs.get(label, 0) + 1
+        self._labels = sorted(self._label_refs)
+        self._labels_index = PrefixIndex(self._labels)
+        self._op_types = {label: op_type
+                          for label, op_type in self._op_types.items()
+                          if label in self._label_refs}
+
+    # Primitive changes of the book.
+    # ------------------------------
+    # Every primitive records its inverse change by _record(), so it can be
+    # undone in O(size of change) time. Inverse change is recorded before
+    # nested primitives are called: changes are undone in reverse order.
+
+    def _record(self, *change):
+        # Record inverse change: (method name, arguments...)
+        self._changes += 1
+        if self._journal is not None:
+            self._journal.append(change)
+
+    def _set_field(self, name, value):
+        # Set field (i.e. _label, _haul, _production_date)
+        self._record("_set_field", name, getattr(self, name))
+        setattr(self, name, value)
+        self._odometer = None
+
+    def _set_haul_reading(self, at_date, km):
+        # Set odometer reading (km - None to remove it).
+        self._record("_set_haul_reading", at_date,
+                     self._haul_readings.get(at_date))
+        if km is None:
+            del self._haul_readings[at_date]
+        else:
+            self._haul_readings[at_date] = km
+        self._odometer = None
+
+    def _tail_set(self, file, tail):
+        # Set position of reading of followed file.
+        self._record("_tail_set", file, self._followed.get(file))
+        if tail is None:
+            del self._followed[file]
+        else:
+            self._followed[file] = tail
+
+    def _type_register(self, label, op_type):
+        # Set shared operation type for label (None to remove it).
+        previous = self._op_types.get(label)
+        if previous is op_type:
+            return
+        self._record("_type_register", label, previous)
+        if op_type is None:
+            del self._op_types[label]
+        else:
+            self._op_types[label] = op_type
+
+    def _type_update(self, op_type, interval_km, interval_time):
+        # Set intervals of shared operation type.
+        if op_type.interval_km == interval_km \
+                and op_type.interval_time == interval_time:
+            return
+        self._record("_type_update", op_type,
+                     op_type.interval_km, op_type.interval_time)
+        op_type.interval_km = interval_km
+        op_type.interval_time = interval_time
+        self._invalidate_caches()
+
+    def _type_rename(self, op_type, old, new):
+        # Rename shared operation type registered with label old.
+        self._record("_type_rename", op_type, new, old)
+        if self._op_types.get(old) is op_type:
+            del self._op_types[old]
+        self._op_types[new] = op_type
+        op_type.label = new
+        self._invalidate_caches()
+        # Keys of many operations are changed: index will be built again.
+        self._dedup_index = None
+        if self._text_index is not None:
+            for op in self._operations_log:
+                if op.op_type is op_type:
+                    self._text_index.update(op)
+
+    def _retype(self, pairs):
+        # Change types of operations: pairs - list of (operation, type)
+        self._record("_retype", [(op, op.op_type) for op, _ in pairs])
+        for op, op_type in pairs:
+            op._type = op_type
+            if self._text_index is not None and op in self._text_index:
+                self._text_index.update(op)
+        self._invalidate_caches()
+        self._dedup_index = None
+
+    def _refs_move(self, old, new, count):
+        # Move counters of operations from label old to label new.
+        self._record("_refs_move", new, old, count)
+        refs = self._label_refs[old] - count
+        if refs > 0:
+            self._label_refs[old] = refs
+        else:
+            del self._label_refs[old]
+            del self._labels[bisect_left(self._labels, old)]
+            self._labels_index.remove(old)
+        self._label_ref(new, count)
+
+    def _log_bisect(self, km, right=True):
+        # Binary search of position in log sorted by haul: after (right) or
+        # before operations with the same haul.
+        log = self._operations_log
+        lo, hi = 0, len(log)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if km < log[mid].done_at_km or \
+                    not right and km == log[mid].done_at_km:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _log_find(self, operation):
+        # Index of operation (by identity) in log or None.
+        log = self._operations_log
+        km = operation.done_at_km
+        ind = self._log_bisect(km, right=False)
+        while ind < len(log) and log[ind].done_at_km == km:
+            if log[ind] is operation:
+                return ind
+            ind += 1
+        return None
+
+    def _log_insert(self, operations):
+        # Add operations to log. Their types must be registered.
+        self._record("_log_delete", operations)
+        log = self._operations_log
+        if len(operations) == 1:
+            # Position after operations with the same haul (as stable sort
+            # does): adding one by one isn't quadratic.
+            log.insert(self._log_bisect(operations[0].done_at_km),
+                       operations[0])
+        else:
+            log.extend(operations)
+            log.sort(key=lambda x: x.done_at_km)
+        for op in operations:
+            self._label_ref(op.label)
+            if self._text_index is not None:
+                self._text_index.add(op)
+            if self._date_index is not None:
+                self._date_index.add(op)
+            if self._dedup_index is not None:
+                self._dedup_index.add(op)
+        self._invalidate_caches()
+
+    def _log_delete(self, operations):
+        # Remove operations (by identity) from log.
+        log = self._operations_log
+        if len(operations) == 1:
+            # Binary search by haul: undo of adding one by one isn't
+            # quadratic.
+            ind = self._log_find(operations[0])
+            if ind is None:
+                raise ValueError("Operation is not in the log.")
+            self._record("_log_insert", operations)
+            del log[ind]
+        else:
+            keys = {id(op) for op in operations}
+            rest = [op for op in log if id(op) not in keys]
+            if len(log) - len(rest) != len(keys):
+                raise ValueError("Operation is not in the log.")
+            self._record("_log_insert", operations)
+            log[:] = rest
+        for op in operations:
+            if self._text_index is not None:
+                self._text_index.remove(op)
+            if self._date_index is not None:
+                self._date_index.remove(op)
+            if self._dedup_index is not None:
+                self._dedup_index.remove(op)
+            self._label_unref(op.label)
+        self._invalidate_caches()
+
+    def _cat_set(self, label, operation):
+        # Set catalogue operation for label (None to remove it).
+        # Type of operation must be registered.
+        previous = self._operations_cat.get(label)
+        self._record("_cat_set", label, previous)
+        if operation is None:
+            del self._operations_cat[label]
+            self._label_unref(label)
+        else:
+            self._operations_cat[label] = operation
+            if previous is None:
+                self._label_ref(label)
+        self._invalidate_caches()
+
+    def _op_update(self, operation, km, at_date, comment):
+        # Set completion of operation from log or catalogue.
+        self._record("_op_update", operation, operation.done_at_km,
+                     operation.done_at_date, operation.comment)
+        ind = None
+        if km != operation.done_at_km:
+            # Operation is found in log by its old haul (None - catalogue
+            # operation).
+            ind = self._log_find(operation)
+        indexed = self._date_index is not None \
+            and operation.done_at_date is not None
+        if indexed:
+            try:
+                self._date_index.remove(operation)
+            except ValueError:
+                # Catalogue operation.
+                indexed = False
+        deduped = self._dedup_index is not None \
+            and operation in self._dedup_index
+        if deduped:
+            self._dedup_index.remove(operation)
+        operation._done_at_km = km
+        operation._done_at_date = at_date
+        operation.comment = comment
+        operation._is_done = at_date is not None
+        if indexed:
+            self._date_index.add(operation)
+        if deduped:
+            self._dedup_index.add(operation)
+        if self._text_index is not None and operation in self._text_index:
+            self._text_index.update(operation)
+        if ind is not None:
+            # Log is kept sorted by haul.
+            del self._operations_log[ind]
+            self._operations_log.insert(self._log_bisect(km), operation)
+        self._invalidate_caches()
+
+    def _snapshot(self):
+        # State of log and catalogue to restore it by _restore().
+        # Operations are not copied.
+        return (list(self._operations_log),
+                dict(self._operations_cat),
+                dict(self._op_types),
+                [(t, t.label, t.interval_km, t.interval_time)
+                 for t in self._op_types.values()],
+                [(op, op.done_at_km, op.done_at_date, op.comment, op.is_done)
+                 for op in self._operations_cat.values()])
+
+    def _restore(self, snapshot):
+        # Restore state of log and catalogue (inverse of large changes,
+        # i.e. clear and import).
+        self._record("_restore", self._snapshot())
+        log, cat, op_types, types, ops = snapshot
+        self._operations_log[:] = log
+        self._operations_cat = dict(cat)
+        self._op_types = dict(op_types)
+        for op_type, label, interval_km, interval_time in types:
+            op_type.label = label
+            op_type.interval_km = interval_km
+            op_type.interval_time = interval_time
+        for op, km, at_date, comment, is_done in ops:
+            op._done_at_km = km
+            op._done_at_date = at_date
+            op.comment = comment
+            op._is_done = is_done
+        self._rebuild_labels()
+        self._text_index = None
+        self._date_index = None
+        self._dedup_index = None
+        self._invalidate_caches()
+
+    def _checkpoint(self):
+        # Record state of the book to undo all following changes of current
+        # step at once. Following changes are not recorded.
+        self._record("_restore", self._snapshot())
+        self._journal = None
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo(self):
+        """ Undo the last change of the book.
+
+        Recorded inverse changes are applied, so it takes time proportional
+        to the size of the change, not to the size of the book.
+        :return:  name of undone method or None if there is nothing to undo
+        """
+        if not self._undo:
+            return None
+        name, changes, _ = self._undo.pop()
+        self._push_step(self._redo, name, self._apply(changes))
+        return name
+
+    def redo(self):
+        """ Redo the last undone change of the book.
+
+        :return:  name of redone method or None if there is nothing to redo
+        """
+        if not self._redo:
+            return None
+        name, changes, _ = self._redo.pop()
+        self._push_step(self._undo, name, self._apply(changes))
+        return name
+
+    def _push_step(self, steps, name, changes):
+        # Add step to undo or redo history. The oldest steps are dropped to
+        # keep total size of history in undo_size_limit: snapshots of large
+        # books (see _checkpoint()) are not kept by undo_limit steps.
+        size = 0
+        for change, *args in changes:
+            if change == "_restore":
+                log, cat, op_types = args[0][:3]
+                size += len(log) + len(cat) + len(op_types)
+            elif change in ("_log_insert", "_log_delete"):
+                size += len(args[0])
+            else:
+                size += 1
+        steps.append((name, changes, size))
+        total = sum(step[2] for step in self._undo) \
+            + sum(step[2] for step in self._redo)
+        # The latest step is kept anyway.
+        for old in (self._undo, self._redo):
+            while total > self.undo_size_limit \
+                    and len(old) > (old is steps):
+                total -= old.popleft()[2]
+
+    def _apply(self, changes):
+        # Apply recorded changes in reverse order. Return inverse changes.
+        journal = self._journal = list()
+        try:
+            for name, *args in reversed(changes):
+                getattr(self, name)(*args)
+        finally:
+            self._journal = None
+        self._modified = True
+        return journal
+
+    def get_all_oper_labels(self, prefix=""):
+        """ Get sorted list of all known operation labels.
+
+        Labels are kept sorted on every change of the book, so it takes
+        O(log n + k) time: only result is copied.
+        :param prefix:  get only labels started with this string
+        :return:        list of strings
+        """
+        if not prefix:
+            return list(self._labels)
+        start = bisect_left(self._labels, prefix)
+        stop = bisect_left(self._labels, prefix + chr(0x10FFFF), start)
+        return self._labels[start:stop]
+
+    def find_oper_labels(self, prefix, limit=None):
+        """ Find known operation labels by prefix case-insensitive
+        (i.e. for autocompletion).
+
+        :param prefix:  beginning of label
+        :param limit:   max number of labels to return (None - all)
+        :return:        list of strings sorted case-insensitive
+        """
+        return self._labels_index.find(prefix, limit)
+
+    def has_oper_label(self, label):
+        # Is there operations with this label in log or catalogue?
+        return label in self._label_refs
 
     def get_periodic(self, label):
         """ Find periodic operation with the same label in periodic
@@ -603,6 +3012,117 @@ class VehicleLogBook(object):
         else:
             return None
 
+    def sort_log(self, *keys, query=None):
+        """ Get order of operations log sorted by several keys.
+
+        Sort keys are computed once and permutations are cached until the
+        next change of the book, so switching between orders is cheap.
+        :param keys:   key names (see SORT_KEYS) from the most significant
+                       one. Name with leading "-" means descending order.
+        :param query:  get only operations found by search_log(query).
+                       Only found operations are sorted (by cached
+                       positions), so it takes O(k log n) time.
+        :return:       list of indexes of operations in log. Do not modify
+                       it.
+        """
+        if query is None:
+            return self._log_sort.permutation(self._operations_log, keys)
+        ranks = self._log_sort.ranks(self._operations_log, keys)
+        found = [self._log_find(op) for op in self.search_log(query)]
+        found.sort(key=ranks.__getitem__)
+        return found
+
+    def sort_cat(self, *keys):
+        """ Get periodic operations catalogue sorted by several keys
+        (see sort_log()).
+
+        :return:  list of <Operation> class instances
+        """
+        ops = list(self._operations_cat.values())
+        return [ops[ind] for ind in self._cat_sort.permutation(ops, keys)]
+
+    def search_log(self, query):
+        """ Full-text search in operations log.
+
+        Finds operations which labels and comments contain all words of query
+        (case-insensitive, the last word may be incomplete). Index of words is
+        built on the first call and updated by every change of log.
+        :param query:  text string, i.e. "oil price"
+        :return:       list of <Operation> class instances sorted by haul
+        """
+        if self._text_index is None:
+            self._text_index = TextIndex(self._operations_log)
+        return self._text_index.search(query)
+
+    def log_between(self, start=None, end=None):
+        """ Get operations done in date range.
+
+        Log is sorted by haul, but dates may be not monotonic with haul
+        (i.e. corrected records, replaced odometer), so index of log by date
+        is used. It is built on the first call and updated by every change
+        of log. Query takes O(log n + k) time.
+        :param start:  first date of range as <datetime.date> class instance
+                       (None - from the first operation)
+        :param end:    last date of range (inclusive). None - up to the last
+                       operation.
+        :return:       list of <Operation> class instances sorted by date
+        """
+        if self._date_index is None:
+            self._date_index = DateIndex(self._operations_log)
+        return self._date_index.between(start, end)
+
+    @undoable
+    def edit_operation(self, operation, label=None, interval_km=None,
+                       interval_time=None, km=None, at_date=None,
+                       comment=None):
+        """ Change operation from log or catalogue.
+        Arguments with value None are not changed.
+
+        :param operation:      <Operation> class instance of this book
+        :param label:          new label. All operations with the same label
+                               are renamed (see op_label_replace()).
+        :param interval_km:    new interval of operations with the same
+                               label, km
+        :param interval_time:  new interval as <datetime.timedelta>
+        :param km:             new completion haul, km
+        :param at_date:        new completion date as <datetime.date>
+        :param comment:        new comment
+        """
+        # Check all values before changes.
+        if label is not None and not isinstance(label, str):
+            raise TypeError("Operation label must be a text string.")
+        probe = Operation._from_type(OperationType(
+            "", operation.interval_km, operation.interval_time))
+        if interval_km is not None:
+            probe.interval_km = interval_km
+        if interval_time is not None:
+            probe.interval_time = interval_time
+        if operation.label in self._operations_cat and not probe.is_periodic:
+            raise ValueError("Unable to make operation of periodic operations "
+                             "catalogue non-periodic. Remove it from the "
+                             "catalogue instead.")
+        if km is not None:
+            km = Operation._valid_km(km)
+        if at_date is not None:
+            Operation._valid_date(at_date)
+
+        self._modified = True
+        self._type_update(operation.op_type,
+                          probe.interval_km, probe.interval_time)
+        if km is not None or at_date is not None or comment is not None:
+            self._op_update(
+                operation,
+                operation.done_at_km if km is None else km,
+                operation.done_at_date if at_date is None else at_date,
+                operation.comment if comment is None else comment)
+        if label is not None:
+            self.op_label_replace(operation.label, label)
+        if operation.is_periodic:
+            # Operation may become periodic.
+            self.add_operation_to_cat(operation)
+
+    @instrumented(items=lambda args, result: 1)
+    @undoable
     def add_operation_to_log(self, operation):
         if not isinstance(operation, Operation):
             raise TypeError("Argument <operation> must be an instance "
@@ -613,21 +3133,31 @@ class VehicleLogBook(object):
                              "Unable to add operation that has never been "
                              "done.")
         self._modified = True
+        # Share operation type with other operations with the same label.
+        op_type = operation.op_type
+        operation._type = self._intern_type(op_type)
         # Put operation to the log-list.
-        self._operations_log.append(operation)
-        self._operations_log.sort(key=lambda x: x.done_at_km)
+        self._log_insert([operation])
         # If it is periodical operation
-        if operation.is_periodic:
+        if op_type.interval_km:
             if operation.label in self._operations_cat:
                 # Update last completion time for this operation
                 # if that is newer than last.
                 operation_last = self._operations_cat[operation.label]
                 if operation > operation_last:
-                    self._operations_cat[operation.label] = operation
+                    self._cat_set(operation.label, operation)
+                    # Intervals of the newest operation are actual.
+                    self._type_update(operation.op_type, op_type.interval_km,
+                                      op_type.interval_time)
             else:
+                # Operation became periodic.
+                self._type_update(operation.op_type, op_type.interval_km,
+                                  op_type.interval_time)
                 # Add operation to periodic operations catalogue
                 self.add_operation_to_cat(operation)
 
+    @instrumented(items=lambda args, result: 1)
+    @undoable
     def add_operation_to_cat(self, operation):
         if operation.is_periodic \
                 and operation.label not in self._operations_cat.keys():
@@ -642,56 +3172,79 @@ class VehicleLogBook(object):
                 last_operation = max(same_operations)
                 last_date = last_operation.done_at_date
                 last_km = last_operation.done_at_km
+            # Operation type became periodic (if it is known).
+            op_type = self._intern_type(operation.op_type)
+            self._type_update(op_type, operation.interval_km,
+                              operation.interval_time)
             # Set operation last completion
-            operation = operation.done(last_km, last_date)
+            operation = Operation._from_type(
+                op_type, float(last_km), last_date, "", True)
             # Add operation to periodic operations catalogue
-            self._operations_cat[operation.label] = operation
+            self._cat_set(operation.label, operation)
 
+    @undoable
     def clear_log(self):
         self._modified = True
+        self._checkpoint()
+        self._invalidate_caches()
         # Clear log of produced operations.
         self._operations_log.clear()
+        self._text_index = None
+        self._date_index = None
+        self._dedup_index = None
         # Clear information about last operation completion
         for operation in self._operations_cat.values():
             operation.undo()
+        # Keep labels and types of periodic operations only.
+        self._rebuild_labels()
 
+    @undoable
     def clear_all(self):
         self._modified = True
+        self._checkpoint()
+        self._invalidate_caches()
         # Clear operations log and peridic operations catalogue.
         self._operations_log.clear()
+        self._text_index = None
+        self._date_index = None
+        self._dedup_index = None
         self._operations_cat.clear()
+        self._op_types.clear()
+        self._labels.clear()
+        self._label_refs.clear()
+        self._labels_index = PrefixIndex()
 
+    @instrumented(items=lambda args, result: len(args[1]))
+    @undoable
     def remove_from_log(self, operations):
         """ Remove specified operation from oeprations list
         :param operations: list of operations
         """
-        for op in operations:
-            self._operations_log.remove(op)
+        self._log_delete(list(operations))
         self._modified = True
 
+    @instrumented(items=lambda args, result: len(args[1]))
+    @undoable
     def remove_from_cat(self, operations):
         for op in operations:
-
             # Remove all operations in log with the same labels.
-            # ... get all indexes of items with the same lables
-            inds = [ind for ind, op_in_log
-                    in enumerate(self._operations_log)
-                    if op_in_log.label == op.label]
-            # we need to start removing from the end to prevent shift of indexes
-            # after removing elements
-            inds.reverse()
-            # ... pop all items with this indexes
-            for ind in inds:
-                self._operations_log.pop(ind)
-
+            same_operations = [op_in_log for op_in_log in self._operations_log
+                               if op_in_log.label == op.label]
+            if same_operations:
+                self._log_delete(same_operations)
             # Also remove operation from catalogue.
-            del self._operations_cat[op.label]
+            self._cat_set(op.label, None)
 
         self._modified = True
 
+    @instrumented(items=lambda args, result: len(result))
     def make_maintenance_plan(self, haul=None, relative=True):
         """ Make plan of periodic operations that must be performed.
 
+        Planned date is the earliest of two dates: when operation interval
+        time expires and when operation interval haul will be reached
+        (estimated by odometer readings).
+
         :param haul:  current vehicle haul, km. If you specify it here, than
                       this value will be saved in class property <haul>
         :param relative: If True, than the plan with operations planned with
@@ -704,56 +3257,275 @@ class VehicleLogBook(object):
         if haul:
             self.haul = haul
         for operation in self._operations_cat.values():
-            # Planned operation date.
-            last_date = operation.done_at_date
-            interval_date = operation.interval_time
-            plan_date = last_date + interval_date
-
             # Planned operation haul.
             last_km = operation.done_at_km
             interval_km = operation.interval_km
             plan_km = last_km + interval_km
 
+            # Planned operation date.
+            last_date = operation.done_at_date
+            interval_date = operation.interval_time
+            plan_date = last_date + interval_date
+            # ...haul will be reached earlier?
+            plan_date_km = self.date_at_haul(plan_km)
+            if plan_date_km and (not interval_date or plan_date_km < plan_date):
+                plan_date = plan_date_km
+
             # Make planned operation haul relative to current.
             if relative:
                 plan_km -= self.haul
-            plan.append(operation.done(plan_km, plan_date))
+            plan.append(Operation._from_type(
+                operation.op_type, float(plan_km), plan_date, "", True))
         plan.sort(key=lambda x: x.done_at_km)
         return plan
 
-    def export_log(self, file):
-        # Export operations history to txt file.
-        self._operations_log.save(file)
+    def export_log(self, file, start=None, end=None, encoding=None):
+        """ Export operations history to txt file.
+
+        :param start:     export operations done since this date only
+        :param end:       export operations done up to this date (inclusive)
+                          only
+        :param encoding:  text encoding (see OperationsList.save())
+        """
+        if start is None and end is None:
+            self._operations_log.save(file, encoding)
+        else:
+            OperationsList(self.log_between(start, end)).save(file, encoding)
 
-    def export_cat(self, file):
+    def export_cat(self, file, encoding=None):
         # Export periodic operations catalogue to txt file.
         cat = self._operations_cat.values()
         # Clear last operation info and convert it to <OperationsList> type.
         cat = OperationsList([x for x in cat])
         for x in cat:
             x.undo()
-        cat.save(file)
+        cat.save(file, encoding)
 
-    def export_plan(self, file, haul=None):
+    def export_plan(self, file, haul=None, encoding=None):
         # Export maintenance plan to txt file.
         plan = self.make_maintenance_plan(haul)
         plan = OperationsList([x for x in plan])
-        plan.save(file)
-
-    def import_log(self, file):
+        plan.save(file, encoding)
+
+    @instrumented(items=lambda args, result: result.total)
+    @undoable
+    def import_log(self, file, encoding=None, processes=1):
+        """ Import operations history from txt file.
+
+        Operations that are already in log are skipped, so the same file (or
+        overlapping exports) can be imported again.
+        :param encoding:   encoding of file without BOM (see
+                           OperationsList.load())
+        :param processes:  number of processes parsing large file (see
+                           OperationsList.load())
+        :return:           <ImportStats> class instance
+        """
         self._modified = True
-        # Import operations history from txt file.
-        ops = OperationsList.load(file)
-        for op in ops:
-            self.add_operation_to_log(op)
+        ops = OperationsList.load(file, encoding, processes)
+        if len(ops) * 8 > len(self._operations_log):
+            # Snapshot of log isn't much larger than imported operations
+            # and is restored at once. Small imports are recorded by
+            # operations (see _push_step()).
+            self._checkpoint()
+        return self._import_ops(ops)
+
+    def _import_ops(self, operations):
+        # Add operations to log (that have never been done - to catalogue)
+        # skipping duplicates. Return <ImportStats>.
+        stats = ImportStats()
+        if self._dedup_index is None:
+            self._dedup_index = DedupIndex(self._operations_log)
+        for op in operations:
+            if not op.is_done:
+                # Catalogue keeps the first periodic operation of a label.
+                known = op.label in self._operations_cat
+                self.add_operation_to_cat(op)
+                if not known and op.label in self._operations_cat:
+                    stats.new += 1
+                else:
+                    stats.duplicate += 1
+                continue
+            status = self._dedup_index.check(op)
+            if status == DedupIndex.NEW:
+                self.add_operation_to_log(op)
+                stats.new += 1
+            elif status == DedupIndex.DUPLICATE:
+                stats.duplicate += 1
+            else:
+                stats.conflicts.append(op)
+        return stats
+
+    @instrumented(items=lambda args, result: result.total)
+    @undoable
+    def merge(self, other):
+        """ Merge other log book of the same vehicle (i.e. office and
+        workshop copies) into this book. Other book is not changed.
+
+        Logs sorted by haul are merged in one pass, O(n + m) time.
+        Operations that are already in log are skipped; equal operations
+        with other date or comment are conflicting and skipped too (as by
+        import_log(), see DedupIndex). The newest completion of every
+        periodic operation of both catalogues is kept, intervals of the
+        newest one are actual (as by add_operation_to_log()). Missed
+        odometer readings are added.
+
+        :param other:  <VehicleLogBook> class instance
+        :return:       <ImportStats> class instance (conflicts - operations
+                       of other book)
+        """
+        if not isinstance(other, VehicleLogBook):
+            raise TypeError("Argument <other> must be an instance "
+                            "of <VehicleLogBook> type.")
+        if other is self:
+            return ImportStats()
+        stats = ImportStats()
+        log = self._operations_log
+        other_log = other.operations_log
+        # Operations of this book for operations of other book:
+        # keys - identities of operations of other book.
+        copies = dict()
+        added = list()
+        i = 0
+        j = 0
+        while j < len(other_log):
+            km = other_log[j].done_at_km
+            while i < len(log) and log[i].done_at_km < km:
+                i += 1
+            # Operations with the same haul, keys - labels.
+            same_km = dict()
+            while i < len(log) and log[i].done_at_km == km:
+                same_km.setdefault(log[i].label, list()).append(log[i])
+                i += 1
+            while j < len(other_log) and other_log[j].done_at_km == km:
+                op = other_log[j]
+                j += 1
+                same = same_km.get(op.label)
+                if same is None:
+                    copy_op = Operation._from_type(
+                        self._intern_type(op.op_type), km, op.done_at_date,
+                        op.comment, True)
+                    same_km[op.label] = [copy_op]
+                    copies[id(op)] = copy_op
+                    added.append(copy_op)
+                    stats.new += 1
+                    continue
+                # The same record (see DedupIndex.key()).
+                comment = op.comment.strip()
+                for known in same:
+                    if known.done_at_date == op.done_at_date \
+                            and known.comment.strip() == comment:
+                        copies[id(op)] = known
+                        stats.duplicate += 1
+                        break
+                else:
+                    stats.conflicts.append(op)
+        if added:
+            # Sorted runs are merged by sort in linear time.
+            self._log_insert(added)
+            self._modified = True
+        for label, op in other.operations_cat.items():
+            last = self._operations_cat.get(label)
+            if last is not None and op.done_at_km <= last.done_at_km:
+                continue
+            op_type = self._intern_type(op.op_type)
+            # Intervals of the newest operation are actual.
+            self._type_update(op_type, op.interval_km, op.interval_time)
+            copy_op = copies.get(id(op))
+            if copy_op is None:
+                # Operation isn't in log (i.e. never done or conflicting).
+                copy_op = Operation._from_type(
+                    op_type, op.done_at_km, op.done_at_date, op.comment,
+                    op.is_done)
+            self._cat_set(label, copy_op)
+            self._modified = True
+        for at_date, km in other.haul_readings.items():
+            if at_date not in self._haul_readings:
+                self._set_haul_reading(at_date, km)
+                self._modified = True
+        if other.haul > self._haul:
+            self._set_field("_haul", other.haul)
+            self._modified = True
+        return stats
+
+    @instrumented(items=lambda args, result: result.total)
+    @undoable
+    def follow_log(self, file, stat=None, encoding=None):
+        """ Import operations appended to text file since the previous call.
+
+        Position of reading is kept for every file (and saved with the book),
+        so only new records are parsed. Unchanged file is not read at all.
+        If file has been rewritten, it is read again from the beginning.
+        Operations that are already in log are skipped (see import_log()).
+        Operations that have never been done are added to catalogue.
+
+        :param file:      text file of operations (see OperationsList.save())
+        :param stat:      file status (i.e. from os.scandir()) to check if it
+                          has been changed without extra system call
+        :param encoding:  encoding of file without BOM (see FileTail.read())
+        :return:          <ImportStats> class instance
+        """
+        key = os.path.abspath(file)
+        tail = self._followed.get(key)
+        if tail is not None and not tail.changed(stat):
+            return ImportStats()
+        # Copy to undo position of reading together with imported operations.
+        previous = tail
+        tail = copy(tail) if tail is not None else FileTail(key)
+        ops = tail.read(encoding)
+        if not ops and (tail.offset, tail.tail) == (
+                (previous.offset, previous.tail) if previous is not None
+                else (0, b"")):
+            # Nothing new: position of reading isn't changed. Keep file
+            # status only to skip reading of unchanged file.
+            if previous is not None:
+                previous.stat = tail.stat
+            return ImportStats()
+        self._modified = True
+        self._tail_set(key, tail)
+        return self._import_ops(ops)
 
-    def import_cat(self, file):
+    @instrumented(items=lambda args, result: result)
+    @undoable
+    def import_cat(self, file, encoding=None):
         self._modified = True
         # Import periodic operations catalogue to txt file.
-        ops = OperationsList.load(file)
+        ops = OperationsList.load(file, encoding)
         for op in ops:
             self.add_operation_to_cat(op)
+        return len(ops)
 
+    def dumps(self):
+        """ Serialize book to bytes in chunked layout (see LogBookReader).
+        """
+        state = self._state(records=False)
+        type_nums = {label: num for num, label in enumerate(self._op_types)}
+        log = self._operations_log
+
+        out = io.BytesIO()
+        out.write(LogBookReader.magic)
+
+        def write(data):
+            # Write chunk, return (offset, size, checksum)
+            offset = out.tell()
+            out.write(data)
+            return offset, len(data), zlib.crc32(data)
+
+        header = write(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+        chunks = list()
+        for first in range(0, len(log), CHUNK_RECORDS):
+            ops = log[first:first + CHUNK_RECORDS]
+            days = [op.done_at_date.toordinal() for op in ops]
+            chunks.append(write(pickle.dumps(
+                _pack_records(ops, type_nums), pickle.HIGHEST_PROTOCOL)) + (
+                first, len(ops), ops[0].done_at_km, ops[-1].done_at_km,
+                min(days), max(days)))
+        offset, size, crc = write(pickle.dumps((header, chunks),
+                                               pickle.HIGHEST_PROTOCOL))
+        out.write(LogBookReader.trailer.pack(
+            offset, size, crc, LogBookReader.trailer_magic))
+        return out.getvalue()
+
+    @instrumented(items=lambda args, result: len(args[0].operations_log))
     def save(self, file=None):
         """ Serialize current class instance.
 
@@ -768,18 +3540,26 @@ class VehicleLogBook(object):
         ext = os.path.splitext(file)[-1]
         if not ext or ext != self._extension:
             file += VehicleLogBook._extension
-        # Serialize.
-        with open(file, 'wb') as fh:
-            pickle.dump(self, fh, pickle.HIGHEST_PROTOCOL)
+        # Serialize. File is replaced atomically: old file is kept if saving
+        # fails (i.e. power loss).
+        atomic_write(file, self.dumps())
         self._modified = False
         self._filename = file
 
     @staticmethod
-    def load(file):
+    @instrumented(items=lambda args, result: len(result.operations_log))
+    def load(file, recover=False):
         """ Create class instance from previously saved instance.
 
         Using pickle module.
 
+        :param file:        file of log book
+        :param recover:     load the rest of book if some chunks of log are
+                            corrupted (see LogBookReader.book()). Partially
+                            loaded book is modified and has no file name, so
+                            it isn't saved over the corrupted file.
+        :raise ChunkError:  if file is corrupted (and not recover)
+
         Warning
         -------
         The pickle module is not secure against erroneous or maliciously
@@ -791,22 +3571,79 @@ class VehicleLogBook(object):
         if not ext:
             file += VehicleLogBook._extension
         # Deserialize.
-        with open(file, 'rb') as fh:
-            vehice_log_book = pickle.load(fh)
+        partial = False
+        if LogBookReader.is_chunked(file):
+            with LogBookReader(file) as reader:
+                vehice_log_book = reader.book(recover)
+                partial = len(vehice_log_book.operations_log) < len(reader)
+        else:
+            # Saved by previous version as a single pickle.
+            with open(file, 'rb') as fh:
+                vehice_log_book = pickle.load(fh)
         vehice_log_book._changed = False
         # Check type.
         if not isinstance(vehice_log_book, VehicleLogBook):
             raise TypeError("File {0} has unexpected type: {1}".format(
                 file,
                 type(vehice_log_book)))
-        # Check version.
-        if vehice_log_book._version != VERSION:
-            warnings.warn("File {0} created by another version "
+        # Check version. Files of previous versions are upgraded by loading
+        # (see STATE_UPGRADES).
+        if vehice_log_book._version > VERSION:
+            warnings.warn("File {0} created by newer version "
                           "of class <VehicleLogBook>".format(file), Warning)
-        vehice_log_book._modified = False
-        vehice_log_book._filename = file
+            vehice_log_book._version = VERSION
+        vehice_log_book._modified = partial
+        vehice_log_book._filename = "" if partial else file
         return vehice_log_book
 
+    @staticmethod
+    def stats():
+        """ Get call statistics of instrumented methods.
+        Statistics collected after enable_stats() call only.
+        """
+        return stats()
+
+    def _state(self, records=True):
+        # Book fields with packed operations (see _pack_book()).
+        # records - pack log records too.
+        state = {name: value for name, value in self.__dict__.items()
+                 if name not in self._unsaved}
+        state.update(_pack_book(list(self._op_types.values()),
+                                self._operations_log, self._operations_cat,
+                                records))
+        return state
+
+    def __getstate__(self):
+        return self._state()
+
+    def __setstate__(self, state):
+        # Upgrade state saved by previous versions step by step.
+        version = tuple(state.get('_version', (1, 0)))
+        while version in STATE_UPGRADES:
+            version, upgrade = STATE_UPGRADES[version]
+            state = upgrade(state)
+        # Default values for fields missed in files of previous versions.
+        self._haul_readings = dict()
+        self._followed = dict()
+        self._undo = deque(maxlen=self.undo_limit)
+        self._redo = deque(maxlen=self.undo_limit)
+        self._journal = None
+        self._undo_depth = 0
+        self._changes = 0
+        self.__dict__.update((name, value) for name, value in state.items()
+                             if name not in ('types', 'cat', 'log'))
+        self._op_types, self._operations_log, self._operations_cat, \
+            log_refs = _unpack_book(state)
+        # State of newer version is kept to warn by load().
+        self._version = max(version, VERSION)
+        self._odometer = None
+        self._log_sort = SortCache()
+        self._cat_sort = SortCache()
+        self._text_index = None
+        self._date_index = None
+        self._dedup_index = None
+        self._rebuild_labels(log_refs)
+
     def __str__(self):
         return self._operations_log.__str__()
 
@@ -4,11 +4,15 @@
 ServiceInterval
 Application interface classes.
 """
-from collections import Iterable
+from time import perf_counter, time
+_START = perf_counter()  # startup time trace origin
+
+from collections.abc import Iterable
 from datetime import date, datetime, timedelta
 from numbers import Number
 import os
-from time import time
+import sys
+import warnings
 import tkinter as tk
 from tkinter import ttk
 import tkinter.messagebox
@@ -22,6 +26,12 @@ __author__ = 'Don D.S.'
 
 # Private constants
 _DIR_IMG = 'icons'  # images directory
+# Set this environment variable to print startup time trace to stderr.
+_ENV_TRACE_STARTUP = 'SERVINT_TRACE_STARTUP'
+# Set this environment variable to change autosave interval, seconds
+# (0 to disable autosave).
+_ENV_AUTOSAVE = 'SERVINT_AUTOSAVE'
+_AUTOSAVE_INTERVAL = 60
 
 # Test data
 oil_change = siu.Operation("Changing the oil: engine",
@@ -33,12 +43,31 @@ oil_changed = oil_change.done(km=98421,
                               comment="Price: 4000 RUR")
 
 
+def trace_startup(stage):
+    """ Print time elapsed since module import to stderr.
+    Works if environment variable SERVINT_TRACE_STARTUP is set.
+
+    :param stage:  text description of startup stage that was reached
+    """
+    if os.environ.get(_ENV_TRACE_STARTUP):
+        print("[startup] {:8.1f} ms  {}".format(
+            (perf_counter() - _START) * 1000, stage), file=sys.stderr)
+
+
 class MainFrame(tk.Frame):
     master_title = "Service Interval"
     tooltip_delay = 0.5
     extension_imp_exp = ".txt"
     extensions_imp_exp = [("Text files", ".txt"),
                           ("All files", ".*")]
+    # Encodings of imported and exported text files: (menu label, name).
+    # Imported files with byte order mark are read in its encoding.
+    encodings_imp_exp = [("System default", ""),
+                         ("UTF-8", "utf-8"),
+                         ("UTF-8 with BOM", "utf-8-sig"),
+                         ("UTF-16", "utf-16"),
+                         ("Windows-1251 (Cyrillic)", "cp1251"),
+                         ("KOI8-R", "koi8-r")]
 
     def __init__(self, master=None, **options):
         super().__init__(master, **options)
@@ -47,20 +76,8 @@ class MainFrame(tk.Frame):
                            siu.VehicleLogBook.get_extension()),
                           ("All files", ".*")]
 
-        # Create images
-        #   Where I can find icons:
-        #   https://www.iconfinder.com/search/?q=exit&price=free
-        self.img_exit = tk.PhotoImage(file=os.path.join(_DIR_IMG, "exit.png"))
-        self.img_new = tk.PhotoImage(file=os.path.join(_DIR_IMG, "new.png"))
-        self.img_open = tk.PhotoImage(file=os.path.join(_DIR_IMG, "open.png"))
-        self.img_save = tk.PhotoImage(file=os.path.join(_DIR_IMG, "save.png"))
-        # self.img_print = tk.PhotoImage(file=os.path.join(_DIR_IMG, "print.png"))
-        self.img_add = tk.PhotoImage(file=os.path.join(_DIR_IMG, "add.png"))
-        self.img_edit = tk.PhotoImage(file=os.path.join(_DIR_IMG, "edit.png"))
-        self.img_delete = tk.PhotoImage(
-            file=os.path.join(_DIR_IMG, "delete.png"))
-        self.img_vehicle = tk.PhotoImage(
-            file=os.path.join(_DIR_IMG, "vehicle.png"))
+        # Images are decoded at first use (see get_image())
+        self._images = dict()
 
         # Setup master window
         # -------------------
@@ -95,6 +112,9 @@ class MainFrame(tk.Frame):
         menu_file.add_command(label="Save As...", command=self.log_save_as,
                               accelerator="Shift+Ctrl+S")  # hotkey
         self.bind_all("<Control-S>", self.log_save_as)
+        # File > Merge log book...
+        menu_file.add_command(label="Merge log book...",
+                              command=self.log_merge, underline=0)
         # File > Operations history SUB_MENU
         menu_log = tk.Menu(menu_file, tearoff=0)
         menu_file.add_separator()
@@ -132,6 +152,14 @@ class MainFrame(tk.Frame):
         # # File > Maintenance plan > Print...
         # menu_plan.add_command(label="Print...", command=self.print_plan,
         #                      underline=0)           # underline character
+        # File > Text encoding SUB_MENU
+        self.encoding = tk.StringVar(value="")
+        menu_encoding = tk.Menu(menu_file, tearoff=0)
+        menu_file.add_cascade(label='Text encoding',
+                              menu=menu_encoding, underline=0)
+        for label, name in self.encodings_imp_exp:
+            menu_encoding.add_radiobutton(label=label, value=name,
+                                          variable=self.encoding)
         # File > Exit
         menu_file.add_separator()
         menu_file.add_command(label="Exit", command=self.quit,
@@ -142,6 +170,15 @@ class MainFrame(tk.Frame):
         # Edit
         menu_edit = tk.Menu(self.menu, tearoff=0)
         self.menu.add_cascade(label="Edit", menu=menu_edit, underline=0)
+        # Edit > Undo
+        menu_edit.add_command(label="Undo", command=self.undo,
+                              underline=0, accelerator="Ctrl+Z")
+        self.bind_all("<Control-z>", self.undo)  # bind hotkey with action
+        # Edit > Redo
+        menu_edit.add_command(label="Redo", command=self.redo,
+                              underline=0, accelerator="Ctrl+Y")
+        self.bind_all("<Control-y>", self.redo)  # bind hotkey with action
+        menu_edit.add_separator()
         # Edit > Add operation
         menu_edit.add_command(label="Add operation",
                               command=self.operation_add,
@@ -162,35 +199,124 @@ class MainFrame(tk.Frame):
         # Help
         menu_help = tk.Menu(self.menu, tearoff=0)
         self.menu.add_cascade(label="Help", menu=menu_help, underline=0)
+        menu_help.add_command(label="Performance statistics...",
+                              command=self.dlg_stats,
+                              underline=0)           # underline character
+        menu_help.add_separator()
         menu_help.add_command(label="About", command=self.dlg_help,
                               underline=0)           # underline character
 
+        # Create tabs
+        # -----------
+        self.tabs = TabPanel(self.master)
+        # 1) Tab Operations Log
+        #     adding Frames as pages for the ttk.Notebook
+        #     first page, which would get widgets gridded into it
+        self.tab_log = ttk.Frame(self.tabs)
+        # collapse/expand all buttons,
+        # copy/paste/cut
+        # ToDo: context menu add/edit/remove/ + cut/copy/paste
+        # ... content
+        self.table_log = OperationsTable(parent=self.tab_log)
+        self.table_log.pack(expand=1, fill="both")
+        self.table_log.bind("<Double-1>", self.operation_edit)
+        # ... filter by words of labels and comments
+        frm_filter = tk.Frame(master=self.tab_log)
+        frm_filter.pack(side=tk.TOP, fill=tk.X, before=self.table_log.tree)
+        tk.Label(master=frm_filter, text="Find:").pack(side=tk.LEFT)
+        self.log_filter = tk.StringVar()
+        txt_filter = tk.Entry(master=frm_filter, textvariable=self.log_filter)
+        txt_filter.pack(side=tk.LEFT, expand=1, fill=tk.X)
+        txt_filter.bind("<KeyRelease>", self.log_filter_changed)
+        # 2) Tab Periodic Operations Catalogue
+        self.tab_cat = ttk.Frame(self.tabs)
+        # ... content
+        self.table_cat = PeriodicOperationsTable(parent=self.tab_cat)
+        self.table_cat.pack(expand=1, fill="both")
+        self.table_cat.bind("<Double-1>", self.operation_edit)
+        # 3) Tab Maintenance plan
+        self.tab_plan = ttk.Frame(self.tabs)
+        # ... content
+        # ToDo: Add haul panel and switcher to absolute / relative
+        self.table_plan = MaintenancePlanTable(parent=self.tab_plan)
+        self.table_plan.pack(expand=1, fill="both")
+        self.table_plan.bind('<Double-1>', lambda e: 'break')
+        # Push our tabs to tabs-widget
+        self.tabs.add(self.tab_log, text='Operations history')
+        self.tabs.add(self.tab_cat, text='Periodic operations catalogue')
+        self.tabs.add(self.tab_plan, text='Maintenance plan')
+        self.tabs.pack(expand=1, fill="both")
+        # Hidden tabs are filled when shown.
+        self.tabs.bind("<<NotebookTabChanged>>", self.tab_changed)
+
+        # Additional elements place here
+        # ------------------------------
+        # ...
+        # ToDo: status bar with tooltips
+
+        # Autosave of modified document to recovery file by worker thread.
+        try:
+            interval = float(os.environ.get(_ENV_AUTOSAVE,
+                                            _AUTOSAVE_INTERVAL))
+        except ValueError:
+            interval = _AUTOSAVE_INTERVAL
+        self.autosaver = siu.Autosaver(interval)
+        self._autosaved = None  # log book watched by autosaver
+        if interval > 0:
+            self.autosaver.start()
+
+        # Document
+        self._doc = None  # Create field for document
+        self.log_new()    # Initialize document
+
+        trace_startup("main frame created")
+        # Idle callbacks are called after the window has been drawn.
+        self.after_idle(trace_startup, "first paint")
+        self.after_idle(self._setup_toolbar)
+
+    def get_image(self, name):
+        """ Get toolbar image by icon name. Image decoded at first call.
+
+        Where I can find icons:
+        https://www.iconfinder.com/search/?q=exit&price=free
+        :param name: icon file name without extension (i.e. "exit")
+        :return:     <tk.PhotoImage> class instance
+        """
+        if name not in self._images:
+            self._images[name] = tk.PhotoImage(
+                file=os.path.join(_DIR_IMG, name + ".png"))
+        return self._images[name]
+
+    def _setup_toolbar(self):
         # Create toolbar
         # --------------
+        # It is created after the main window has been shown to reduce
+        # startup time: icons decoding and tooltips are not necessary
+        # for the first paint.
         self.toolbar = tk.Frame(self.master, bd=1, relief=tk.GROOVE)
         # New
-        self.btn_new = tk.Button(self.toolbar, image=self.img_new,
+        self.btn_new = tk.Button(self.toolbar, image=self.get_image("new"),
                                   relief=tk.FLAT,
                                   command=self.log_new)
         self.btn_new.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_new, msg="Create new vehicle log book",
                 follow=False, delay=self.tooltip_delay)
         # Open
-        self.btn_open = tk.Button(self.toolbar, image=self.img_open,
+        self.btn_open = tk.Button(self.toolbar, image=self.get_image("open"),
                                   relief=tk.FLAT,
                                   command=self.log_open)
         self.btn_open.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_open, msg="Open another log book",
                 follow=False, delay=self.tooltip_delay)
         # Save
-        self.btn_save = tk.Button(self.toolbar, image=self.img_save,
+        self.btn_save = tk.Button(self.toolbar, image=self.get_image("save"),
                                   relief=tk.FLAT,
                                   command=self.log_save)
         self.btn_save.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_save, msg="Save",
                 follow=False, delay=self.tooltip_delay)
         # # Print (active tab)
-        # self.btn_print = tk.Button(self.toolbar, image=self.img_print,
+        # self.btn_print = tk.Button(self.toolbar, image=self.get_image("print"),
         #                           relief=tk.FLAT,
         #                           command=self.print_active_tab)
         # self.btn_print.pack(side=tk.LEFT, padx=2, pady=2)
@@ -200,7 +326,7 @@ class MainFrame(tk.Frame):
         sep = ttk.Separator(self.toolbar, orient=tk.VERTICAL)
         sep.pack(side=tk.LEFT, padx=2, pady=2, fill="both")
         # Vehicle properties
-        self.btn_vehicle = tk.Button(self.toolbar, image=self.img_vehicle,
+        self.btn_vehicle = tk.Button(self.toolbar, image=self.get_image("vehicle"),
                                   relief=tk.FLAT,
                                   command=self.vehicle_setup)
         self.btn_vehicle.pack(side=tk.LEFT, padx=2, pady=2)
@@ -210,21 +336,21 @@ class MainFrame(tk.Frame):
         sep = ttk.Separator(self.toolbar, orient=tk.VERTICAL)
         sep.pack(side=tk.LEFT, padx=2, pady=2, fill="both")
         # Add operation
-        self.btn_add = tk.Button(self.toolbar, image=self.img_add,
+        self.btn_add = tk.Button(self.toolbar, image=self.get_image("add"),
                                   relief=tk.FLAT,
                                   command=self.operation_add)
         self.btn_add.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_add, msg="Add new operation",
                 follow=False, delay=self.tooltip_delay)
         # Edit operation
-        self.btn_edit = tk.Button(self.toolbar, image=self.img_edit,
+        self.btn_edit = tk.Button(self.toolbar, image=self.get_image("edit"),
                                   relief=tk.FLAT,
                                   command=self.operation_edit)
         self.btn_edit.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_edit, msg="Edit selected operation",
                 follow=False, delay=self.tooltip_delay)
         # Delete operation
-        self.btn_delete = tk.Button(self.toolbar, image=self.img_delete,
+        self.btn_delete = tk.Button(self.toolbar, image=self.get_image("delete"),
                                   relief=tk.FLAT,
                                   command=self.operation_delete)
         ToolTip(self.btn_delete, msg="Delete selected operation",
@@ -234,56 +360,15 @@ class MainFrame(tk.Frame):
         sep = ttk.Separator(self.toolbar, orient=tk.VERTICAL)
         sep.pack(side=tk.LEFT, padx=2, pady=2, fill="both")
         # Exit
-        self.btn_exit = tk.Button(self.toolbar, image=self.img_exit,
+        self.btn_exit = tk.Button(self.toolbar, image=self.get_image("exit"),
                                   relief=tk.FLAT,
                                   command=self.quit)
         self.btn_exit.pack(side=tk.LEFT, padx=2, pady=2)
         ToolTip(self.btn_exit, msg="Exit",
                 follow=False, delay=self.tooltip_delay)  # Add tooltip
         # Pack toolbar to master frame
-        self.toolbar.pack(side=tk.TOP, fill=tk.X)
-
-        # Create tabs
-        # -----------
-        self.tabs = TabPanel(self.master)
-        # 1) Tab Operations Log
-        #     adding Frames as pages for the ttk.Notebook
-        #     first page, which would get widgets gridded into it
-        self.tab_log = ttk.Frame(self.tabs)
-        # collapse/expand all buttons,
-        # copy/paste/cut
-        # ToDo: context menu add/edit/remove/ + cut/copy/paste
-        # ... content
-        self.table_log = OperationsTable(parent=self.tab_log)
-        self.table_log.pack(expand=1, fill="both")
-        self.table_log.bind("<Double-1>", self.operation_edit)
-        # 2) Tab Periodic Operations Catalogue
-        self.tab_cat = ttk.Frame(self.tabs)
-        # ... content
-        self.table_cat = PeriodicOperationsTable(parent=self.tab_cat)
-        self.table_cat.pack(expand=1, fill="both")
-        self.table_cat.bind("<Double-1>", self.operation_edit)
-        # 3) Tab Maintenance plan
-        self.tab_plan = ttk.Frame(self.tabs)
-        # ... content
-        # ToDo: Add haul panel and switcher to absolute / relative
-        self.table_plan = MaintenancePlanTable(parent=self.tab_plan)
-        self.table_plan.pack(expand=1, fill="both")
-        self.table_plan.bind('<Double-1>', lambda e: 'break')
-        # Push our tabs to tabs-widget
-        self.tabs.add(self.tab_log, text='Operations history')
-        self.tabs.add(self.tab_cat, text='Periodic operations catalogue')
-        self.tabs.add(self.tab_plan, text='Maintenance plan')
-        self.tabs.pack(expand=1, fill="both")
-
-        # Additional elements place here
-        # ------------------------------
-        # ...
-        # ToDo: status bar with tooltips
-
-        # Document
-        self._doc = None  # Create field for document
-        self.log_new()    # Initialize document
+        self.toolbar.pack(side=tk.TOP, fill=tk.X, before=self.tabs)
+        trace_startup("toolbar created")
 
     @property
     def doc(self):
@@ -294,6 +379,16 @@ class MainFrame(tk.Frame):
         self._doc = new_doc
         self.update_title()
 
+    def tab_changed(self, event=None):
+        # Fill table of selected tab if data has been changed while it hidden
+        if self.doc:
+            self.doc.tabs_update_stale()
+
+    def log_filter_changed(self, event=None):
+        # Show only operations with all typed words in the log table.
+        if self.doc:
+            self.doc.filter_log(self.log_filter.get())
+
     def update_title(self, event=None):
         # Update main window title
         status = "*" if self.doc.is_modified else ""
@@ -315,8 +410,36 @@ class MainFrame(tk.Frame):
                 self.log_save()
             elif ans == "cancel":
                 return False
+            else:
+                # Changes are discarded: recovery file isn't needed.
+                self.autosaver.discard(self.doc.log_book)
         return True
 
+    def _autosave_watch(self):
+        # Autosave current document only.
+        if self._autosaved is not None:
+            self.autosaver.unwatch(self._autosaved)
+        self._autosaved = self.doc.log_book
+        self.autosaver.watch(self._autosaved)
+
+    def _recover(self, filename):
+        # Offer to restore autosaved changes of opened document.
+        if not self.autosaver.has_recovery(filename):
+            return
+        ans = tk.messagebox.askquestion(
+            parent=self.master,
+            title="Question",
+            message=self.doc.label,
+            detail="Log book has unsaved changes kept by autosave. "
+                   "Do you want to restore them?",
+            icon="question",
+            type="yesno")
+        if ans == "yes":
+            self.doc.log_book = self.autosaver.recover(filename)
+            self.doc.tabs_update()
+        else:
+            self.autosaver.discard(self.doc.log_book)
+
     def log_new(self, event=None):
         if self.doc:
             # Creating new instead old
@@ -325,13 +448,16 @@ class MainFrame(tk.Frame):
             # Creating at first time
             not_cancelled = True  # anyway
         if not_cancelled:
+            self.log_filter.set("")
             self.doc = TkVehicleLogBook(
                 parent=self,
                 label="New Vehicle",
                 production_date=date.today(),
                 tab_log=self.table_log,
                 tab_cat=self.table_cat,
-                tab_plan=self.table_plan)
+                tab_plan=self.table_plan,
+                tabs=self.tabs)
+            self._autosave_watch()
 
     def log_open(self, event=None):
         not_cancelled = self.ask_save()
@@ -346,15 +472,41 @@ class MainFrame(tk.Frame):
             if not filename:
                 return
             try:
-                self.doc.load(filename)
+                try:
+                    self.doc.load(filename)
+                except siu.ChunkError:
+                    if not self._ask_recover(filename):
+                        return
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore")
+                        self.doc.load(filename, recover=True)
+                self._recover(filename)
+                self._autosave_watch()
                 self.update_title()
-            except OSError as err:
+            except (OSError, ValueError) as err:
                 tk.messagebox.showerror(
                     parent=self.master,
                     title="Error",
                     message="Error occurred while opening file\n" + filename,
                     detail=err)
 
+    def _ask_recover(self, filename):
+        # Offer to open the rest of corrupted log book. Return True if
+        # accepted.
+        with siu.LogBookReader(filename) as reader:
+            errors = reader.verify()
+        ans = tk.messagebox.askquestion(
+            parent=self.master,
+            title="Question",
+            message="File is corrupted\n" + filename,
+            detail="\n".join(str(err) for err in errors) +
+                   "\n\nDo you want to open the rest of log book? Records "
+                   "of corrupted chunks will be lost, so it can be saved "
+                   "to other file only.",
+            icon="warning",
+            type="yesno")
+        return ans == "yes"
+
     def log_save(self, event=None):
         if self.doc.filename:
             self.doc.save()
@@ -371,7 +523,42 @@ class MainFrame(tk.Frame):
             initialdir=os.path.dirname(self.doc.filename))
         if not filename:
             return
+        # Recovery file of the old file name isn't needed.
+        self.autosaver.discard(self.doc.log_book)
         self.doc.save(filename)
+        self._autosave_watch()
+
+    def log_merge(self, event=None):
+        filename = tk.filedialog.askopenfilename(
+            parent=self.master,
+            title="Merge vehicle log book",
+            defaultextension=self.doc.extension,
+            filetypes=self.filetypes,
+            initialdir=os.path.dirname(self.doc.filename))
+        if not filename:
+            return
+        try:
+            other = siu.VehicleLogBook.load(filename)
+        except (OSError, ValueError) as err:
+            tk.messagebox.showerror(
+                parent=self.master,
+                title="Error",
+                message="Error occurred while opening file\n" + filename,
+                detail=err)
+            return
+        stats = self.doc.merge(other)
+        if stats.duplicate or stats.conflicting:
+            tk.messagebox.showinfo(
+                parent=self.master,
+                title="Merge log book",
+                message="Merged operations: {}".format(stats),
+                detail="Operations that are already in log were skipped. "
+                       "Conflicting operations (the same label and haul, "
+                       "but other date or comment) were skipped too.")
+
+    def _text_encoding(self):
+        # Selected encoding of text files (None - system default).
+        return self.encoding.get() or None
 
     def import_log(self, event=None):
         filename = tk.filedialog.askopenfilename(
@@ -387,7 +574,15 @@ class MainFrame(tk.Frame):
         ext = os.path.splitext(filename)[-1]
         if not ext or ext != self.extension_imp_exp:
             filename += self.extension_imp_exp
-        self.doc.import_log(filename)
+        stats = self.doc.import_log(filename, encoding=self._text_encoding())
+        if stats.duplicate or stats.conflicting:
+            tk.messagebox.showinfo(
+                parent=self.master,
+                title="Import operations log",
+                message="Imported operations: {}".format(stats),
+                detail="Operations that are already in log were skipped. "
+                       "Conflicting operations (the same label and haul, "
+                       "but other date or comment) were skipped too.")
 
     def import_cat(self, event=None):
         filename = tk.filedialog.askopenfilename(
@@ -403,7 +598,7 @@ class MainFrame(tk.Frame):
         ext = os.path.splitext(filename)[-1]
         if not ext or ext != self.extension_imp_exp:
             filename += self.extension_imp_exp
-        self.doc.import_cat(filename)
+        self.doc.import_cat(filename, encoding=self._text_encoding())
 
     def export_log(self, event=None):
         filename = tk.filedialog.asksaveasfilename(
@@ -419,7 +614,7 @@ class MainFrame(tk.Frame):
         ext = os.path.splitext(filename)[-1]
         if not ext or ext != self.extension_imp_exp:
             filename += self.extension_imp_exp
-        self.doc.export_log(filename)
+        self.doc.export_log(filename, encoding=self._text_encoding())
 
     def export_cat(self, event=None):
         filename = tk.filedialog.asksaveasfilename(
@@ -435,7 +630,7 @@ class MainFrame(tk.Frame):
         ext = os.path.splitext(filename)[-1]
         if not ext or ext != self.extension_imp_exp:
             filename += self.extension_imp_exp
-        self.doc.export_cat(filename)
+        self.doc.export_cat(filename, encoding=self._text_encoding())
 
     def export_plan(self, event=None):
         filename = tk.filedialog.asksaveasfilename(
@@ -451,7 +646,7 @@ class MainFrame(tk.Frame):
         ext = os.path.splitext(filename)[-1]
         if not ext or ext != self.extension_imp_exp:
             filename += self.extension_imp_exp
-        self.doc.export_plan(filename)
+        self.doc.export_plan(filename, encoding=self._text_encoding())
 
     # def print_log(self, event=None):
     #     print('print_log')
@@ -468,12 +663,34 @@ class MainFrame(tk.Frame):
     def quit(self, event=None):
         not_cancelled = self.ask_save()
         if not_cancelled:
+            self.autosaver.stop()
+            # Remove recovery file of saved document.
+            self.autosaver.save_pending()
             self.master.quit()
 
     def vehicle_setup(self, event=None):
         VehicleSetupWindow(master=self, vehicle=self.doc)
         self.update_title()
 
+    def undo(self, event=None):
+        # Hotkeys of dialog windows are left to them.
+        if event is not None \
+                and event.widget.winfo_toplevel() is not self.master:
+            return
+        if self.doc.undo() is None:
+            self.bell()
+        self.update_title()
+        return "break"
+
+    def redo(self, event=None):
+        if event is not None \
+                and event.widget.winfo_toplevel() is not self.master:
+            return
+        if self.doc.redo() is None:
+            self.bell()
+        self.update_title()
+        return "break"
+
     def operation_add(self, event=None):
         AddOperationWindow(master=self, vehicle=self.doc)
 
@@ -578,6 +795,9 @@ class MainFrame(tk.Frame):
             "Author:\tDon Dmitriy Sergeevich\n\n"
             "Send your feedback to dondmitriys@gmail.com")
 
+    def dlg_stats(self):
+        StatsWindow(master=self.master)
+
     def _center(self):
         # Center window at the screen
         self.update_idletasks()
@@ -719,6 +939,92 @@ class VehicleSetupWindow(tk.Toplevel):
             self.destroy()
 
 
+class StatsWindow(tk.Toplevel):
+    """ Window with call statistics of log book methods (for debugging).
+    """
+    headers = ["Method", "Calls", "Total, ms", "Max, ms", "Mean, ms",
+               "Records"]
+
+    def __init__(self, master=None, **options):
+        super().__init__(master, **options)
+        self.title("Performance statistics")
+        self.minsize(width=640, height=300)
+
+        # Checkboxes: collect statistics / profile
+        self.is_enabled = tk.IntVar()
+        self.is_enabled.set(siu.STATS.enabled)
+        self.is_profiled = tk.IntVar()
+        self.is_profiled.set(siu.STATS.profiler is not None)
+        frm_chk = tk.Frame(master=self, bd=10)
+        frm_chk.pack(side=tk.TOP, fill=tk.X)
+        tk.Checkbutton(master=frm_chk,
+                       text="Collect statistics",
+                       variable=self.is_enabled,
+                       command=self.switch).pack(side=tk.LEFT)
+        tk.Checkbutton(master=frm_chk,
+                       text="Profile with cProfile",
+                       variable=self.is_profiled,
+                       command=self.switch).pack(side=tk.LEFT)
+
+        # Buttons
+        frm_btns = tk.Frame(master=self, bd=10)
+        frm_btns.pack(side=tk.BOTTOM)
+        for text, command in (("Refresh", self.refresh),
+                              ("Reset", self.reset),
+                              ("Save profile...", self.save_profile),
+                              ("Close", self.destroy)):
+            tk.Button(master=frm_btns, text=text, command=command,
+                      height=1, width=12).pack(side=tk.LEFT)
+        self.bind("<Escape>", lambda event: self.destroy())
+
+        # Statistics table
+        self.table = Table(headers=self.headers,
+                           parent=self,
+                           widths=(None, 60, 80, 80, 80, 80),
+                           stretch=(1, 0, 0, 0, 0, 0),
+                           show_tree=False)
+        self.table.pack(expand=1, fill="both")
+        self.refresh()
+
+    def switch(self):
+        # Enable/disable statistics collecting and profiling
+        if not self.is_profiled.get():
+            siu.STATS.profiler = None
+        if self.is_enabled.get():
+            siu.STATS.enable(profile=bool(self.is_profiled.get()))
+        else:
+            siu.STATS.disable()
+
+    def refresh(self):
+        self.table.clear()
+        for name, st in sorted(siu.stats().items()):
+            self.table.insert((name, st["calls"],
+                               round(st["total"] * 1000, 2),
+                               round(st["max"] * 1000, 2),
+                               round(st["mean"] * 1000, 3),
+                               st["items"]))
+
+    def reset(self):
+        siu.reset_stats()
+        self.refresh()
+
+    def save_profile(self):
+        if siu.STATS.profiler is None:
+            tk.messagebox.showwarning(
+                parent=self,
+                title="Save profile",
+                message="Profiling is not enabled.",
+                detail="Check <Profile with cProfile> and retry.")
+            return
+        filename = tk.filedialog.asksaveasfilename(
+            parent=self,
+            title="Save profile",
+            defaultextension=".prof",
+            filetypes=[("Profile files", ".prof"), ("All files", ".*")])
+        if filename:
+            siu.STATS.dump_profile(filename)
+
+
 def num_validate(insert_char):
     # only numbers and . , allowed
     allowed = "0123456789.,"
@@ -904,6 +1210,8 @@ class Table(object):
         self._col_widths = widths if widths else tuple_none
         self._col_is_stretch = stretch if stretch else tuple_none
         self._show_tree = show_tree
+        # Sort key names of columns (see siu.SORT_KEYS). None - unsortable.
+        self.sort_keys = tuple_none
         self.tree = None
         # Create GUI widget and setup columns
         self._setup_widgets(parent)
@@ -974,6 +1282,26 @@ class Table(object):
         for i in self.tree.get_children():
             self.tree.delete(i)
 
+    def set_sort_command(self, command):
+        """ Make columns sortable by click on heading.
+
+        :param command:  function(table, key) called with sort key name of
+                         clicked column (see sort_keys)
+        """
+        for name, key in zip(self._col_names, self.sort_keys):
+            if key:
+                self.tree.heading(
+                    name, command=lambda key=key: command(self, key))
+
+    def show_sort(self, keys):
+        # Mark heading of the column sorted by the first of keys.
+        key = keys[0] if keys else ""
+        for name, header, col_key in zip(self._col_names, self._col_headers,
+                                         self.sort_keys):
+            if col_key and key.lstrip("-") == col_key:
+                header += " \u25bc" if key.startswith("-") else " \u25b2"
+            self.tree.heading(name, text=header)
+
 
 class OperationsTable(Table):
     """ Operations table widget.
@@ -984,8 +1312,9 @@ class OperationsTable(Table):
                          widths=(100, 100, None),
                          stretch=(0, 0, 1),
                          show_tree=True)
+        self.sort_keys = ("date", "km", "label")
 
-    def insert(self, operation):
+    def insert(self, operation, item_id=None):
         # Check type
         if not isinstance(operation, siu.Operation):
             raise TypeError(
@@ -996,7 +1325,7 @@ class OperationsTable(Table):
             raise ValueError("Operation must be done for this widget."
                              "Use Operation.done() method before.")
         item = (operation.done_at_date, operation.done_at_km, operation.label)
-        iid = super().insert(item)
+        iid = super().insert(item, item_id=item_id)
         super().insert(parent=iid,
                        values=("", "", operation.comment))
 
@@ -1018,6 +1347,7 @@ class PeriodicOperationsTable(Table):
                          widths=(100, 100, None),
                          stretch=(0, 0, 1),
                          show_tree=False)
+        self.sort_keys = ("interval_time", "interval_km", "label")
 
     def insert(self, operation):
         # Check type
@@ -1048,6 +1378,7 @@ class MaintenancePlanTable(Table):
                          widths=(100, 100, None),
                          stretch=(0, 0, 1),
                          show_tree=False)
+        self.sort_keys = ("date", "km", "label")
 
     def insert(self, operation):
         # Check type
@@ -1090,6 +1421,8 @@ class AddOperationWindow(tk.Toplevel):
     new_op_label = "New operation"
     title_edit = "Edit operation"
     title_new = "Add new operation"
+    # Max number of labels in drop-down list of operation labels
+    max_labels = 100
 
     def __init__(self, vehicle, master=None, operation=None, **options):
 
@@ -1121,13 +1454,13 @@ class AddOperationWindow(tk.Toplevel):
         # --------
         # else:
         # mode_new
-        # First position allow to enter new operation label
-        self.op_list = self.vehicle.get_all_oper_labels()
-        if self.new_op_label in self.op_list:
-            # delete current operation label...
-            self.op_list.remove(self.new_op_label)
-        # ...and insert it first
-        self.op_list.insert(0, self.new_op_label)
+        # First position allow to enter new operation label.
+        # List is filtered by typed text (see label_typed()).
+        self.op_list = self.make_op_list("", self.new_op_label)
+        # Typed text and labels found for it: used to filter list while
+        # typing without new search.
+        self._typed = ""
+        self._typed_labels = None
         # --------
         # end {if self.mode_edit: ... else: ...}
 
@@ -1178,6 +1511,7 @@ class AddOperationWindow(tk.Toplevel):
             master=frm_lbl,
             textvariable=self.op_label)
         self.cmb_label.bind('<Return>', self.cmb_changed)
+        self.cmb_label.bind('<KeyRelease>', self.label_typed)
         self.cmb_label.bind("<<ComboboxSelected>>", self.label_selected)
         self.cmb_label['values'] = self.op_list
         self.cmb_label.pack(side=tk.TOP, fill=tk.X)
@@ -1324,22 +1658,52 @@ class AddOperationWindow(tk.Toplevel):
         Called when user edited operation label
         """
         new_label = self.op_label.get()
-        if new_label in self.op_list:
+        if self.vehicle.has_oper_label(new_label):
             # If label already exist - user select exist label
             # from list of combobutton
             self.label_selected()
         # Update labels list
-        self.op_list = self.vehicle.get_all_oper_labels()
-        self.op_list = list(self.op_list)
-        if self.new_op_label in self.op_list:
-            # delete current operation label...
-            self.op_list.remove(self.new_op_label)
-        # ...and insert it first
-        self.op_list.insert(0, new_label)
+        self.op_list = self.make_op_list("", new_label)
         # Update combobox list
         self.cmb_label['values'] = self.op_list
         # print("cmb_changed" + self.op_label.get())
 
+    def make_op_list(self, prefix, first):
+        """ Make list of labels for combobox.
+
+        :param prefix:  find labels started with prefix (case-insensitive)
+        :param first:   label to place first
+        :return:        list of strings
+        """
+        op_list = self.vehicle.find_oper_labels(prefix, self.max_labels)
+        if first in op_list:
+            # delete current operation label...
+            op_list.remove(first)
+        # ...and insert it first
+        op_list.insert(0, first)
+        return op_list
+
+    def label_typed(self, event=None):
+        """ Filter labels list by typed text.
+        Called on every key release in combobox.
+        """
+        text = self.op_label.get()
+        if text == self._typed:
+            return
+        labels = self._typed_labels
+        if labels is not None and len(labels) < self.max_labels \
+                and text.casefold().startswith(self._typed.casefold()):
+            # All labels started with the previous text have been found.
+            # Filter them instead of new search.
+            prefix = text.casefold()
+            labels = [x for x in labels if x.casefold().startswith(prefix)]
+        else:
+            labels = self.vehicle.find_oper_labels(text, self.max_labels)
+        self._typed = text
+        self._typed_labels = labels
+        self.op_list = [self.new_op_label] + labels
+        self.cmb_label['values'] = self.op_list
+
     def btn_ok(self, event=None):
         """Add new or edit exist operation for vehicle
         """
@@ -1372,36 +1736,48 @@ class AddOperationWindow(tk.Toplevel):
                 "Argument testmode must be <bool>, not " + str(type(testmode)))
         # Verify GUI fields by trying to use it
         try:
-            # keep old label to reAdd operations to catalogue if it is periodic
-            old_label = operation.label
-            operation.label = self.op_label.get()
+            label = self.op_label.get()
+            interval_km = None
+            interval_time = None
             if self.is_periodic.get():
-                operation.interval_time = \
+                interval_time = \
                     timedelta(days=365 * float(self.period_year.get()))
-                operation.interval_km = float(self.period_km.get())
-                if float(self.period_km.get()) == 0:
+                interval_km = float(self.period_km.get())
+                if interval_km == 0:
                     raise ValueError(
                         "For periodic operation interval (km) must be non-zero")
 
+            done_km = None
+            done_date = None
+            done_comment = None
             if self.is_done.get():
                 done_km = float(self.done_km.get())
                 done_date = self.done_date.get()
                 done_date = done_date.replace('.', '-')
                 done_date = datetime.strptime(done_date, '%Y-%m-%d').date()
                 done_comment = self.txt_cmt.get("1.0", tk.END + "-1c")
-                if self.mode_edit:
-                    self.operation._is_done = True
-                    self.operation.done_at_km = done_km
-                    self.operation.done_at_date = done_date
-                    self.operation.comment = done_comment
-                else:
-                    self.operation = self.operation.done(done_km,
-                                                         done_date,
-                                                         done_comment)
 
             if not self.is_done.get() and not self.is_periodic.get():
                 raise ValueError("Unable to create operation that is not "
                                  "periodic and have never been done.")
+            if self.mode_edit and not testmode:
+                # Change operation through log book, so it can be undone.
+                # Operations with the same label in log are renamed too.
+                self.vehicle.edit_operation(
+                    operation, label=label,
+                    interval_km=interval_km, interval_time=interval_time,
+                    km=done_km, at_date=done_date, comment=done_comment)
+                return True
+            # keep old label to reAdd operations to catalogue if it is periodic
+            old_label = operation.label
+            operation.label = label
+            if interval_km is not None:
+                operation.interval_time = interval_time
+                operation.interval_km = interval_km
+            if done_km is not None:
+                done = operation.done(done_km, done_date, done_comment)
+                if not testmode:
+                    self.operation = done
             if not testmode:
                 # reAdd periodic operation to catalogue with new label
                 # and rename old operations in log with label same as old label
@@ -1462,14 +1838,37 @@ class TkVehicleLogBook(object):
     """ Represents storage of service operations .
     Wrapper for VehicleLogBook that can be used in Tk-GUI.
     It linked with tkinter Table widgets based on TreeView.
+
+    If <TabPanel> with the tables is specified, only table in the selected
+    tab is filled on update. Other tables are filled by tabs_update_stale()
+    when their tab is selected.
     """
+    # Max number of sort keys of table.
+    max_sort_keys = 3
+
     def __init__(self, tab_log, tab_cat, tab_plan,
-                 *args, parent=None, **kwargs):
+                 *args, parent=None, tabs=None, **kwargs):
         super().__init__()
         self.parent = parent
         self.tab_log = tab_log
         self.tab_cat = tab_cat
         self.tab_plan = tab_plan
+        self.tabs = tabs
+        # Tables that must be filled again when they will be shown.
+        self._stale = set()
+        # Log table shows operations found by this text only
+        # (see VehicleLogBook.search_log()). Empty - show all.
+        self._log_filter = ""
+        # Indexes of operations in log shown in log table.
+        self._log_shown = set()
+        # Sort keys of tables (see VehicleLogBook.sort_log()).
+        # Click on column heading makes its key the first one.
+        self._sort = {tab_log: ("km",),
+                      tab_cat: ("interval_km",),
+                      tab_plan: ("km",)}
+        for table, keys in self._sort.items():
+            table.set_sort_command(self.sort_table)
+            table.show_sort(keys)
         self.log_book = siu.VehicleLogBook(*args, **kwargs)
         self.tabs_update()
 
@@ -1495,12 +1894,40 @@ class TkVehicleLogBook(object):
     def make_maintenance_plan(self, *args, **kwargs):
         return self.log_book.make_maintenance_plan(*args, **kwargs)
 
-    def get_all_oper_labels(self):
-        return self.log_book.get_all_oper_labels()
+    def get_all_oper_labels(self, *args, **kwargs):
+        return self.log_book.get_all_oper_labels(*args, **kwargs)
+
+    def find_oper_labels(self, *args, **kwargs):
+        return self.log_book.find_oper_labels(*args, **kwargs)
+
+    def has_oper_label(self, *args, **kwargs):
+        return self.log_book.has_oper_label(*args, **kwargs)
 
     def get_periodic(self, *args, **kwargs):
         return self.log_book.get_periodic(*args, **kwargs)
 
+    def edit_operation(self, *args, **kwargs):
+        self.log_book.edit_operation(*args, **kwargs)
+        self.tabs_update()
+
+    def undo(self):
+        name = self.log_book.undo()
+        self.tabs_update()
+        return name
+
+    def redo(self):
+        name = self.log_book.redo()
+        self.tabs_update()
+        return name
+
+    @property
+    def can_undo(self):
+        return self.log_book.can_undo
+
+    @property
+    def can_redo(self):
+        return self.log_book.can_redo
+
     def get_ops_by_selection(self, tree):
         """ Get operations by selection in table widget, based on treeview
         :param tree: Tree widget based on ttk.Treeview
@@ -1522,17 +1949,16 @@ class TkVehicleLogBook(object):
 
         for item_id in item_ids:
             if tree == self.tab_log.tree:
-                # Selection by index of item selected in tab_log
-                index = tree.index(item_id)
+                # Top items ids are indexes of operations in log.
                 # Check is item in the top list
                 # if item has no parent - it is placed in the top
                 parent_id = tree.parent(item_id)
                 if parent_id:
                     # if item has parent, get parent index
-                    index = tree.index(parent_id)
+                    item_id = parent_id
                 if len(self.log_book.operations_log) == 0:
                     raise ValueError("Nothing to select")
-                operations.append(self.log_book.operations_log[index])
+                operations.append(self.log_book.operations_log[int(item_id)])
             elif tree == self.tab_cat.tree:
                 # selection by label of selected item in tab_cat
                 values = tree.item(item_id, option="values")
@@ -1552,6 +1978,74 @@ class TkVehicleLogBook(object):
                     "Unknown ttk.Treeview widget in argument tree.")
         return operations
 
+    def sort_table(self, table, key):
+        """ Sort table by column. Called by click on column heading.
+        Click on the column of the first sort key reverses the order.
+
+        :param table:  one of tab_log, tab_cat, tab_plan
+        :param key:    sort key name of the column
+        """
+        keys = self._sort[table]
+        if keys[0] == key:
+            key = "-" + key
+        # Previous keys are kept to sort items with equal first key.
+        keys = (key,) + tuple(x for x in keys
+                              if x.lstrip("-") != key.lstrip("-"))
+        keys = self._sort[table] = keys[:self.max_sort_keys]
+        table.show_sort(keys)
+        if table is self.tab_log:
+            if table not in self._stale and self._is_shown(table):
+                # Items ids are indexes of operations in log: move items
+                # instead of creating them again.
+                table.tree.set_children("", *map(str, self._log_order()))
+            else:
+                self.tab_log_update()
+        elif table is self.tab_cat:
+            self.tab_cat_update()
+        else:
+            self.tab_plan_update()
+
+    def filter_log(self, text):
+        """ Show only operations found by text in log table.
+
+        :param text:  words of labels and comments (the last word may be
+                      incomplete). Empty string - show all operations.
+        """
+        text = text.strip()
+        if text == self._log_filter:
+            return
+        self._log_filter = text
+        stale = self.tab_log in self._stale
+        if not self._is_shown(self.tab_log):
+            return
+        order = self._log_order()
+        if not stale and self._log_shown.issuperset(order):
+            # Query is narrowed (i.e. next letter is typed): remove items
+            # not found, others are in the same order.
+            hidden = self._log_shown.difference(order)
+            if hidden:
+                self.tab_log.tree.delete(*map(str, hidden))
+            self._log_shown = set(order)
+        else:
+            self._tab_log_fill(order)
+
+    def _log_order(self):
+        # Indexes of operations in log shown in table: sorted and filtered.
+        keys = self._sort[self.tab_log]
+        if not self._log_filter:
+            return self.log_book.sort_log(*keys)
+        return self.log_book.sort_log(*keys, query=self._log_filter)
+
+    def _tab_log_fill(self, order=None):
+        # Remove all items from table and add all shown items again
+        if order is None:
+            order = self._log_order()
+        self.tab_log.clear()
+        log = self.log_book.operations_log
+        for ind in order:
+            self.tab_log.insert(log[ind], item_id=str(ind))
+        self._log_shown = set(order)
+
     def event_generate_update(self):
         if self.parent:
             self.parent.event_generate(
@@ -1562,33 +2056,53 @@ class TkVehicleLogBook(object):
         self.tab_cat_update()
         self.tab_plan_update()
 
+    def tabs_update_stale(self):
+        # Fill shown table if it has been changed while hidden.
+        if self.tab_log in self._stale:
+            self.tab_log_update()
+        if self.tab_cat in self._stale:
+            self.tab_cat_update()
+        if self.tab_plan in self._stale:
+            self.tab_plan_update()
+
+    def _is_shown(self, table):
+        """ Check is table placed in selected tab.
+        If it is hidden - mark it to update it later.
+        """
+        if self.tabs is None or self.tabs.get_active_tab() is table.tree.master:
+            self._stale.discard(table)
+            return True
+        self._stale.add(table)
+        return False
+
     def tab_log_update(self):
-        # Remove all items from table and add all items again
-        self.tab_log.clear()
-        for op in self.log_book.operations_log:
-            self.tab_log.insert(op)
-            if op.is_periodic and op.label not in self.log_book.operations_cat:
-                # check if operation became periodic
-                self.add_operation_to_cat(op)
+        # View only: catalogue is kept by log book (periodic operations are
+        # added to it by add_operation_to_log() and edit_operation()).
+        if self._is_shown(self.tab_log):
+            self._tab_log_fill()
         self.event_generate_update()
 
     def tab_cat_update(self):
+        if not self._is_shown(self.tab_cat):
+            self.event_generate_update()
+            return
         # Remove all items from table and add all items again
         self.tab_cat.clear()
-        ops = list()
-        for op in self.log_book.operations_cat.values():
-            ops.append(op)
-        ops.sort(key=lambda x: x.interval_km)
-        for op in ops:
+        for op in self.log_book.sort_cat(*self._sort[self.tab_cat]):
             self.tab_cat.insert(op)
         self.event_generate_update()
 
     def tab_plan_update(self):
+        if not self._is_shown(self.tab_plan):
+            self.event_generate_update()
+            return
         # Remove all items from table and add all items again
         self.tab_plan.clear()
         plan = self.log_book.make_maintenance_plan()
-        for op in plan:
-            self.tab_plan.insert(op)
+        # Plan is made again every time: sort it without cache.
+        perm = siu.SortCache().permutation(plan, self._sort[self.tab_plan])
+        for ind in perm:
+            self.tab_plan.insert(plan[ind])
         self.event_generate_update()
 
     def add_operation_to_log(self, *args, **kwargs):
@@ -1612,8 +2126,14 @@ class TkVehicleLogBook(object):
         self.tabs_update()
 
     def import_log(self, *args, **kwargs):
-        self.log_book.import_log(*args, **kwargs)
+        stats = self.log_book.import_log(*args, **kwargs)
+        self.tabs_update()
+        return stats
+
+    def merge(self, *args, **kwargs):
+        stats = self.log_book.merge(*args, **kwargs)
         self.tabs_update()
+        return stats
 
     def import_cat(self, *args, **kwargs):
         self.log_book.import_cat(*args, **kwargs)